@@ -0,0 +1,375 @@
+import csv
+import heapq
+import os
+import pickle
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from normalization import (
+    EXPECTED_COLUMNS, REQUIRED_FIELDS, CHUNK_SIZE, check_valid_columns, normalize_chunk, open_txid_index, txid_index_path, add_txids,
+    utc_date, write_trades_normalized,
+)
+from profiling import count, stage
+
+# --- Lines at the top of an export that are searched for the header row
+HEADER_SEARCH_LINES = 20
+# --- Sorted runs that are merged at the same time, more are merged in steps first
+MAX_OPEN_RUNS = 64
+
+class FormatAdapter:
+    """
+    Maps the rows of one broker/ exchange export to the input layout (EXPECTED_COLUMNS), so
+    they go through the same validation and normalization as my_trades.csv.
+    """
+
+    def __init__(self, name: str, columns: dict[str, str], date_format: str | None = None, types: dict[str, str] | None = None,
+                 skip_types: list[str] | None = None, defaults: dict[str, str] | None = None):
+        """
+        Args:
+            name (str): The name of the format, e.g. "exchange_x".
+            columns (dict[str, str]): Per input column (e.g. "Quantity") the export's column name.
+            date_format (str | None): The strptime format of the export's dates, None for ISO dates.
+            types (dict[str, str] | None): The export's trade types mapped to "buy"/ "sell".
+            skip_types (list[str] | None): Trade types of the export that are not trades (e.g. deposits).
+            defaults (dict[str, str] | None): Values for input columns the export does not have.
+        """
+        self.name = name
+        self.columns = columns
+        self.date_format = date_format
+        self.types = {k.strip().lower(): v for k, v in (types or {}).items()}
+        self.skip_types = {t.strip().lower() for t in skip_types or []}
+        self.defaults = defaults or {}
+
+    @classmethod
+    def from_config(cls, name: str, spec: dict) -> "FormatAdapter":
+        """
+        Builds an adapter from its BROKER_FORMATS entry in the config.
+        Args:
+            name (str): The name of the format.
+            spec (dict): The entry with "columns" and the optional "date_format", "types", "skip_types" and "defaults".
+        Returns:
+            FormatAdapter: The adapter.
+        """
+        return cls(name, spec["columns"], spec.get("date_format"), spec.get("types"), spec.get("skip_types"), spec.get("defaults"))
+
+    def matches(self, header: list[str]) -> bool:
+        """
+        Checks if a header row is this format's, the columns mapped to required fields have to be there.
+        Args:
+            header (list[str]): The column names of the export.
+        Returns:
+            bool: True if the adapter can read the export.
+        """
+        names = {h.strip() for h in header}
+        return all(self.columns.get(column) in names for column in REQUIRED_FIELDS)
+
+    def to_raw_trade(self, row: dict) -> dict | None:
+        """
+        Maps one export row to a raw trade in the input layout.
+        Args:
+            row (dict): The export row (keyed by the export's column names).
+        Returns:
+            dict | None: The raw trade, None for a row of a skipped type.
+        """
+        t = {column: self.defaults.get(column, "") for column in EXPECTED_COLUMNS}
+        for column, source in self.columns.items():
+            if row.get(source) is not None:
+                t[column] = row[source].strip()
+        # a row with too many fields is reported by the validation
+        if None in row:
+            t[None] = row[None]
+        trade_type = t["Type"].lower()
+        if trade_type in self.skip_types:
+            return None
+        t["Type"] = self.types.get(trade_type, t["Type"])
+        if self.date_format and t["Date"]:
+            try:
+                t["Date"] = str(datetime.strptime(t["Date"], self.date_format))
+            except ValueError:
+                pass  # left as is, validation reports it
+        return t
+
+class SortedRun:
+    """
+    A date sorted run of raw trades, kept in a temporary file in chunks. Only one chunk per run
+    is in memory while the runs are merged, and the file is only open while it is written or read.
+    """
+
+    def __init__(self, run_dir: str):
+        """
+        Args:
+            run_dir (str): The folder for the temporary file (removed by the caller).
+        """
+        fd, self.path = tempfile.mkstemp(suffix=".run", dir=run_dir)
+        os.close(fd)
+        self.last_key = None
+
+    def append(self, trades: list[dict]) -> None:
+        """
+        Adds date sorted trades to the end of the run (dated on or after its last trade).
+        Args:
+            trades (list[dict]): The raw trades.
+        """
+        if not trades:
+            return
+        with open(self.path, "ab") as f:
+            pickle.dump(trades, f, pickle.HIGHEST_PROTOCOL)
+        self.last_key = merge_key(trades[-1])
+
+    def extend(self, trades: Iterable[dict]) -> None:
+        """
+        Adds a date sorted stream of trades to the run, CHUNK_SIZE trades at a time.
+        Args:
+            trades (Iterable[dict]): The raw trades.
+        """
+        chunk = []
+        for t in trades:
+            chunk.append(t)
+            if len(chunk) == CHUNK_SIZE:
+                self.append(chunk)
+                chunk = []
+        self.append(chunk)
+
+    def __iter__(self) -> Iterator[dict]:
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    return
+                yield from chunk
+
+    def remove(self) -> None:
+        """
+        Deletes the temporary file.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# --- The layout of my_trades.csv
+NATIVE = FormatAdapter("native", {column: column for column in EXPECTED_COLUMNS})
+
+# --- Helper Functions Start
+def load_adapters(formats: dict | None) -> list[FormatAdapter]:
+    """
+    Builds the adapters of the BROKER_FORMATS config entry, after the native layout.
+    Args:
+        formats (dict | None): Per format name its spec (see FormatAdapter.from_config).
+    Returns:
+        list[FormatAdapter]: The adapters, in the order they are tried.
+    """
+    return [NATIVE] + [FormatAdapter.from_config(name, spec) for name, spec in (formats or {}).items()]
+
+def detect_format(lines: list[str], adapters: list[FormatAdapter]) -> tuple[FormatAdapter, int]:
+    """
+    Finds the header row of an export (exports can start with a few lines of other text)
+    and the adapter that reads it.
+    Args:
+        lines (list[str]): The lines of the export.
+        adapters (list[FormatAdapter]): The adapters to try, the first that matches is used.
+    Returns:
+        tuple[FormatAdapter, int]: The adapter and the index of the header line.
+    """
+    for index, fields in enumerate(csv.reader(lines[:HEADER_SEARCH_LINES])):
+        for adapter in adapters:
+            if fields and adapter.matches(fields):
+                return adapter, index
+    raise ValueError(f"No known format found, add one to BROKER_FORMATS in the config (tried: {', '.join(a.name for a in adapters)})")
+
+def is_native_file(file_path: str) -> bool:
+    """
+    Checks if a file is in the layout of my_trades.csv (header in the first line), so it can go
+    through run_normalization directly.
+    Args:
+        file_path (str): The path to the input CSV.
+    Returns:
+        bool: True if the first line is a native header.
+    """
+    with open(file_path, "r", newline="") as f:
+        header = next(csv.reader([f.readline()]), [])
+    return NATIVE.matches(header)
+
+def read_export_chunks(f, adapter: FormatAdapter, first_line: int) -> Iterator[tuple[int, list[dict]]]:
+    """
+    Maps the rows of an export to raw trades in chunks of at most CHUNK_SIZE consecutive rows.
+    A skipped row ends a chunk, so the rows of a chunk are on consecutive lines.
+    Args:
+        f: The export file, positioned after its header line.
+        adapter (FormatAdapter): The adapter of the export.
+        first_line (int): The line number of the first row.
+    Returns:
+        Iterator[tuple[int, list[dict]]]: The line number of the first row and the raw trades of each chunk.
+    """
+    chunk = []
+    start_line = first_line
+    for line, row in enumerate(csv.DictReader(f), start=first_line):
+        t = adapter.to_raw_trade(row)
+        if t is not None:
+            chunk.append(t)
+        if t is None or len(chunk) == CHUNK_SIZE:
+            if chunk:
+                yield start_line, chunk
+            chunk = []
+            start_line = line + 1
+    if chunk:
+        yield start_line, chunk
+
+def read_export(file_path: str, adapters: list[FormatAdapter], run_dir: str) -> tuple[list[SortedRun], list[str]]:
+    """
+    Reads one export in chunks, maps it to raw trades and validates them. Each CHUNK_SIZE
+    trades are sorted and added to a sorted run, a new run only starts where the export goes
+    back in time, so memory use depends on the chunk size and not on the size of the export.
+    Args:
+        file_path (str): The path to the export CSV.
+        adapters (list[FormatAdapter]): The adapters to detect the format with.
+        run_dir (str): The folder for the temporary files of the runs.
+    Returns:
+        tuple[list[SortedRun], list[str]]: The date sorted runs of raw trades and the errors found (with the file name).
+    """
+    runs = []
+    errors = []
+    rows = 0
+    with open(file_path, "r", newline="") as f:
+        head = [f.readline() for _ in range(HEADER_SEARCH_LINES)]
+        try:
+            adapter, header_index = detect_format(head, adapters)
+        except ValueError as e:
+            return [], [f"{file_path}: {e}"]
+        f.seek(0)
+        for _ in range(header_index):
+            f.readline()
+
+        buffer = []
+        # line 1 is the first line of the file, the header is at header_index + 1
+        for start_line, chunk in read_export_chunks(f, adapter, header_index + 2):
+            errors.extend(f"{file_path}: {error}" for error in check_valid_columns(chunk, start_line))
+            rows += len(chunk)
+            if errors:
+                continue
+            buffer.extend(chunk)
+            if len(buffer) >= CHUNK_SIZE:
+                add_to_runs(runs, buffer, run_dir)
+                buffer = []
+        if not errors:
+            add_to_runs(runs, buffer, run_dir)
+    if errors:
+        for run in runs:
+            run.remove()
+        return [], errors
+    count("rows_read", rows)
+    print(f"INFO: Read {rows} trades from {file_path} ({adapter.name} format).")
+    return runs, []
+
+def add_to_runs(runs: list[SortedRun], trades: list[dict], run_dir: str) -> None:
+    """
+    Sorts trades and adds them to the last run, or to a new run if they start before its end.
+    Args:
+        runs (list[SortedRun]): The runs of the export so far.
+        trades (list[dict]): The raw trades.
+        run_dir (str): The folder for the temporary files of the runs.
+    """
+    if not trades:
+        return
+    trades.sort(key=merge_key)
+    if not runs or merge_key(trades[0]) < runs[-1].last_key:
+        runs.append(SortedRun(run_dir))
+    runs[-1].append(trades)
+
+def merge_runs(runs: list[SortedRun], run_dir: str) -> Iterator[dict]:
+    """
+    Merges sorted runs into one date sorted stream, trades with the same date keep the order of
+    the runs. With more than MAX_OPEN_RUNS runs, the first ones are merged into one run first.
+    Args:
+        runs (list[SortedRun]): The runs, in file order.
+        run_dir (str): The folder for the temporary files of the runs.
+    Returns:
+        Iterator[dict]: The raw trades.
+    """
+    runs = list(runs)
+    while len(runs) > MAX_OPEN_RUNS:
+        merged = SortedRun(run_dir)
+        merged.extend(heapq.merge(*runs[:MAX_OPEN_RUNS], key=merge_key))
+        for run in runs[:MAX_OPEN_RUNS]:
+            run.remove()
+        runs = [merged] + runs[MAX_OPEN_RUNS:]
+    return heapq.merge(*runs, key=merge_key)
+
+def merge_key(t: dict) -> datetime:
+    """
+    Gets the date a raw trade is sorted and merged on, in UTC like the normalized store has it,
+    so files with and without time zone offsets can be merged.
+    Args:
+        t (dict): The validated raw trade.
+    Returns:
+        datetime: The date without time zone.
+    """
+    return utc_date(t["Date"].strip())
+
+def write_chunk(chunk: list[dict], conn: sqlite3.Connection, normalized_trades: str) -> int:
+    """
+    Normalizes a chunk of merged raw trades and appends the new ones to the store.
+    Args:
+        chunk (list[dict]): The raw trades.
+        conn (sqlite3.Connection): The connection to the txid index.
+        normalized_trades (str): The path to the normalized trades CSV.
+    Returns:
+        int: The number of trades added.
+    """
+    if not chunk:
+        return 0
+    trades = normalize_chunk(chunk, conn)
+    with stage("write_normalized"):
+        write_trades_normalized(trades, normalized_trades)
+        add_txids(conn, [t["txid"] for t in trades], normalized_trades)
+    return len(trades)
+
+# --- Helper Functions End
+
+def run_ingestion(input_files: list[str], normalized_trades: str, adapters: list[FormatAdapter] | None = None,
+                  workers: int | None = None) -> list[str]:
+    """
+    Reads several exports at the same time (thread pool), then merges their date sorted
+    runs in one pass and normalizes, dedups and appends them to the normalized store.
+    Nothing is written if any file has errors.
+    Args:
+        input_files (list[str]): The paths to the export CSVs.
+        normalized_trades (str): The path to the normalized trades CSV.
+        adapters (list[FormatAdapter] | None): The formats to detect, None for the native one only.
+        workers (int | None): The number of files read at the same time (default: one per file).
+    Returns:
+        list[str]: The errors found in the exports.
+    """
+    adapters = adapters or [NATIVE]
+    with tempfile.TemporaryDirectory() as run_dir:
+        with stage("read_exports"), ThreadPoolExecutor(max_workers=workers or max(len(input_files), 1)) as pool:
+            results = list(pool.map(lambda path: read_export(path, adapters, run_dir), input_files))
+        error_report = [error for _, errors in results for error in errors]
+        count("rows_invalid", len(error_report))
+        if error_report:
+            print("ERROR: Errors found in the CSV files:")
+            for err in error_report:
+                print(err)
+            print("WARNING: Please fix these errors before trying again.")
+            return error_report
+
+        # each run is sorted, a k-way merge keeps the whole stream in date order
+        merged = merge_runs([run for runs, _ in results for run in runs], run_dir)
+        conn = open_txid_index(txid_index_path(normalized_trades), normalized_trades)
+        added = 0
+        chunk = []
+        for t in merged:
+            chunk.append(t)
+            if len(chunk) == CHUNK_SIZE:
+                added += write_chunk(chunk, conn, normalized_trades)
+                chunk = []
+        added += write_chunk(chunk, conn, normalized_trades)
+        count("rows_written", added)
+        conn.close()
+
+    if added:
+        print(f"INFO: Added {added} new trades.")
+    else: print("INFO: No new trades found.")
+    return []
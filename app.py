@@ -1,51 +1,349 @@
-from fifo import calculate_fifo
-from normalization import run_normalization
-import csv
+# Only light modules are imported here, so --help and argument errors return at once.
+# The pipeline modules (YAML, sqlite, process pools) are imported by the functions that use them.
+from profiling import enable_profiling, stage, write_profile
+from contextlib import redirect_stdout
+from decimal import Decimal
+from functools import partial
+from itertools import chain
+from typing import TYPE_CHECKING, Iterable, Iterator
 import argparse
+import io
+import os
+import time
 
-# --- Load Files
-with open("data/normalized_trades.csv", "r") as f:
-    trades = list(csv.DictReader(f))
+if TYPE_CHECKING:
+    from adapters import FormatAdapter
+    from calculator import CGTCalculator
+
+# --- Report records and their CSV column headers
+REPORT_FIELDS = [
+    ("record", "Record"),
+    ("date", "Date"),
+    ("asset", "Asset"),
+    ("sold_quantity", "Sold Quantity"),
+    ("buy_date", "Buy Date"),
+    ("used_quantity", "Used Quantity"),
+    ("cost_per_unit", "Cost Per Unit"),
+    ("cost_basis", "Cost Basis"),
+    ("proceeds", "Proceeds"),
+    ("gain", "Gain"),
+    ("exemption_used", "Exemption Used"),
+    ("taxable_gain", "Taxable Gain"),
+    ("tax_due", "Tax Due"),
+]
+REPORT_FORMATS = ["csv", "jsonl"]
 
 # --- File Paths
 MY_TRADES_PATH = "input/my_trades.csv"
 NORMALIZED_TRADES_PATH = "data/normalized_trades.csv"
 OUTPUT_REPORT_PATH = "output/report.csv"
+BATCH_DATA_DIR = "data/batch"
+BATCH_OUTPUT_DIR = "output/batch"
 
-def generate_report(sold_lots: list[dict], output_file: str) -> None:
+def report_records(sold_lots: Iterable[dict], tax_rate: Decimal, exemption: Decimal) -> Iterator[dict]:
     """
-    Generate a report from the capital gains data
+    Turns sold lots into report records, one at a time: a "match" record per buy lot a sell used,
+    and a "disallowed_loss" record per sell whose loss the 4-week rule disallowed (the gain adds
+    the loss back), then an "asset_total" record per asset and a "year_total" record with the
+    exemption used, the taxable gain and the tax due. Only the running totals are kept in memory.
     Args:
-        sold_lots (list[dict]): A list of sold lot dictionaries.
-        output_file (str): The path to the output CSV file.
+        sold_lots (Iterable[dict]): The sold lot dictionaries of one tax year, e.g. a generator.
+        tax_rate (Decimal): The CGT rate, e.g. 0.33.
+        exemption (Decimal): The personal exemption, e.g. 1270.
+    Returns:
+        Iterator[dict]: The records, keyed by the names in REPORT_FIELDS.
     """
-    # Make sure to only try to gnerate a report if capital_gains were calculated before
-    if sold_lots:
-        with open(output_file, "w", newline="") as csvfile:
-            fieldnames = ["Date", "Asset", "Sold Quantity", "Total Gain", "Buys Used"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    from fifo import calculate_tax
 
+    zero = Decimal(0)
+    asset_totals = {}
+    for lot in sold_lots:
+        totals = asset_totals.setdefault(lot["asset"], {"sold_quantity": zero, "cost_basis": zero, "proceeds": zero, "gain": zero})
+        totals["sold_quantity"] += lot["quantity"]
+        # a sell without any buy lot to match still shows up
+        for d in lot["details"] or [{}]:
+            yield {
+                "record": "match",
+                "date": lot["date"],
+                "asset": lot["asset"],
+                "sold_quantity": lot["quantity"],
+                "buy_date": d.get("buy_date"),
+                "used_quantity": d.get("used_qty"),
+                "cost_per_unit": d.get("cost_per_unit"),
+                "cost_basis": d.get("cost_basis"),
+                "proceeds": d.get("proceeds"),
+                "gain": d.get("gain", zero),
+            }
+            totals["cost_basis"] += d.get("cost_basis", zero)
+            totals["proceeds"] += d.get("proceeds", zero)
+            totals["gain"] += d.get("gain", zero)
+        if lot.get("disallowed_loss"):
+            yield {
+                "record": "disallowed_loss",
+                "date": lot["date"],
+                "asset": lot["asset"],
+                "sold_quantity": lot["quantity"],
+                "gain": lot["disallowed_loss"],
+            }
+            totals["gain"] += lot["disallowed_loss"]
+
+    for asset, totals in asset_totals.items():
+        yield {"record": "asset_total", "asset": asset, **totals}
+    year = {key: sum((totals[key] for totals in asset_totals.values()), zero) for key in ["cost_basis", "proceeds", "gain"]}
+    tax = calculate_tax(year["gain"], tax_rate, exemption)
+    yield {"record": "year_total", **year, "exemption_used": tax["exemption_used"], "taxable_gain": tax["taxable_gain"], "tax_due": tax["tax_due"]}
+
+def generate_report(sold_lots: Iterable[dict], output_file: str, tax_rate: Decimal, exemption: Decimal,
+                    output_format: str = "csv") -> dict | None:
+    """
+    Generate a report from the capital gains data, streaming the sold lots into the file.
+    Args:
+        sold_lots (Iterable[dict]): The sold lot dictionaries of one tax year, e.g. a generator.
+        output_file (str): The path to the output file.
+        tax_rate (Decimal): The CGT rate, e.g. 0.33.
+        exemption (Decimal): The personal exemption, e.g. 1270.
+        output_format (str): "csv", or "jsonl" for one JSON object per line.
+    Returns:
+        dict | None: The year total record, None if there were no sold lots (no file is written).
+    """
+    import csv
+    import json
+
+    sold_lots = iter(sold_lots)
+    first = next(sold_lots, None)
+    # Make sure to only try to gnerate a report if capital_gains were calculated before
+    if first is None:
+        return None
+    records = report_records(chain([first], sold_lots), tax_rate, exemption)
+    with open(output_file, "w", newline="") as f:
+        if output_format == "jsonl":
+            for record in records:
+                # Decimals as strings, so no precision is lost
+                f.write(json.dumps(record, default=str) + "\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=[header for _, header in REPORT_FIELDS])
             writer.writeheader()
-            for lot in sold_lots:
-                writer.writerow({
-                    "Date": lot['date'],
-                    "Asset": lot['asset'],
-                    "Sold Quantity": lot['quantity'],
-                    "Total Gain": lot['total_gain'],
-                    "Buys Used": [f"Date: {d['buy_date']}, Used Qty: {d['used_qty']}, Cost/Unit: {d['cost_per_unit']}, Cost Basis: {d['cost_basis']}, Gain: {d['gain']}" for d in lot['details']]
-                })
+            for record in records:
+                writer.writerow({header: record.get(key) for key, header in REPORT_FIELDS})
+    return record
+
+def report_path(output_file: str, output_format: str) -> str:
+    """
+    Gets the report path for an output format, e.g. output/report.csv -> output/report.jsonl
+    Args:
+        output_file (str): The path to the output report.
+        output_format (str): "csv" or "jsonl".
+    Returns:
+        str: The path with the extension of the format (other extensions are kept).
+    """
+    root, ext = os.path.splitext(output_file)
+    if output_format == "jsonl" and ext == ".csv":
+        return root + ".jsonl"
+    return output_file
+
+def year_report_path(output_file: str, year: int) -> str:
+    """
+    Builds the report path for one tax year, e.g. output/report.csv -> output/report_2024.csv
+    Args:
+        output_file (str): The path to the output CSV file.
+        year (int): The tax year of the report.
+    Returns:
+        str: The path of the report for that tax year.
+    """
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_{year}{ext}"
+
+def process_trades(calculator: "CGTCalculator", input_file: str | list[str], normalized_file: str, output_file: str, year: int,
+                   all_years: bool = False, output_format: str = "csv", adapters: list["FormatAdapter"] | None = None) -> list[str]:
+    """
+    Runs normalization, FIFO and the report(s) for one input file.
+    Args:
+        calculator (CGTCalculator): The calculator with the config (and lot snapshot path) to use.
+        input_file (str | list[str]): The path to the input trades CSV, or several broker exports.
+        normalized_file (str): The path to the normalized store of this input (see CGTCalculator.normalized_path).
+        output_file (str): The path to the output report CSV.
+        year (int): The tax year to calculate.
+        all_years (bool): If True, write one report per tax year instead.
+        output_format (str): The report format, "csv" or "jsonl".
+        adapters (list[FormatAdapter] | None): The broker formats to read the input with (see adapters.py).
+    Returns:
+        list[str]: The errors found in the input, no report is written if there are any.
+    """
+    from adapters import is_native_file, run_ingestion
+    from normalization import run_normalization
+
+    input_files = [input_file] if isinstance(input_file, str) else input_file
+    if len(input_files) == 1 and is_native_file(input_files[0]):
+        errors = run_normalization(input_files[0], normalized_file)
     else:
-        return None
+        errors = run_ingestion(input_files, normalized_file, adapters)
+    if errors:
+        return errors
+
+    with stage("load_trades"):
+        trades = calculator.load_trades(normalized_file)
+    write_report = partial(generate_report, tax_rate=calculator.tax_rate, exemption=calculator.exemption, output_format=output_format)
+    if all_years:
+        for tax_year, result in calculator.calculate_all_years(trades).items():
+            with stage("generate_report"):
+                write_report(result["sold_lots"], year_report_path(output_file, tax_year))
+            print(f"INFO: {tax_year}: {len(result['sold_lots'])} sells, total gain {result['total_gain']}, tax due {result['tax_due']}")
+    else:
+        result = calculator.calculate(trades, year)
+        if not result["sold_lots"]:
+            print(f"WARNING: No sell trade found in tax year {year}")
+        with stage("generate_report"):
+            write_report(result["sold_lots"], output_file)
+        if result["sold_lots"]:
+            print(f"INFO: {year}: {len(result['sold_lots'])} sells, total gain {result['total_gain']}, tax due {result['tax_due']}")
+    return []
+
+def run_batch_client(input_file: str, data_dir: str, output_dir: str, year: int, all_years: bool, output_format: str = "csv") -> dict:
+    """
+    Processes the trade file of one client in a batch, with its own normalized store and report.
+    Args:
+        input_file (str): The path to the client's input trades CSV.
+        data_dir (str): The folder for the client's normalized store.
+        output_dir (str): The folder for the client's report and log.
+        year (int): The tax year to calculate.
+        all_years (bool): If True, write one report per tax year instead.
+        output_format (str): The report format, "csv" or "jsonl".
+    Returns:
+        dict: The manifest entry with the client's status, run time and errors.
+    """
+    from adapters import load_adapters
+    from calculator import CGTCalculator
+    from fifo import CONFIG_PATH, load_config
+
+    client = os.path.splitext(os.path.basename(input_file))[0]
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    report_file = report_path(os.path.join(output_dir, "report.csv"), output_format)
+
+    entry = {"client": client, "input": input_file, "report": report_file, "status": "ok", "errors": []}
+    log = io.StringIO()
+    start = time.perf_counter()
+    try:
+        # the client's messages go to its own log instead of mixing with the other clients
+        with redirect_stdout(log):
+            calculator = CGTCalculator.from_config_file(workers=1, snapshot_path=os.path.join(data_dir, "lot_snapshot.json"))
+            adapters = load_adapters(load_config(CONFIG_PATH).get("BROKER_FORMATS"))
+            normalized_file = calculator.normalized_path(os.path.join(data_dir, "normalized_trades.csv"))
+            errors = process_trades(calculator, input_file, normalized_file, report_file, year, all_years, output_format, adapters)
+        if errors:
+            entry["status"] = "invalid_input"
+            entry["errors"] = errors
+    except Exception as e:
+        entry["status"] = "failed"
+        entry["errors"] = [f"{type(e).__name__}: {e}"]
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+
+    with open(os.path.join(output_dir, "log.txt"), "w") as f:
+        f.write(log.getvalue())
+    return entry
+
+def run_batch(batch_dir: str, year: int, all_years: bool = False, jobs: int | None = None,
+              data_root: str = BATCH_DATA_DIR, output_root: str = BATCH_OUTPUT_DIR, output_format: str = "csv") -> list[dict]:
+    """
+    Processes every client trade CSV in a folder, several clients at a time.
+    A client that fails does not stop the others, see the manifest for the status of each.
+    Args:
+        batch_dir (str): The folder with one input trades CSV per client.
+        year (int): The tax year to calculate.
+        all_years (bool): If True, write one report per tax year instead.
+        jobs (int | None): The number of clients processed at the same time (default: CPU count).
+        data_root (str): The folder that gets one normalized store per client.
+        output_root (str): The folder that gets one report folder per client and manifest.json.
+        output_format (str): The report format, "csv" or "jsonl".
+    Returns:
+        list[dict]: The manifest entries, one per client.
+    """
+    import json
+    from concurrent.futures import ProcessPoolExecutor
+
+    input_files = sorted(
+        os.path.join(batch_dir, name) for name in os.listdir(batch_dir) if name.lower().endswith(".csv")
+    )
+    start = time.perf_counter()
+    entries = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        for input_file in input_files:
+            client = os.path.splitext(os.path.basename(input_file))[0]
+            futures[input_file] = pool.submit(
+                run_batch_client, input_file, os.path.join(data_root, client), os.path.join(output_root, client), year, all_years, output_format,
+            )
+        for input_file, future in futures.items():
+            try:
+                entries.append(future.result())
+            except Exception as e:
+                # e.g. a worker process that crashed
+                client = os.path.splitext(os.path.basename(input_file))[0]
+                entries.append({"client": client, "input": input_file, "status": "failed", "errors": [f"{type(e).__name__}: {e}"]})
+
+    manifest = {
+        "year": year,
+        "all_years": all_years,
+        "seconds": round(time.perf_counter() - start, 3),
+        "clients": entries,
+    }
+    os.makedirs(output_root, exist_ok=True)
+    with open(os.path.join(output_root, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    failed = sum(entry["status"] != "ok" for entry in entries)
+    print(f"INFO: Processed {len(entries)} clients, {failed} with errors. See {os.path.join(output_root, 'manifest.json')}")
+    return entries
 
 def main():
     parser = argparse.ArgumentParser(description="FIFO CGT Calculator")
     parser.add_argument("--year", type=int, default=2025, help="Tax year to calculate (default: 2025)")
-    parser.add_argument("--input", type=str, default=MY_TRADES_PATH, help="Path to input trades CSV")
+    parser.add_argument("--input", type=str, nargs="+", default=[MY_TRADES_PATH], help="Path to input trades CSV, or several broker exports (see BROKER_FORMATS in config)")
     parser.add_argument("--output", type=str, default=OUTPUT_REPORT_PATH, help="Path to output report CSV")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes matching assets in parallel (default: FIFO_WORKERS in config)")
+    parser.add_argument("--all-years", action="store_true", help="Write one report per tax year in a single FIFO pass")
+    parser.add_argument("--batch", type=str, help="Folder with one trades CSV per client, each gets its own store and report")
+    parser.add_argument("--jobs", type=int, default=None, help="Clients processed at the same time in --batch mode (default: CPU count)")
+    parser.add_argument("--format", type=str, choices=REPORT_FORMATS, default="csv", help="Report format, jsonl writes one JSON object per line (default: csv)")
+    parser.add_argument("--watch", action="store_true", help="Keep running and update the report(s) whenever the input file changes")
+    parser.add_argument("--profile", type=str, default=None, help="Write stage timings and counters as JSON/trace file to this path")
+    parser.add_argument("--cprofile", type=str, default=None, help="Write cProfile stats (pstats format) to this path")
     args = parser.parse_args()
+    if args.watch and len(args.input) > 1:
+        parser.error("--watch takes one --input file")
 
-    run_normalization(args.input, NORMALIZED_TRADES_PATH)
-    generate_report(calculate_fifo(trades, args.year), args.output)
+    if args.profile:
+        enable_profiling()
+    profiler = None
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    output_file = report_path(args.output, args.format)
+    from adapters import load_adapters
+    from calculator import CGTCalculator
+    from fifo import CONFIG_PATH, LOT_SNAPSHOT_PATH, load_config
+    try:
+        if args.batch:
+            run_batch(args.batch, args.year, args.all_years, args.jobs, output_format=args.format)
+        elif args.watch:
+            from watch import TradeWatcher, watch
+            calculator = CGTCalculator.from_config_file(workers=1)
+            write_report = partial(generate_report, tax_rate=calculator.tax_rate, exemption=calculator.exemption, output_format=args.format)
+            watch(TradeWatcher(calculator, args.input[0], calculator.normalized_path(NORMALIZED_TRADES_PATH), output_file, args.year,
+                               args.all_years, write_report, year_report_path))
+        else:
+            calculator = CGTCalculator.from_config_file(workers=args.workers, snapshot_path=LOT_SNAPSHOT_PATH)
+            adapters = load_adapters(load_config(CONFIG_PATH).get("BROKER_FORMATS"))
+            process_trades(calculator, args.input, calculator.normalized_path(NORMALIZED_TRADES_PATH), output_file, args.year, args.all_years,
+                           args.format, adapters)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+            print(f"INFO: cProfile stats written to {args.cprofile} (view with: python -m pstats {args.cprofile})")
+        if args.profile:
+            write_profile(args.profile)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""
+Compares the Decimal and the fixed-point mode on synthetic trades read from a columnar store.
+Run from the project folder: python -m benchmarks.bench_fixed_point --trades 200000
+"""
+import argparse
+import os
+import tempfile
+import time
+from decimal import Decimal
+
+from benchmarks.generate_trades import generate_rows
+from calculator import CGTCalculator
+from columnar_store import write_columnar_store
+from normalization import make_txid, normalize_trade
+
+def time_mode(config: dict, store_path: str, repeat: int) -> tuple[float, float, dict[int, dict]]:
+    """
+    Loads the trades of a store and matches every tax year, the best of several runs.
+    Args:
+        config (dict): The config of the mode.
+        store_path (str): The path to the columnar store.
+        repeat (int): The number of runs.
+    Returns:
+        tuple[float, float, dict[int, dict]]: The load and the FIFO time (seconds) and the results per year.
+    """
+    load_times, fifo_times = [], []
+    for _ in range(repeat):
+        # a new calculator each time, so the trades are not taken from its cache
+        calculator = CGTCalculator(config)
+        start = time.perf_counter()
+        trades = calculator.load_trades(store_path)
+        load_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        years = calculator.calculate_all_years(trades)
+        fifo_times.append(time.perf_counter() - start)
+    return min(load_times), min(fifo_times), years
+
+def main():
+    parser = argparse.ArgumentParser(description="Decimal vs fixed-point FIFO benchmark")
+    parser.add_argument("--trades", type=int, default=200000, help="Number of synthetic trades")
+    parser.add_argument("--assets", type=int, default=50, help="Number of assets")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode, the fastest counts")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store_path = os.path.join(tmpdir, "normalized_trades.cols")
+        trades = [normalize_trade(t, make_txid(t)) for t in generate_rows(args.trades, args.assets, args.seed)]
+        write_columnar_store(trades, store_path)
+        decimal_load, decimal_fifo, decimal_years = time_mode({"NORMALIZED_STORE": "columnar"}, store_path, args.repeat)
+        fixed_load, fixed_fifo, fixed_years = time_mode({"NORMALIZED_STORE": "columnar", "FIXED_POINT": True}, store_path, args.repeat)
+
+    max_diff = max(
+        (abs(fixed_years[y]["total_gain"] - decimal_years[y]["total_gain"]) for y in decimal_years),
+        default=Decimal(0),
+    )
+    tax_differs = [y for y in decimal_years if fixed_years[y]["tax_due"] != decimal_years[y]["tax_due"]]
+    decimal_time, fixed_time = decimal_load + decimal_fifo, fixed_load + fixed_fifo
+    print(f"Decimal:     {decimal_time:.3f}s (load {decimal_load:.3f}s, FIFO {decimal_fifo:.3f}s)")
+    print(f"Fixed-point: {fixed_time:.3f}s (load {fixed_load:.3f}s, FIFO {fixed_fifo:.3f}s, {decimal_time / fixed_time:.2f}x)")
+    print(f"Largest yearly total gain difference: {max_diff}")
+    if max_diff >= Decimal("0.01") or tax_differs:
+        print(f"WARNING: Fixed-point results differ by a cent or more (tax due differs in: {tax_differs})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Measures the cold start of the CLI: each command runs in a new Python process, like a scheduler calling app.py.
+Run from the project folder: python -m benchmarks.bench_startup --runs 20
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate_trades import write_trades_csv
+
+# --- Project folder and the latency budget of the light commands (--help, import app)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET_MS = 150
+
+def time_command(command: list[str], cwd: str, runs: int, before_run=None) -> list[float]:
+    """
+    Runs a command in new processes and measures the wall time of each run.
+    Args:
+        command (list[str]): The command and its arguments.
+        cwd (str): The folder to run it in.
+        runs (int): The number of runs.
+        before_run (Callable | None): Called before each run (not timed), e.g. to clear a cache.
+    Returns:
+        list[float]: The milliseconds per run.
+    """
+    timings = []
+    for _ in range(runs):
+        if before_run:
+            before_run()
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def slowest_imports(module: str, limit: int) -> list[tuple[int, str]]:
+    """
+    Lists the imports that take the most time when a module is imported (python -X importtime).
+    Args:
+        module (str): The module to import.
+        limit (int): The number of imports to list.
+    Returns:
+        list[tuple[int, str]]: The cumulative microseconds and the name of each import, slowest first.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            imports.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(imports, reverse=True)[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI cold start benchmark")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per command")
+    parser.add_argument("--rows", type=int, default=100, help="Trades of the small client run")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Allowed median of --help and import app")
+    args = parser.parse_args()
+
+    python = sys.executable
+    app = os.path.join(PROJECT_DIR, "app.py")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # a client folder with its own config, input and data, like one scheduled run
+        for folder in ["config", "input", "data", "output"]:
+            os.makedirs(os.path.join(tmpdir, folder))
+        config_path = os.path.join(tmpdir, "config", "config.yaml")
+        shutil.copy(os.path.join(PROJECT_DIR, "config", "config.yaml"), config_path)
+        write_trades_csv(os.path.join(tmpdir, "input", "my_trades.csv"), args.rows, 5)
+        load_config = [python, "-c", f"import sys; sys.path.insert(0, {PROJECT_DIR!r}); from fifo import load_config; load_config('config/config.yaml')"]
+
+        def clear_config_cache():
+            shutil.rmtree(os.path.join(tmpdir, "config", "__pycache__"), ignore_errors=True)
+
+        results = {
+            "python -c pass": time_command([python, "-c", "pass"], tmpdir, args.runs),
+            "app.py --help": time_command([python, app, "--help"], tmpdir, args.runs),
+            "import app": time_command([python, "-c", "import app"], PROJECT_DIR, args.runs),
+            "load_config (YAML)": time_command(load_config, tmpdir, args.runs, clear_config_cache),
+            "load_config (cached)": time_command(load_config, tmpdir, args.runs),
+            f"app.py, {args.rows} trades": time_command([python, app, "--all-years"], tmpdir, args.runs),
+        }
+
+    for name, timings in results.items():
+        print(f"{name:<24} median {statistics.median(timings):7.1f} ms, min {min(timings):7.1f} ms")
+    print("Slowest imports of app.py (cumulative):")
+    for micros, name in slowest_imports("app", 8):
+        print(f"  {micros / 1000:7.1f} ms {name}")
+
+    for name in ["app.py --help", "import app"]:
+        if statistics.median(results[name]) > args.budget_ms:
+            print(f"WARNING: {name} takes longer than {args.budget_ms:.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Seeded synthetic trade history in the input/my_trades.csv layout, for benchmarks.
+Run from the project folder: python -m benchmarks.generate_trades --rows 100000 --output input/bench_trades.csv
+"""
+import argparse
+import csv
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Iterator
+
+from normalization import EXPECTED_COLUMNS, make_txid
+
+def generate_rows(rows: int, assets: int, seed: int = 42, start: str = "2015-01-01") -> Iterator[dict]:
+    """
+    Generates date sorted raw trades: about 70% buys, sells never exceed the held quantity,
+    some orders are filled in several parts and fees are a mix of zero, flat and percentage fees.
+    Args:
+        rows (int): The number of trades.
+        assets (int): The number of assets.
+        seed (int): The random seed, the same seed gives the same trades.
+        start (str): The date of the first trade.
+    Returns:
+        Iterator[dict]: The raw trade dictionaries with the EXPECTED_COLUMNS keys.
+    """
+    rng = random.Random(seed)
+    names = [f"asset{i}" for i in range(assets)]
+    # a few assets get most of the trades, like a real portfolio
+    weights = [1 / (i + 1) for i in range(assets)]
+    prices = [Decimal(rng.randint(100, 5000000)).scaleb(-2) for _ in range(assets)]
+    held = [Decimal(0)] * assets
+    date = datetime.fromisoformat(start)
+    # spread the trades over about ten years
+    step = max(1, int(10 * 365 * 86400 / max(rows, 1)))
+
+    produced = 0
+    while produced < rows:
+        date += timedelta(seconds=rng.randint(1, 2 * step))
+        i = rng.choices(range(assets), weights)[0]
+        prices[i] = max(Decimal("0.01"), (prices[i] * Decimal(rng.uniform(0.97, 1.03))).quantize(Decimal("0.01")))
+        qty = Decimal(rng.randint(1, 10**6)).scaleb(-6)
+        trade_type = "buy"
+        if held[i] > 0 and rng.random() < 0.3:
+            trade_type = "sell"
+            qty = min(qty, held[i])
+        held[i] += qty if trade_type == "buy" else -qty
+
+        # an order filled in 1 to 3 parts at the same time and price
+        fills = 1 if rng.random() < 0.9 else rng.randint(2, 3)
+        parts = []
+        remaining = qty
+        for _ in range(fills - 1):
+            part = (remaining * Decimal(rng.uniform(0.2, 0.6))).quantize(Decimal("0.000001"))
+            parts.append(part)
+            remaining -= part
+        parts.append(remaining)
+        for n, part in enumerate(parts):
+            if produced == rows or part <= 0:
+                break
+            fee_kind = rng.random()
+            if fee_kind < 0.2:
+                fee = ""
+            elif fee_kind < 0.6:
+                fee = str(Decimal(rng.choice([1, 2, 5, 10])))
+            else:
+                fee = str((prices[i] * part * Decimal("0.001")).quantize(Decimal("0.01")))
+            yield {
+                "Date": date.isoformat(sep=" "),
+                "Type": trade_type,
+                "Asset": names[i].upper(),
+                "Quantity": str(part),
+                "Price": str(prices[i]),
+                "Fees": fee,
+                "Notes": f"fill {n + 1}/{len(parts)}" if len(parts) > 1 else "",
+            }
+            produced += 1
+
+def write_trades_csv(file_path: str, rows: int, assets: int, seed: int = 42) -> None:
+    """
+    Writes a synthetic trade history as an input CSV.
+    Args:
+        file_path (str): The path to the CSV file.
+        rows (int): The number of trades.
+        assets (int): The number of assets.
+        seed (int): The random seed.
+    """
+    with open(file_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=EXPECTED_COLUMNS)
+        writer.writeheader()
+        writer.writerows(generate_rows(rows, assets, seed))
+
+def generate_normalized(rows: int, assets: int, seed: int = 42) -> list[dict]:
+    """
+    Generates the same trades as generate_rows in the normalized layout, without any files.
+    Args:
+        rows (int): The number of trades.
+        assets (int): The number of assets.
+        seed (int): The random seed.
+    Returns:
+        list[dict]: The normalized trade dictionaries (numbers as strings, like the normalized CSV).
+    """
+    trades = []
+    for t in generate_rows(rows, assets, seed):
+        fee = Decimal(t["Fees"] or 0)
+        total_gross = Decimal(t["Price"]) * Decimal(t["Quantity"])
+        trades.append({
+            "date": t["Date"],
+            "asset": t["Asset"].lower(),
+            "type": t["Type"],
+            "quantity": t["Quantity"],
+            "total_net": str(total_gross + fee if t["Type"] == "buy" else total_gross - fee),
+            "txid": make_txid({**t, "Asset": t["Asset"].lower()}),
+        })
+    return trades
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic trade history generator")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of trades")
+    parser.add_argument("--assets", type=int, default=50, help="Number of assets")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--output", type=str, default="input/bench_trades.csv", help="Path to output CSV")
+    args = parser.parse_args()
+    write_trades_csv(args.output, args.rows, args.assets, args.seed)
+    print(f"INFO: Wrote {args.rows} trades to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Times the pipeline stages on synthetic trade histories and records the results as JSON.
+Run from the project folder: python -m benchmarks.run_benchmarks --sizes 1000,10000,100000
+Compare with an earlier run: python -m benchmarks.run_benchmarks --compare benchmarks/results/<old>.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from benchmarks.generate_trades import write_trades_csv
+from calculator import CGTCalculator
+from normalization import check_valid_columns, parse_chunk, read_raw_chunks, run_normalization
+from fifo import calculate_fifo
+from app import generate_report
+
+# --- Default scales (input rows) and regression threshold
+DEFAULT_SIZES = [1000, 10000, 100000]
+RESULTS_DIR = "benchmarks/results"
+REGRESSION_THRESHOLD = 0.2
+# timings below this difference (seconds) are treated as noise
+REGRESSION_MIN_DELTA = 0.01
+
+def time_stage(func, *args) -> tuple[float, object]:
+    """
+    Runs one stage with its messages silenced and measures the wall time.
+    Args:
+        func: The stage function.
+        *args: The arguments of the stage.
+    Returns:
+        tuple[float, object]: The seconds taken and the stage's return value.
+    """
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        result = func(*args)
+    return time.perf_counter() - start, result
+
+def validate_file(file_path: str) -> list[str]:
+    """
+    Validates a whole input file chunk by chunk, like run_normalization does.
+    Args:
+        file_path (str): The path to the input CSV.
+    Returns:
+        list[str]: The errors found.
+    """
+    errors = []
+    start_line = 2  # line 1 is the header row
+    with open(file_path, "rb") as f:
+        for header, data in read_raw_chunks(f):
+            chunk = parse_chunk(header, data)
+            errors.extend(check_valid_columns(chunk, start_line))
+            start_line += len(chunk)
+    return errors
+
+def bench_size(rows: int, assets: int, seed: int, tmpdir: str) -> dict:
+    """
+    Times check_valid_input, run_normalization, calculate_fifo and generate_report for one scale.
+    Args:
+        rows (int): The number of synthetic trades.
+        assets (int): The number of assets.
+        seed (int): The random seed.
+        tmpdir (str): The folder for the input, store and report files.
+    Returns:
+        dict: The seconds per stage for this scale.
+    """
+    input_path = os.path.join(tmpdir, f"trades_{rows}.csv")
+    normalized_path = os.path.join(tmpdir, f"normalized_{rows}.csv")
+    report_path = os.path.join(tmpdir, f"report_{rows}.csv")
+    write_trades_csv(input_path, rows, assets, seed)
+
+    result = {"rows": rows, "assets": assets, "seed": seed}
+    result["check_valid_input"], errors = time_stage(validate_file, input_path)
+    if errors:
+        raise ValueError(f"Synthetic trades are invalid: {errors[:3]}")
+    result["run_normalization"], _ = time_stage(run_normalization, input_path, normalized_path)
+    # a second run on the same input only dedups
+    result["run_normalization_rerun"], _ = time_stage(run_normalization, input_path, normalized_path)
+
+    calculator = CGTCalculator()
+    trades = calculator.load_trades(normalized_path)
+    year = max(int(t["date"][:4]) for t in trades)
+    result["calculate_fifo"], sold_lots = time_stage(calculate_fifo, trades, year)
+    result["generate_report"], _ = time_stage(generate_report, sold_lots or [], report_path, calculator.tax_rate, calculator.exemption)
+    result["sells_in_year"] = len(sold_lots or [])
+    return result
+
+def git_revision() -> str | None:
+    """
+    Gets the current git commit, if the project is a git checkout.
+    Returns:
+        str | None: The short commit hash.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(old: dict, new: dict, threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """
+    Lists the stages that got slower than the threshold between two benchmark runs.
+    Args:
+        old (dict): The earlier results JSON.
+        new (dict): The new results JSON.
+        threshold (float): The allowed slow down, 0.2 = 20%.
+    Returns:
+        list[str]: One message per regression.
+    """
+    old_by_rows = {r["rows"]: r for r in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        before = old_by_rows.get(result["rows"])
+        if not before:
+            continue
+        for stage, seconds in result.items():
+            if stage in ("rows", "assets", "seed", "sells_in_year") or stage not in before:
+                continue
+            if seconds > before[stage] * (1 + threshold) and seconds - before[stage] > REGRESSION_MIN_DELTA:
+                regressions.append(f"{stage} at {result['rows']} rows: {before[stage]:.3f}s -> {seconds:.3f}s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks on synthetic trades")
+    parser.add_argument("--sizes", type=str, default=",".join(map(str, DEFAULT_SIZES)), help="Comma separated numbers of rows, e.g. 1000,10000,10000000")
+    parser.add_argument("--assets", type=int, default=50, help="Number of assets")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--output", type=str, default=None, help="Path to the results JSON (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier results JSON to check for regressions")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for rows in (int(size) for size in args.sizes.split(",")):
+            result = bench_size(rows, args.assets, args.seed, tmpdir)
+            results.append(result)
+            stages = ", ".join(f"{k} {v:.3f}s" for k, v in result.items() if isinstance(v, float))
+            print(f"INFO: {rows} rows: {stages}")
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"INFO: Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare_results(json.load(f), report)
+        for regression in regressions:
+            print(f"WARNING: Slower than before: {regression}")
+        if not regressions:
+            print("INFO: No regressions found.")
+
+if __name__ == "__main__":
+    main()
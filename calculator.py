@@ -0,0 +1,137 @@
+import csv
+import os
+from decimal import Decimal
+from typing import Iterable
+
+from columnar_store import COLUMNAR_SUFFIX, ColumnarStore, columnar_path
+from fifo import calculate_fifo_all_years, calculate_tax, load_config, CONFIG_PATH
+from fixed_point import QUANTITY_SCALE, AMOUNT_SCALE, fixed_scales, to_fixed
+
+# --- Fields of a normalized trade that FIFO uses, only these are read from a columnar store
+FIFO_FIELDS = ["date", "asset", "type", "quantity", "total_net", "txid"]
+
+class CGTCalculator:
+    """
+    FIFO CGT calculator for use as a library, e.g. in a long-running service.
+    Built once from a config, it takes trades from memory and does no file I/O per call
+    (unless a lot snapshot path is given).
+    """
+
+    def __init__(self, config: dict | None = None, workers: int | None = None, snapshot_path: str | None = None):
+        """
+        Args:
+            config (dict | None): The config values (see config/config.yaml), None for the defaults.
+            workers (int | None): Worker processes that match assets in parallel, None for FIFO_WORKERS.
+            snapshot_path (str | None): The path to a lot snapshot file, None to keep everything in memory.
+        """
+        config = config or {}
+        # str() so a float from YAML like 0.33 is not carried over with its binary error
+        self.tax_rate = Decimal(str(config.get("CGT_TAX_Normal", "0.33")))
+        self.exemption = Decimal(str(config.get("PERSONAL_EXEMPTION", "1270")))
+        self.fixed_point_scales = None
+        if config.get("FIXED_POINT", False):
+            self.fixed_point_scales = (int(config.get("QUANTITY_SCALE", QUANTITY_SCALE)), int(config.get("AMOUNT_SCALE", AMOUNT_SCALE)))
+        self.four_week_rule = bool(config.get("FOUR_WEEK_RULE", False))
+        if self.four_week_rule and self.fixed_point_scales:
+            raise ValueError("FOUR_WEEK_RULE can not be combined with FIXED_POINT")
+        self.workers = workers if workers is not None else int(config.get("FIFO_WORKERS", 1))
+        self.snapshot_path = snapshot_path
+        self.columnar = config.get("NORMALIZED_STORE", "csv") == "columnar"
+        self._trades_cache = {}
+
+    @classmethod
+    def from_config_file(cls, file_path: str = CONFIG_PATH, **kwargs) -> "CGTCalculator":
+        """
+        Builds a calculator from a YAML config file (parsed once per process, see fifo.load_config).
+        Args:
+            file_path (str): The path to the config file.
+            **kwargs: Passed on to CGTCalculator().
+        Returns:
+            CGTCalculator: The calculator.
+        """
+        return cls(load_config(file_path), **kwargs)
+
+    def normalized_path(self, file_path: str) -> str:
+        """
+        Gets the path of the normalized store to write and read.
+        Args:
+            file_path (str): The path to the normalized trades CSV file.
+        Returns:
+            str: The CSV path, or with NORMALIZED_STORE: columnar the path of the columnar store next to it.
+        """
+        return columnar_path(file_path) if self.columnar else file_path
+
+    def load_trades(self, file_path: str) -> list[dict]:
+        """
+        Loads normalized trades from a CSV, the parsed trades are reused until the file changes.
+        A columnar store (see normalized_path) is memory-mapped and only the columns FIFO uses
+        are read (see FIFO_FIELDS).
+        With FIXED_POINT the quantities and net totals are converted to scaled integers here, once per
+        file change. From a columnar store that is integer arithmetic on its coefficient and exponent
+        columns, no Decimal is built.
+        Args:
+            file_path (str): The path to the normalized trades CSV file or columnar store.
+        Returns:
+            list[dict]: The normalized trade dictionaries (shared between calls, do not modify).
+        """
+        if not os.path.exists(file_path):
+            return []
+        stat = os.stat(file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._trades_cache.get(file_path)
+        if cached is None or cached[0] != key:
+            if file_path.endswith(COLUMNAR_SUFFIX):
+                scales = fixed_scales(self.fixed_point_scales) if self.fixed_point_scales else None
+                with ColumnarStore(file_path) as store:
+                    cached = (key, list(store.trades(fields=FIFO_FIELDS, scales=scales)))
+            else:
+                with open(file_path, "r", newline="") as f:
+                    trades = list(csv.DictReader(f))
+                if self.fixed_point_scales:
+                    for field, (scale, exact) in fixed_scales(self.fixed_point_scales).items():
+                        for t in trades:
+                            t[field] = to_fixed(t[field], scale, exact)
+                cached = (key, trades)
+            self._trades_cache[file_path] = cached
+        return cached[1]
+
+    def tax_totals(self, total_gain: Decimal) -> dict:
+        """
+        Applies this calculator's exemption and rate to a total gain (see fifo.calculate_tax).
+        Args:
+            total_gain (Decimal): The summed gains and losses of a tax year.
+        Returns:
+            dict: The total gain, the exemption used, the taxable gain and the tax due.
+        """
+        return calculate_tax(total_gain, self.tax_rate, self.exemption)
+
+    def calculate_all_years(self, trades: Iterable[dict]) -> dict[int, dict]:
+        """
+        Calculates every tax year in one FIFO pass (always over the whole history, no snapshot).
+        Args:
+            trades (Iterable[dict]): The normalized trade dictionaries.
+        Returns:
+            dict[int, dict]: Per tax year the sold lots, the open lots at the year end and the tax totals.
+        """
+        years = calculate_fifo_all_years(
+            list(trades), workers=self.workers, four_week_rule=self.four_week_rule, fixed_point_scales=self.fixed_point_scales,
+        )
+        for result in years.values():
+            result.update(self.tax_totals(result["total_gain"]))
+        return years
+
+    def calculate(self, trades: Iterable[dict], tax_year: int) -> dict:
+        """
+        Calculates one tax year, sells of earlier years still use up their lots.
+        Args:
+            trades (Iterable[dict]): The normalized trade dictionaries.
+            tax_year (int): The tax year to calculate.
+        Returns:
+            dict: The sold lots ("sold_lots", empty if there were no sells) and the tax totals of the year.
+        """
+        years = calculate_fifo_all_years(
+            list(trades), self.snapshot_path, from_year=tax_year,
+            workers=self.workers, four_week_rule=self.four_week_rule, open_lots=False, fixed_point_scales=self.fixed_point_scales,
+        )
+        result = years.get(tax_year, {"sold_lots": [], "total_gain": Decimal(0)})
+        return {"sold_lots": result["sold_lots"], **self.tax_totals(result["total_gain"])}
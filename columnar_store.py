@@ -0,0 +1,527 @@
+import bisect
+import csv
+import heapq
+import json
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Iterator
+
+from fixed_point import rescale
+
+# --- File layout: magic, then segments of header length, JSON header and 8 byte aligned column blocks.
+# New trades are appended as a new segment, each segment is sorted by date and indexed by asset.
+MAGIC = b"CGTCOL1\n"
+COLUMNAR_SUFFIX = ".cols"
+# --- Segments of the same size tier that are merged into one, so a store that grows by appends stays a few segments
+MERGE_SEGMENTS = 8
+# the index is stored as the type code, new types are only ever appended
+TRADE_TYPES = ["buy", "sell", "split", "bonus", "consolidation"]
+DECIMAL_FIELDS = ["quantity", "price", "fee", "total_gross", "total_net"]
+CSV_COLUMNS = ["date", "asset", "type", "quantity", "price", "fee", "total_gross", "total_net", "txid", "note"]
+TXID_LENGTH = 10
+EPOCH = datetime(1970, 1, 1)
+INT64_MAX = 2**63 - 1
+# powers of ten to scale a coefficient by (exponents are -128 to 127)
+POW10 = [10 ** shift for shift in range(256)]
+
+# --- Helper Functions Start
+def columnar_path(file_path: str) -> str:
+    """
+    Gets the path of the columnar store that belongs to a normalized trades CSV.
+    Args:
+        file_path (str): The path to the normalized trades CSV file.
+    Returns:
+        str: The path to the columnar store next to it.
+    """
+    return os.path.splitext(file_path)[0] + COLUMNAR_SUFFIX
+
+def date_to_micros(date) -> int:
+    """
+    Converts a date (datetime or ISO string) to microseconds since 1970-01-01. Dates with a
+    time zone (e.g. in a CSV normalized before offsets were converted) count as UTC.
+    Args:
+        date: The date as datetime or ISO formatted string.
+    Returns:
+        int: The microseconds since 1970-01-01.
+    """
+    if not isinstance(date, datetime):
+        date = datetime.fromisoformat(str(date))
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return (date - EPOCH) // timedelta(microseconds=1)
+
+def micros_to_date(micros: int) -> str:
+    """
+    Converts microseconds since 1970-01-01 back to the date string of the normalized CSV.
+    Args:
+        micros (int): The microseconds since 1970-01-01.
+    Returns:
+        str: The date like "2025-01-01 00:00:00".
+    """
+    return str(EPOCH + timedelta(microseconds=micros))
+
+def split_decimal(value) -> tuple[int, int]:
+    """
+    Splits a number into an integer coefficient and a decimal exponent, exactly.
+    Args:
+        value: The number as Decimal or string.
+    Returns:
+        tuple[int, int]: The coefficient and exponent, value == coefficient * 10**exponent.
+    """
+    # plain decimal strings (most values) are split as text, which is faster than as_tuple()
+    integer, _, fraction = str(value).partition(".")
+    if integer.lstrip("+-").isdigit() and (not fraction or fraction.isdigit()):
+        coefficient, exponent = int(integer + fraction), -len(fraction)
+    else:
+        sign, digits, exponent = Decimal(value).as_tuple()
+        if not isinstance(exponent, int):
+            raise ValueError(f"{value} can not be stored in the columnar store")
+        coefficient = int("".join(map(str, digits)) or "0")
+        coefficient = -coefficient if sign else coefficient
+    if abs(coefficient) > INT64_MAX or not -128 <= exponent <= 127:
+        raise ValueError(f"{value} has too many digits for the columnar store")
+    return coefficient, exponent
+
+def segment_tier(rows: int) -> int:
+    """
+    Gets the size tier of a segment, segments of one tier have about the same number of rows.
+    Args:
+        rows (int): The number of rows of the segment.
+    Returns:
+        int: The tier, each tier holds MERGE_SEGMENTS times the rows of the one before.
+    """
+    tier = 0
+    while rows >= MERGE_SEGMENTS:
+        rows //= MERGE_SEGMENTS
+        tier += 1
+    return tier
+
+def encode_segment(trades: list[dict], source: dict | None = None) -> bytes:
+    """
+    Encodes normalized trades as one segment, see encode_columns().
+    Args:
+        trades (list[dict]): The normalized trade dictionaries.
+        source (dict | None): Details of the CSV the store was built from (see build_columnar_store).
+    Returns:
+        bytes: The segment, its length is a multiple of 8.
+    """
+    columns = {
+        "date": [date_to_micros(t["date"]) for t in trades],
+        "asset": [t["asset"] for t in trades],
+        "type": [TRADE_TYPES.index(t["type"]) for t in trades],
+        "txid": [str(t["txid"]).encode().ljust(TXID_LENGTH)[:TXID_LENGTH] for t in trades],
+        "note": [str(t.get("note") or "").encode() for t in trades],
+    }
+    for field in DECIMAL_FIELDS:
+        parts = [split_decimal(t[field]) for t in trades]
+        columns[f"{field}_coef"] = [coefficient for coefficient, _ in parts]
+        columns[f"{field}_exp"] = [exponent for _, exponent in parts]
+    return encode_columns(columns, source)
+
+def segment_columns(segments: list["ColumnarSegment"]) -> dict[str, list]:
+    """
+    Reads the raw values of whole segments, in segment order, to encode them again without
+    decoding the numbers (see encode_columns).
+    Args:
+        segments (list[ColumnarSegment]): The segments.
+    Returns:
+        dict[str, list]: The values per column.
+    """
+    numeric = ["date", "type"] + [f"{field}_{part}" for field in DECIMAL_FIELDS for part in ("coef", "exp")]
+    columns = {name: [] for name in numeric + ["asset", "txid", "note"]}
+    for segment in segments:
+        c = segment.columns
+        for name in numeric:
+            columns[name].extend(c[name].tolist())
+        columns["asset"].extend(segment.assets[code] for code in c["asset"])
+        txids = bytes(c["txid"])
+        columns["txid"].extend(txids[row * TXID_LENGTH:(row + 1) * TXID_LENGTH] for row in range(segment.rows))
+        notes, offsets = bytes(c["notes"]), c["note_offsets"]
+        columns["note"].extend(notes[offsets[row]:offsets[row + 1]] for row in range(segment.rows))
+    return columns
+
+def encode_columns(columns: dict[str, list], source: dict | None = None) -> bytes:
+    """
+    Encodes the values of trades as one segment, sorted by date (trades with the same date keep
+    their order) and indexed by asset.
+    Args:
+        columns (dict[str, list]): Per column the values of every trade: dates in microseconds, assets,
+            type codes, coefficients and exponents of the numbers, and txids and notes as bytes.
+        source (dict | None): Details of the CSV the store was built from (see build_columnar_store).
+    Returns:
+        bytes: The segment, its length is a multiple of 8.
+    """
+    order = sorted(range(len(columns["date"])), key=columns["date"].__getitem__)
+    ordered = {name: [values[i] for i in order] for name, values in columns.items()}
+    dates = ordered["date"]
+
+    assets = []
+    asset_codes = {}
+    for asset in ordered["asset"]:
+        if asset not in asset_codes:
+            asset_codes[asset] = len(assets)
+            assets.append(asset)
+    codes = [asset_codes[asset] for asset in ordered["asset"]]
+
+    # row numbers grouped by asset (still date sorted within each asset)
+    asset_rows = sorted(range(len(dates)), key=codes.__getitem__)
+    asset_index = {}
+    for position, row in enumerate(asset_rows):
+        start, count = asset_index.get(codes[row], (position, 0))
+        asset_index[codes[row]] = (start, count + 1)
+
+    notes = ordered["note"]
+    note_offsets = [0]
+    for note in notes:
+        note_offsets.append(note_offsets[-1] + len(note))
+
+    blocks = {
+        "date": ("q", dates),
+        "asset": ("i", codes),
+        "type": ("b", ordered["type"]),
+        "asset_rows": ("i", asset_rows),
+        "note_offsets": ("q", note_offsets),
+    }
+    for field in DECIMAL_FIELDS:
+        blocks[f"{field}_coef"] = ("q", ordered[f"{field}_coef"])
+        blocks[f"{field}_exp"] = ("b", ordered[f"{field}_exp"])
+
+    raw_blocks = {name: struct.pack(f"<{len(values)}{fmt}", *values) for name, (fmt, values) in blocks.items()}
+    raw_blocks["txid"] = b"".join(ordered["txid"])
+    raw_blocks["notes"] = b"".join(notes)
+    formats = {name: fmt for name, (fmt, _) in blocks.items()}
+    formats.update({"txid": "c", "notes": "c"})
+
+    # offsets are relative to the end of the header, each block starts 8 byte aligned
+    columns = {}
+    offset = 0
+    for name, raw in raw_blocks.items():
+        columns[name] = {"offset": offset, "size": len(raw), "format": formats[name]}
+        offset += len(raw) + (-len(raw) % 8)
+
+    header = json.dumps({
+        "rows": len(dates),
+        "assets": assets,
+        "asset_index": {str(code): list(span) for code, span in asset_index.items()},
+        "columns": columns,
+        "size": offset,
+        "source": source or {},
+    }).encode()
+    header += b" " * (-(8 + len(header)) % 8)
+    return b"".join([struct.pack("<Q", len(header)), header] + [raw + b"\0" * (-len(raw) % 8) for raw in raw_blocks.values()])
+
+def decode_rows(located: list[tuple["ColumnarSegment", int]], fields: list[str] | None = None,
+                scales: dict[str, tuple[int, bool]] | None = None) -> Iterator[dict]:
+    """
+    Decodes rows of one or more segments, column by column (faster than row by row).
+    Args:
+        located (list[tuple[ColumnarSegment, int]]): The segment and row number in it of each row.
+        fields (list[str] | None): The fields to decode (see CSV_COLUMNS), None for all.
+        scales (dict[str, tuple[int, bool]] | None): Numbers to decode as scaled integers instead of
+            Decimals, per field the scale and if it must fit exactly (see fixed_point.fixed_scales).
+    Returns:
+        Iterator[dict]: The trade dictionaries, with Decimal numbers like the normalized CSV.
+    """
+    scales = scales or {}
+    take = lambda name: [segment.columns[name][row] for segment, row in located]
+    columns = {}
+    for field in fields or CSV_COLUMNS:
+        if field == "date":
+            columns[field] = [micros_to_date(micros) for micros in take("date")]
+        elif field == "asset":
+            columns[field] = [segment.assets[segment.columns["asset"][row]] for segment, row in located]
+        elif field == "type":
+            columns[field] = [TRADE_TYPES[code] for code in take("type")]
+        elif field in scales:
+            # coefficients and exponents are ints already, so no Decimal is built
+            scale, exact = scales[field]
+            columns[field] = [
+                coefficient * POW10[exponent + scale] if exponent + scale >= 0 else rescale(coefficient, exponent, scale, exact)
+                for coefficient, exponent in zip(take(f"{field}_coef"), take(f"{field}_exp"))
+            ]
+        elif field in DECIMAL_FIELDS:
+            columns[field] = [Decimal(coefficient).scaleb(exponent) for coefficient, exponent in zip(take(f"{field}_coef"), take(f"{field}_exp"))]
+        elif field == "txid":
+            columns[field] = [bytes(segment.columns["txid"][row * TXID_LENGTH:(row + 1) * TXID_LENGTH]).decode().rstrip() for segment, row in located]
+        elif field == "note":
+            columns[field] = [
+                bytes(segment.columns["notes"][segment.columns["note_offsets"][row]:segment.columns["note_offsets"][row + 1]]).decode()
+                for segment, row in located
+            ]
+    names = list(columns)
+    for values in zip(*columns.values()):
+        yield dict(zip(names, values))
+
+# --- Helper Functions End
+
+def write_columnar_store(trades: list[dict], file_path: str, source: dict | None = None) -> None:
+    """
+    Writes normalized trades to a new columnar store file, as one segment.
+    Args:
+        trades (list[dict]): The normalized trade dictionaries.
+        file_path (str): The path to the store file.
+        source (dict | None): Details of the CSV the store was built from (see build_columnar_store).
+    """
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(encode_segment(trades, source))
+    os.replace(tmp_path, file_path)
+
+class ColumnarSegment:
+    """
+    One segment of a columnar store: typed views on its column blocks in the memory map.
+    """
+
+    def __init__(self, view: memoryview, offset: int, first_row: int):
+        """
+        Args:
+            view (memoryview): The view on the whole store file.
+            offset (int): The position of the segment in the file.
+            first_row (int): The store row number of the segment's first row.
+        """
+        self.offset = offset
+        self.first_row = first_row
+        header_size = struct.unpack_from("<Q", view, offset)[0]
+        data_start = offset + 8 + header_size
+        self.header = json.loads(bytes(view[offset + 8:data_start]))
+        self.rows = self.header["rows"]
+        self.assets = self.header["assets"]
+        self.asset_codes = {asset: code for code, asset in enumerate(self.assets)}
+        # a store written before segments has a single one, up to the end of the file
+        self.end = data_start + self.header["size"] if "size" in self.header else len(view)
+
+        self.views = []
+        self.columns = {}
+        for name, spec in self.header["columns"].items():
+            start = data_start + spec["offset"]
+            column = view[start:start + spec["size"]]
+            if spec["format"] != "c":
+                column = column.cast(spec["format"])
+            self.views.append(column)
+            self.columns[name] = column
+
+    def select(self, asset: str | None = None, start=None, end=None) -> list[int]:
+        """
+        Finds the rows of an asset and/or date range in this segment, see ColumnarStore.select().
+        Returns:
+            list[int]: The date sorted row numbers in the segment.
+        """
+        dates = self.columns["date"]
+        if asset is None:
+            rows = range(self.rows)
+            date_of = dates.__getitem__
+        else:
+            if asset not in self.asset_codes:
+                return []
+            first, count = self.header["asset_index"][str(self.asset_codes[asset])]
+            rows = self.columns["asset_rows"][first:first + count]
+            date_of = lambda position: dates[rows[position]]
+        low = 0 if start is None else bisect.bisect_left(range(len(rows)), date_to_micros(start), key=date_of)
+        high = len(rows) if end is None else bisect.bisect_left(range(len(rows)), date_to_micros(end), key=date_of)
+        return list(rows[low:high])
+
+class ColumnarStore:
+    """
+    Read access to a columnar store file. Columns are typed views on a memory map, so opening
+    the store does not parse or copy the trades. Use as a context manager or call close().
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        with open(file_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(file_path) else None
+        if self._map is None or self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{file_path} is not a columnar trade store")
+
+        view = memoryview(self._map)
+        self._views = [view]
+        self.segments = []
+        offset = len(MAGIC)
+        rows = 0
+        while offset < len(view):
+            segment = ColumnarSegment(view, offset, rows)
+            self._views.extend(segment.views)
+            self.segments.append(segment)
+            offset = segment.end
+            rows += segment.rows
+        self._rows = rows
+        self._first_rows = [segment.first_row for segment in self.segments]
+        # assets in the order they first show up
+        self.assets = list(dict.fromkeys(asset for segment in self.segments for asset in segment.assets))
+        self.source = self.segments[0].header["source"] if self.segments else {}
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __enter__(self) -> "ColumnarStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Releases the column views and the memory map.
+        """
+        for segment in self.segments:
+            segment.columns = {}
+        self.segments = []
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def locate(self, rows: list[int]) -> list[tuple[ColumnarSegment, int]]:
+        """
+        Finds the segment of store rows.
+        Args:
+            rows (list[int]): The store row numbers.
+        Returns:
+            list[tuple[ColumnarSegment, int]]: The segment and the row number in it of each row.
+        """
+        if len(self.segments) == 1:
+            segment = self.segments[0]
+            return [(segment, row) for row in rows]
+        located = []
+        for row in rows:
+            segment = self.segments[bisect.bisect_right(self._first_rows, row) - 1]
+            located.append((segment, row - segment.first_row))
+        return located
+
+    def select(self, asset: str | None = None, start=None, end=None) -> list[int]:
+        """
+        Finds the rows of an asset and/or date range without reading any other rows.
+        Args:
+            asset (str | None): The asset to select, None for all assets.
+            start: The first date to include (datetime or ISO string), None for no lower bound.
+            end: The date to stop before (datetime or ISO string), None for no upper bound.
+        Returns:
+            list[int]: The date sorted store row numbers, rows with the same date in the order they were added.
+        """
+        if len(self.segments) == 1:
+            return self.segments[0].select(asset, start, end)
+        # each segment is date sorted, later segments hold later added trades
+        per_segment = []
+        for segment in self.segments:
+            dates = segment.columns["date"]
+            per_segment.append([(dates[row], segment.first_row + row) for row in segment.select(asset, start, end)])
+        return [row for _, row in heapq.merge(*per_segment)]
+
+    def column(self, name: str, rows: list[int]) -> list:
+        """
+        Reads the raw values of one column block, e.g. the type codes (see TRADE_TYPES).
+        Args:
+            name (str): The name of the block.
+            rows (list[int]): The store row numbers.
+        Returns:
+            list: The values of the rows.
+        """
+        return [segment.columns[name][row] for segment, row in self.locate(rows)]
+
+    def trade(self, row: int) -> dict:
+        """
+        Reads one row as a normalized trade dictionary.
+        Args:
+            row (int): The store row number.
+        Returns:
+            dict: The trade with Decimal numbers, like the normalized CSV.
+        """
+        return next(decode_rows(self.locate([row])))
+
+    def trades(self, asset: str | None = None, start=None, end=None, fields: list[str] | None = None,
+               scales: dict[str, tuple[int, bool]] | None = None) -> Iterator[dict]:
+        """
+        Reads the trades of an asset and/or date range, see select(). Decodes column by column,
+        which is faster than trade() per row.
+        Args:
+            fields (list[str] | None): Only decode these fields (see CSV_COLUMNS), None for all.
+            scales (dict[str, tuple[int, bool]] | None): Numbers to read as scaled integers (see decode_rows).
+        Returns:
+            Iterator[dict]: The date sorted trade dictionaries.
+        """
+        return decode_rows(self.locate(self.select(asset, start, end)), fields, scales)
+
+def append_columnar_store(trades: list[dict], file_path: str) -> None:
+    """
+    Appends normalized trades to a columnar store as a new segment, without reading the trades
+    already stored. Then the last MERGE_SEGMENTS segments are merged while they have the same
+    size tier, so each trade is only rewritten a few times however often the store grows.
+    Args:
+        trades (list[dict]): The normalized trade dictionaries.
+        file_path (str): The path to the store file (created if missing).
+    """
+    if not trades:
+        return
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        write_columnar_store(trades, file_path)
+        return
+    with ColumnarStore(file_path) as store:
+        sized = all("size" in segment.header for segment in store.segments)
+        stored = [] if sized else list(store.trades())
+    if not sized:
+        # a store written before segments can not be appended to, it is rewritten once
+        write_columnar_store(stored + list(trades), file_path)
+        return
+    with open(file_path, "ab") as f:
+        f.write(encode_segment(trades))
+
+    while True:
+        with ColumnarStore(file_path) as store:
+            tail = store.segments[-MERGE_SEGMENTS:]
+            if len(tail) < MERGE_SEGMENTS or len({segment_tier(segment.rows) for segment in tail}) > 1:
+                return
+            offset = tail[0].offset
+            merged = encode_columns(segment_columns(tail))
+        # the merged segment replaces the ones it was made of at the end of the file
+        with open(file_path, "r+b") as f:
+            f.seek(offset)
+            f.write(merged)
+            f.truncate()
+
+def build_columnar_store(csv_path: str, store_path: str) -> bool:
+    """
+    (Re)builds the columnar store from the normalized trades CSV if the CSV changed since.
+    Args:
+        csv_path (str): The path to the normalized trades CSV file.
+        store_path (str): The path to the columnar store file.
+    Returns:
+        bool: True if the store was rebuilt.
+    """
+    stat = os.stat(csv_path) if os.path.exists(csv_path) else None
+    source = {"path": os.path.basename(csv_path), "size": stat.st_size if stat else 0, "mtime_ns": stat.st_mtime_ns if stat else 0}
+    if os.path.exists(store_path):
+        try:
+            with ColumnarStore(store_path) as store:
+                if store.source == source:
+                    return False
+                stored = len(store)
+                built = bool(store.source)
+        except ValueError:
+            stored, built = 0, True
+        if stored and not built:
+            raise ValueError(f"{store_path} is the normalized store of NORMALIZED_STORE: columnar, not a copy of {csv_path}")
+    trades = []
+    if stat:
+        with open(csv_path, "r", newline="") as f:
+            trades = list(csv.DictReader(f))
+    write_columnar_store(trades, store_path, source)
+    return True
+
+def export_csv(store_path: str, csv_path: str) -> None:
+    """
+    Exports a columnar store as a normalized trades CSV (date sorted).
+    Args:
+        store_path (str): The path to the columnar store file.
+        csv_path (str): The path to the CSV file to write.
+    """
+    with ColumnarStore(store_path) as store, open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for trade in store.trades():
+            writer.writerow({k: str(v) for k, v in trade.items()})
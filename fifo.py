@@ -1,93 +1,800 @@
-import yaml
-from decimal import Decimal
-from datetime import datetime
+import hashlib
+import heapq
+import json
+import marshal
+import os
+from bisect import bisect_left
+from decimal import Decimal, ROUND_HALF_UP
+from fractions import Fraction
+from datetime import datetime, timedelta
 from collections import deque, defaultdict
-
-# --- Load Files
-with open("config/config.yaml", "r") as f:
-    config = yaml.safe_load(f)
+from functools import lru_cache, partial
+from fixed_point import FixedLot, as_fixed, match_sell_fixed, from_fixed
+from profiling import count, profiling_enabled, record_queue_depth, stage
 
 # --- File Paths and Constants
 MY_TRADES_PATH = "input/my_trades.csv"
 NORMALIZED_TRADES_PATH = "data/normalized_trades.csv"
+LOT_SNAPSHOT_PATH = "data/lot_snapshot.json"
+CONFIG_PATH = "config/config.yaml"
+# 4-week rule: a loss is not allowed as far as the asset is bought again within 4 weeks after the sell
+FOUR_WEEK_WINDOW = timedelta(weeks=4)
+
+# --- Lot Record
+class Lot:
+    """
+    An open buy lot in a FIFO queue. The cost per unit is computed once when the lot is
+    created, matching a sell only updates the remaining quantity.
+    Quantities are in the units of the asset's cumulative corporate action factor given by
+    "factor", a lot is only rescaled to a newer factor when it is matched (see rescale).
+    Once rescaled, the exact remaining quantity is kept as a Fraction in the units the lot was
+    created in ("base_qty"), so repeated corporate actions never add up rounding.
+    """
+    __slots__ = ("quantity", "total_net", "original_qty", "cost_per_unit", "date", "factor",
+                 "base_qty", "base_original_qty", "base_factor")
 
-CGT_TAX_Normal = Decimal(config.get("CGT_TAX_Normal", 0.33))
-PERSONAL_EXEMPTION = Decimal(config.get("PERSONAL_EXEMPTION", 1270))
+    def __init__(self, quantity: Decimal, total_net: Decimal, original_qty: Decimal, date: str, factor: Fraction | int = 1):
+        self.quantity = quantity
+        self.total_net = total_net
+        self.original_qty = original_qty
+        # each trade has a total net value, which divided by it's original
+        # qty is the cost per unit, this can be used to calculate cost_basis
+        self.cost_per_unit = total_net / original_qty if original_qty else Decimal(0)
+        self.date = date
+        self.factor = factor
+        self.base_qty = None
 
-# --- Functions
-def calculate_fifo(trades: list[dict], tax_year: int) -> list[dict]:
+    def scaled(self, factor: Fraction) -> tuple[Decimal, Decimal]:
+        """
+        Converts the lot's remaining and original quantity to the units of a factor, rounded once.
+        Args:
+            factor (Fraction): The asset's cumulative factor.
+        Returns:
+            tuple[Decimal, Decimal]: The remaining and the original quantity in those units.
+        """
+        if self.base_qty is None:
+            base_qty, base_original_qty, base_factor = Fraction(self.quantity), Fraction(self.original_qty), self.factor
+        else:
+            base_qty, base_original_qty, base_factor = self.base_qty, self.base_original_qty, self.base_factor
+        ratio = Fraction(factor) / base_factor
+        return fraction_to_decimal(base_qty * ratio), fraction_to_decimal(base_original_qty * ratio)
+
+    def rescale(self, factor: Fraction) -> None:
+        """
+        Applies the corporate actions since the lot was created or last rescaled, the cost stays the same.
+        Args:
+            factor (Fraction): The asset's current cumulative factor.
+        """
+        if self.base_qty is None:
+            self.base_qty = Fraction(self.quantity)
+            self.base_original_qty = Fraction(self.original_qty)
+            self.base_factor = self.factor
+        self.quantity, self.original_qty = self.scaled(factor)
+        self.cost_per_unit = self.total_net / self.original_qty if self.original_qty else Decimal(0)
+        self.factor = factor
+
+    def as_dict(self, factor: Fraction | None = None) -> dict:
+        """
+        Converts the lot to the dictionary layout used in the results.
+        Args:
+            factor (Fraction | None): The asset's current cumulative factor, None if it had no corporate actions.
+        Returns:
+            dict: The lot's quantity, total_net, original_qty and date.
+        """
+        if factor is not None and factor != self.factor:
+            quantity, original_qty = self.scaled(factor)
+            return {
+                "quantity": quantity,
+                "total_net": self.total_net,
+                "original_qty": original_qty,
+                "date": self.date,
+            }
+        return {
+            "quantity": self.quantity,
+            "total_net": self.total_net,
+            "original_qty": self.original_qty,
+            "date": self.date,
+        }
+
+def fraction_to_decimal(value: Fraction) -> Decimal:
     """
-    Calculate FIFO (First In, First Out) capital gains for a list of trades.
+    Converts an exact Fraction to a Decimal, exact whenever the Decimal context allows.
     Args:
-        trades (list[dict]): A list of trade dictionaries.
+        value (Fraction): The value.
     Returns:
-        list[dict]: A list of capital gain dictionaries.
+        Decimal: The value, rounded once by the division.
+    """
+    return Decimal(value.numerator) / Decimal(value.denominator)
+
+# --- 4-Week Rule
+def trade_key(trade: dict) -> str:
+    """
+    Identifies a trade across runs, by its txid or (without one) by its FIFO fields.
+    Args:
+        trade (dict): The trade dictionary.
+    Returns:
+        str: The key of the trade.
+    """
+    return trade.get("txid") or f"{trade['date']}|{trade['asset']}|{trade['quantity']}|{trade['total_net']}"
+
+class ReacquisitionWindow:
+    """
+    Finds the buys that reacquire an asset within 4 weeks after a loss-making sell (the Irish
+    4-week rule) and defers the disallowed part of the loss onto their cost.
+    The buys of each asset are indexed once in date order. Each asset keeps a pointer to its first
+    buy that can still count as reacquisition: sells come in date order, so buys dated up to a sell
+    or fully used by earlier sells are never looked at again and all sells of an asset scan its
+    buys about once.
+    """
+
+    def __init__(self, sorted_trades: list[dict], pending: dict[str, dict[str, list]] | None = None):
+        """
+        Args:
+            sorted_trades (list[dict]): The date sorted trades that will be matched.
+            pending (dict[str, dict[str, list]] | None): The deferred losses of a year end
+                (see pending()), e.g. of a snapshot.
+        """
+        self.buys = defaultdict(list)
+        for t in sorted_trades:
+            if t["type"] == "buy":
+                self.buys[t["asset"]].append((datetime.fromisoformat(str(t["date"])), Decimal(t["quantity"]), trade_key(t)))
+        self.next = defaultdict(int)
+        # per asset and buy key: the quantity already used as reacquisition and the loss deferred onto it
+        self.used = defaultdict(dict)
+        self.deferred = defaultdict(dict)
+        for asset, buys in (pending or {}).items():
+            for key, (used, deferred) in buys.items():
+                self.used[asset][key] = Decimal(used)
+                self.deferred[asset][key] = Decimal(deferred)
+
+    def defer_loss(self, sell: dict, qty: Decimal, loss: Decimal) -> Decimal:
+        """
+        Matches a loss-making sell against the buys of its asset within 4 weeks after it.
+        Args:
+            sell (dict): The sell trade.
+            qty (Decimal): The matched (sold) quantity the loss belongs to.
+            loss (Decimal): The loss of the sell, as a positive amount.
+        Returns:
+            Decimal: The part of the loss that is not allowed (0 without reacquisition).
+        """
+        asset = sell["asset"]
+        buys = self.buys[asset]
+        used = self.used[asset]
+        deferred = self.deferred[asset]
+        sell_date = datetime.fromisoformat(str(sell["date"]))
+        i = self.next[asset]
+        while i < len(buys) and (buys[i][0] <= sell_date or used.get(buys[i][2], 0) >= buys[i][1]):
+            i += 1
+        self.next[asset] = i
+
+        window_end = sell_date + FOUR_WEEK_WINDOW
+        remaining = qty
+        disallowed = Decimal(0)
+        # every buy passed here is used up, except the one the loop stops at
+        while remaining > 0 and i < len(buys) and buys[i][0] <= window_end:
+            _, buy_qty, key = buys[i]
+            take = min(buy_qty - used.get(key, 0), remaining)
+            if take > 0:
+                share = loss * take / qty
+                used[key] = used.get(key, 0) + take
+                deferred[key] = deferred.get(key, 0) + share
+                disallowed += share
+                remaining -= take
+            i += 1
+        return disallowed
+
+    def deferred_cost(self, buy: dict) -> Decimal:
+        """
+        Takes the losses deferred onto a buy, they are added to its cost.
+        Args:
+            buy (dict): The buy trade, at the time it is added to the FIFO queue.
+        Returns:
+            Decimal: The deferred loss (0 if none).
+        """
+        # later sells are dated from this buy on, so it can no longer be a reacquisition
+        self.used[buy["asset"]].pop(trade_key(buy), None)
+        return self.deferred[buy["asset"]].pop(trade_key(buy), Decimal(0))
+
+    def pending(self) -> dict[str, dict[str, list]]:
+        """
+        Lists the deferred losses of buys that are not matched yet, e.g. at a year end.
+        Returns:
+            dict[str, dict[str, list]]: Per asset and buy key the used quantity and the deferred loss.
+        """
+        return {
+            asset: {key: [used[key], self.deferred[asset][key]] for key in used}
+            for asset, used in self.used.items() if used
+        }
+
+# --- Helper Functions Start
+def config_cache_path(file_path: str) -> str:
+    """
+    Gets the path of the precompiled copy of a config file, in __pycache__ next to it like compiled modules.
+    Args:
+        file_path (str): The path to the config file.
+    Returns:
+        str: The path to the cache file, e.g. config/__pycache__/config.yaml.cache
+    """
+    return os.path.join(os.path.dirname(file_path), "__pycache__", os.path.basename(file_path) + ".cache")
+
+@lru_cache(maxsize=None)
+def load_config(file_path: str = CONFIG_PATH) -> dict:
+    """
+    Loads the YAML config, each file is only read and parsed once per process.
+    The parsed values are also kept in a marshal file (see config_cache_path) that is used while
+    the size and modification time of the YAML file are unchanged, so a new process does not
+    need to import or run the YAML parser.
+    Args:
+        file_path (str): The path to the config file.
+    Returns:
+        dict: The config values (shared between calls, do not modify).
+    """
+    stat = os.stat(file_path)
+    key = (stat.st_mtime_ns, stat.st_size, marshal.version)
+    cache_path = config_cache_path(file_path)
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, config = marshal.load(f)
+        if cached_key == key:
+            return config
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    import yaml
+    with open(file_path, "r") as f:
+        config = yaml.safe_load(f) or {}
+    try:
+        # values marshal can not store (e.g. YAML dates) raise ValueError, the config then stays uncached
+        data = marshal.dumps((key, config))
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # written under a temporary name first, so parallel runs never read half a file
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, cache_path)
+    except (OSError, ValueError):
+        pass
+    return config
+
+def calculate_tax(total_gain: Decimal, tax_rate: Decimal, exemption: Decimal) -> dict:
+    """
+    Applies the personal exemption and the CGT rate to the total gain of a tax year.
+    Args:
+        total_gain (Decimal): The summed gains and losses of the year.
+        tax_rate (Decimal): The CGT rate, e.g. 0.33.
+        exemption (Decimal): The personal exemption, e.g. 1270.
+    Returns:
+        dict: The total gain, the exemption used, the taxable gain and the tax due (rounded to cents).
+    """
+    exemption_used = min(max(total_gain, Decimal(0)), exemption)
+    taxable_gain = max(total_gain - exemption, Decimal(0))
+    return {
+        "total_gain": total_gain,
+        "exemption_used": exemption_used,
+        "taxable_gain": taxable_gain,
+        "tax_due": (taxable_gain * tax_rate).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP),
+    }
+
+def snapshot_lots(lots: dict[str, deque], factors: dict[str, Fraction] | None = None) -> dict[str, list[dict]]:
+    """
+    Copies the open lots of every asset, e.g. to keep the lot state at a year end.
+    Args:
+        lots (dict[str, deque]): The FIFO queues of open Lot records per asset.
+        factors (dict[str, Fraction] | None): The cumulative corporate action factor of the assets that had any.
+    Returns:
+        dict[str, list[dict]]: A copy of the open lots per asset (assets without open lots are left out),
+            in the units after the corporate actions.
+    """
+    factors = factors or {}
+    return {
+        asset: [lot.as_dict(factors[asset]) for lot in queue] if asset in factors else [lot.as_dict() for lot in queue]
+        for asset, queue in lots.items() if queue
+    }
+
+def action_factor(trade_type: str, ratio: Decimal | str) -> Fraction:
+    """
+    Gets the factor a corporate action multiplies the quantity of the open lots with.
+    Args:
+        trade_type (str): "split" (ratio: new shares per share), "bonus" (ratio: free shares per share)
+            or "consolidation" (ratio: shares per new share).
+        ratio (Decimal | str): The ratio, the trade's quantity.
+    Returns:
+        Fraction: The exact factor, e.g. 100 for a 1:100 split.
+    """
+    ratio = Fraction(str(ratio))
+    if trade_type == "split":
+        return ratio
+    if trade_type == "bonus":
+        return 1 + ratio
+    return 1 / ratio
+
+def match_sell(queue: deque, qty: Decimal, proceeds: Decimal, factor: Fraction | None = None) -> tuple[list[dict], Decimal]:
+    """
+    Matches a sell against the open buy lots of one asset (oldest first).
+    Args:
+        queue (deque): The FIFO queue of open Lot records of the sold asset.
+        qty (Decimal): The sold quantity.
+        proceeds (Decimal): The net proceeds of the sell.
+        factor (Fraction | None): The asset's cumulative corporate action factor, None if it had no corporate actions.
+    Returns:
+        tuple[list[dict], Decimal]: The matched buy details and the quantity that could not be matched.
+    """
+    qty_to_match = qty
+    details = []
+    # important: since a sell can be partial, a while loop ensures
+    # that while qty_to_match > 0 the algorithm keeps matching with
+    # remaining buys on the queue
+    while qty_to_match > 0 and queue:
+        buy_lot = queue[0]
+        # a corporate action since the lot was added is only applied now
+        if factor is not None and buy_lot.factor != factor:
+            buy_lot.rescale(factor)
+        lot_qty = buy_lot.quantity
+        match_qty = qty_to_match if qty_to_match < lot_qty else lot_qty
+
+        cost_per_unit = buy_lot.cost_per_unit
+        cost_basis = cost_per_unit * match_qty
+        # only the share of the proceeds that belongs to the matched qty
+        # counts against this buy lot
+        match_proceeds = proceeds if match_qty == qty else proceeds * match_qty / qty
+
+        details.append({
+            "used_qty": match_qty,
+            "cost_per_unit": cost_per_unit,
+            "cost_basis": cost_basis,
+            "proceeds": match_proceeds,
+            "gain": match_proceeds - cost_basis,
+            "buy_date": buy_lot.date,
+        })
+
+        # the match_qty and qty_to_match are updated and the buy_lot is
+        # removed from the queue if fully matched
+        qty_to_match -= match_qty
+        if match_qty == lot_qty:
+            queue.popleft()
+        else:
+            buy_lot.quantity = lot_qty - match_qty
+            if buy_lot.base_qty is not None:
+                # the exact quantity in the lot's own units, for later corporate actions
+                buy_lot.base_qty -= Fraction(match_qty) * buy_lot.base_factor / buy_lot.factor
+    return details, qty_to_match
+
+def hash_trades(trades: list[dict]) -> str:
+    """
+    Hashes the fields of the trades that matter for FIFO, in the given order.
+    Args:
+        trades (list[dict]): A list of date sorted trade dictionaries.
+    Returns:
+        str: The hex digest identifying these trades.
+    """
+    h = hashlib.sha256()
+    for t in trades:
+        h.update(f"{t['date']}|{t['type']}|{t['asset']}|{t['quantity']}|{t['total_net']}|{t.get('txid', '')}\n".encode())
+    return h.hexdigest()
+
+def count_trades_until(sorted_trades: list[dict], year: int) -> int:
+    """
+    Counts the trades up to and including a year end.
+    Args:
+        sorted_trades (list[dict]): A list of date sorted trade dictionaries.
+        year (int): The last year to count.
+    Returns:
+        int: The number of trades dated in or before that year.
+    """
+    return bisect_left(sorted_trades, str(year + 1), key=lambda t: str(t["date"]))
+
+def hash_snapshot_trades(sorted_trades: list[dict], year: int, four_week_rule: bool = False) -> str:
+    """
+    Hashes the trades a lot snapshot depends on: those up to the year end and, with the
+    4-week rule, also the buys of the first 4 weeks after it that can take deferred losses.
+    Args:
+        sorted_trades (list[dict]): A list of date sorted trade dictionaries.
+        year (int): The year of the snapshot.
+        four_week_rule (bool): True if the snapshot was made with the 4-week rule.
+    Returns:
+        str: The hex digest identifying these trades (see hash_trades).
+    """
+    end = count_trades_until(sorted_trades, year)
+    if four_week_rule:
+        window_end = str((datetime(year + 1, 1, 1) + FOUR_WEEK_WINDOW).date())
+        end = bisect_left(sorted_trades, window_end, key=lambda t: str(t["date"]))
+    return hash_trades(sorted_trades[:end])
+
+def save_lot_snapshot(file_path: str, year: int, trades_hash: str, open_lots: dict[str, list[dict]],
+                      deferred_losses: dict[str, dict[str, list]] | None = None) -> None:
+    """
+    Saves the open lots at a year end to a compact JSON file.
+    Args:
+        file_path (str): The path to the snapshot file.
+        year (int): The year the lot state belongs to (state at 31 Dec).
+        trades_hash (str): The hash of all trades up to that year end (see hash_snapshot_trades).
+        open_lots (dict[str, list[dict]]): The open lots per asset.
+        deferred_losses (dict[str, dict[str, list]] | None): The losses deferred onto later buys
+            (see ReacquisitionWindow.pending), None if the 4-week rule is off.
+    """
+    snapshot = {
+        "year": year,
+        "trades_hash": trades_hash,
+        "lots": {
+            asset: [[str(l["quantity"]), str(l["total_net"]), str(l["original_qty"]), str(l["date"])] for l in asset_lots]
+            for asset, asset_lots in open_lots.items()
+        },
+    }
+    if deferred_losses is not None:
+        snapshot["four_week_rule"] = True
+        snapshot["deferred_losses"] = {
+            asset: {key: [str(used), str(loss)] for key, (used, loss) in buys.items()}
+            for asset, buys in deferred_losses.items()
+        }
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+
+def load_lot_snapshot(file_path: str) -> dict | None:
+    """
+    Loads a lot snapshot saved by save_lot_snapshot.
+    Args:
+        file_path (str): The path to the snapshot file.
+    Returns:
+        dict | None: The snapshot with "year", "trades_hash", the open lots per asset ("lots") and,
+            if made with the 4-week rule, the deferred losses ("deferred_losses"), None if there is none.
+    """
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, "r") as f:
+            snapshot = json.load(f)
+        snapshot["lots"] = {
+            asset: [
+                {"quantity": Decimal(q), "total_net": Decimal(n), "original_qty": Decimal(o), "date": d}
+                for q, n, o, d in asset_lots
+            ]
+            for asset, asset_lots in snapshot["lots"].items()
+        }
+        return snapshot
+    except (ValueError, KeyError, TypeError):
+        print(f"WARNING: Ignoring unreadable lot snapshot {file_path}")
+        return None
+
+# --- Helper Functions End
+
+def fifo_sweep(sorted_trades: list[dict], initial_lots: dict[str, list[dict]] | None = None, start_year: int | None = None,
+               four_week_rule: bool = False, deferred_losses: dict[str, dict[str, list]] | None = None,
+               open_lots_years: set[int] | None = None, fixed_point_scales: tuple[int, int] | None = None) -> dict[int, dict]:
+    """
+    Runs the FIFO matching over date sorted trades, the core of calculate_fifo_all_years.
+    Args:
+        sorted_trades (list[dict]): A list of date sorted trade dictionaries.
+        initial_lots (dict[str, list[dict]] | None): The open lots per asset to start from (e.g. of a snapshot).
+        start_year (int | None): The year initial_lots belong to, it is left out of the results.
+        four_week_rule (bool): True to apply the 4-week rule: the loss of a sell is not allowed as far
+            as the asset is bought again within 4 weeks, it is added to the cost of those buys instead.
+        deferred_losses (dict[str, dict[str, list]] | None): The losses deferred at the end of start_year.
+        open_lots_years (set[int] | None): The years whose year end lot state is needed, None for every
+            year. The lot state of the last year is always kept.
+        fixed_point_scales (tuple[int, int] | None): The quantity and amount scales to match on
+            scaled integers (see fixed_point.py), None to match on Decimals.
+    Returns:
+        dict[int, dict]: Per tax year the sold lots ("sold_lots"), the summed gain
+            ("total_gain") and the open lots per asset at the year end ("open_lots", see open_lots_years).
+            With the 4-week rule, sold lots have the "disallowed_loss" and each year with open lots the
+            losses deferred onto buys of the next year ("deferred_losses").
+    Split, bonus and consolidation trades multiply the asset's cumulative factor, the open lots
+    are rescaled to it when they are matched (or copied to the results), so a corporate action
+    costs the same however many lots are open.
     """
+    if four_week_rule and fixed_point_scales:
+        raise ValueError("The 4-week rule is not supported in fixed-point mode")
+    window = ReacquisitionWindow(sorted_trades, deferred_losses) if four_week_rule else None
     lots = defaultdict(deque)
+    # cumulative corporate action factor per asset, only of assets that had any
+    factors = {}
+    years = {}
+    current_year = start_year
+
+    # numbers of trades loaded for the fixed-point mode are scaled ints already, others are converted here
+    if fixed_point_scales:
+        qty_scale, amount_scale = fixed_point_scales
+        parse_qty = partial(as_fixed, scale=qty_scale, exact=True)
+        parse_amount = partial(as_fixed, scale=amount_scale)
+        new_lot = partial(FixedLot, scales=fixed_point_scales)
+        match = partial(match_sell_fixed, scales=fixed_point_scales)
+        to_decimal = partial(from_fixed, scale=qty_scale)
+    else:
+        parse_qty = parse_amount = Decimal
+        new_lot = Lot
+        match = match_sell
+        def to_decimal(qty):
+            return qty
+
+    for asset, asset_lots in (initial_lots or {}).items():
+        lots[asset].extend(
+            new_lot(parse_qty(l["quantity"]), parse_amount(l["total_net"]), parse_qty(l["original_qty"]), l["date"])
+            for l in asset_lots
+        )
+
+    # counters are only kept while profiling, so the loop stays lean otherwise
+    profiling = profiling_enabled()
+    peaks = {}
+    lots_created = partial_matches = matches = 0
+
+    for trade in sorted_trades:
+        # normalized dates are ISO formatted, so the year is the first 4 chars
+        year = int(str(trade["date"])[:4])
+        if year != current_year:
+            # close every year between the last trade and this one
+            if current_year is not None:
+                for closed_year in range(current_year, year):
+                    if closed_year == start_year:
+                        continue
+                    years.setdefault(closed_year, {"sold_lots": [], "total_gain": Decimal(0)})
+                    # copying the lots costs time with many open lots, so only where needed
+                    if open_lots_years is None or closed_year in open_lots_years:
+                        years[closed_year]["open_lots"] = snapshot_lots(lots, factors)
+                        if window:
+                            years[closed_year]["deferred_losses"] = window.pending()
+            current_year = year
+            years.setdefault(year, {"sold_lots": [], "total_gain": Decimal(0)})
+
+        asset = trade["asset"]
+        qty = parse_qty(trade["quantity"])
+        # if a buy push the qty to the FIFO queue
+        if trade["type"] == "buy":
+            queue = lots[asset]
+            total_net = parse_amount(trade["total_net"])
+            if window:
+                total_net += window.deferred_cost(trade)
+            lot = new_lot(qty, total_net, qty, trade["date"])
+            if asset in factors:
+                lot.factor = factors[asset]
+            queue.append(lot)
+            if profiling:
+                lots_created += 1
+                if len(queue) > peaks.get(asset, 0):
+                    peaks[asset] = len(queue)
+        # if a sell, find buys in the queue to match qty
+        elif trade["type"] == "sell":
+            queue = lots[asset]
+            depth = len(queue)
+            if asset in factors:
+                details, unmatched_qty = match(queue, qty, parse_amount(trade["total_net"]), factors[asset])
+            else:
+                details, unmatched_qty = match(queue, qty, parse_amount(trade["total_net"]))
+            if profiling:
+                matches += len(details)
+                # a matched lot that is still in the queue was only partly used
+                partial_matches += len(details) - (depth - len(queue))
+            qty = to_decimal(qty)
+            if unmatched_qty > 0:
+                print(f"WARNING: Unmatched sell quantity for asset: {asset}. Remaining quantity: {to_decimal(unmatched_qty)}")
+
+            total_gain = sum(d["gain"] for d in details)
+            sold_lot = {
+                "date": trade["date"],
+                "asset": asset,
+                "type": "sell",
+                "quantity": qty,
+                "total_gain": total_gain,
+                "details": details,
+            }
+            if window:
+                disallowed = Decimal(0)
+                if total_gain < 0:
+                    disallowed = window.defer_loss(trade, sum(d["used_qty"] for d in details), -total_gain)
+                # the details keep the full loss, the disallowed part is taken out of the total
+                total_gain += disallowed
+                sold_lot["total_gain"] = total_gain
+                sold_lot["disallowed_loss"] = disallowed
+            years[year]["sold_lots"].append(sold_lot)
+            years[year]["total_gain"] += total_gain
+        # a split, bonus or consolidation only updates the asset's factor
+        elif trade["type"] in ("split", "bonus", "consolidation"):
+            if fixed_point_scales:
+                raise ValueError(f"Corporate actions are not supported in fixed-point mode ({trade['type']} of {asset})")
+            factors[asset] = factors.get(asset, Fraction(1)) * action_factor(trade["type"], trade["quantity"])
+
+    if current_year in years:
+        years[current_year]["open_lots"] = snapshot_lots(lots, factors)
+        if window:
+            years[current_year]["deferred_losses"] = window.pending()
 
-    sold_lots = []
+    if profiling:
+        count("lots_created", lots_created)
+        count("lot_matches", matches)
+        count("partial_matches", partial_matches)
+        record_queue_depth(peaks)
+    return years
 
+def partition_by_asset(sorted_trades: list[dict], partitions: int) -> list[list[dict]]:
+    """
+    Splits date sorted trades into partitions that never share an asset, balanced by trade count.
+    Args:
+        sorted_trades (list[dict]): A list of date sorted trade dictionaries.
+        partitions (int): The maximum number of partitions.
+    Returns:
+        list[list[dict]]: The partitions, each still date sorted.
+    """
+    counts = defaultdict(int)
+    for t in sorted_trades:
+        counts[t["asset"]] += 1
+
+    # biggest assets first, each into the partition with the fewest trades so far
+    sizes = [(0, i) for i in range(min(partitions, len(counts)))]
+    assignment = {}
+    for asset in sorted(counts, key=counts.get, reverse=True):
+        size, i = heapq.heappop(sizes)
+        assignment[asset] = i
+        heapq.heappush(sizes, (size + counts[asset], i))
+
+    result = [[] for _ in sizes]
+    for t in sorted_trades:
+        result[assignment[t["asset"]]].append(t)
+    return result
+
+def merge_partition_years(sorted_trades: list[dict], partitions: list[list[dict]], partition_years: list[dict[int, dict]],
+                          start_year: int | None, open_lots_years: set[int] | None = None) -> dict[int, dict]:
+    """
+    Merges the results of fifo_sweep over asset partitions into the results of one sweep.
+    Sold lots are merged back in the order of the date sorted trades.
+    Args:
+        sorted_trades (list[dict]): All date sorted trade dictionaries.
+        partitions (list[list[dict]]): The partitions of sorted_trades (see partition_by_asset).
+        partition_years (list[dict[int, dict]]): The fifo_sweep results per partition.
+        start_year (int | None): The year the sweeps started from, it is left out of the results.
+        open_lots_years (set[int] | None): The years the sweeps kept the open lots of, None for every year.
+    Returns:
+        dict[int, dict]: The merged per tax year results.
+    """
+    if not sorted_trades:
+        return {}
+    first_year = int(str(sorted_trades[0]["date"])[:4]) if start_year is None else start_year + 1
+    last_year = int(str(sorted_trades[-1]["date"])[:4])
+
+    # the position of each sell in the full trade list decides the merge order,
+    # a partition's sold lots come out in the same order as its sells
+    position = {id(t): i for i, t in enumerate(sorted_trades) if t["type"] == "sell"}
+    sell_positions = [iter([position[id(t)] for t in trades if t["type"] == "sell"]) for trades in partitions]
+    # assets are listed in the order they first show up, like in a single sweep
+    first_seen = {}
+    for t in sorted_trades:
+        first_seen.setdefault(t["asset"], len(first_seen))
+
+    years = {}
+    for year in range(first_year, last_year + 1):
+        tagged = [
+            [(next(positions), lot) for lot in p_years.get(year, {}).get("sold_lots", [])]
+            for positions, p_years in zip(sell_positions, partition_years)
+        ]
+        sold_lots = [lot for _, lot in heapq.merge(*tagged, key=lambda x: x[0])]
+        years[year] = {
+            "sold_lots": sold_lots,
+            # added up in sell order like in a single sweep, Decimal sums are rounded per addition
+            "total_gain": sum((lot["total_gain"] for lot in sold_lots), Decimal(0)),
+        }
+        if open_lots_years is not None and year not in open_lots_years and year != last_year:
+            continue
+        open_lots = {}
+        deferred_losses = None
+        for p_years in partition_years:
+            # a partition without trades in this year keeps the lot state of its last year before
+            # (a sweep always keeps the lot state of its last year)
+            known = [y for y in p_years if y <= year]
+            if known:
+                open_lots.update(p_years[max(known)]["open_lots"])
+                if "deferred_losses" in p_years[max(known)]:
+                    deferred_losses = {**(deferred_losses or {}), **p_years[max(known)]["deferred_losses"]}
+        years[year]["open_lots"] = dict(sorted(open_lots.items(), key=lambda item: first_seen.get(item[0], -1)))
+        if deferred_losses is not None:
+            years[year]["deferred_losses"] = deferred_losses
+    return years
+
+def calculate_fifo_all_years(trades: list[dict], snapshot_path: str | None = None, from_year: int | None = None,
+                             workers: int = 1, four_week_rule: bool = False, open_lots: bool = True,
+                             fixed_point_scales: tuple[int, int] | None = None) -> dict[int, dict]:
+    """
+    Calculate FIFO capital gains for every tax year in one pass over the trades.
+    Sells of every year use up buy lots, so each year is matched against the right lots.
+    With a snapshot_path, the open lots of the last closed year are loaded from (and saved to)
+    that file, so only later trades are replayed. The snapshot is only used while the trades
+    up to its year end are unchanged.
+    With more than one worker, the assets are split over a process pool and matched in parallel,
+    FIFO queues are independent per asset so the results are the same as with one worker.
+    Args:
+        trades (list[dict]): A list of trade dictionaries.
+        snapshot_path (str | None): The path to the lot snapshot file, None to replay all history.
+        from_year (int | None): The first year results are needed for, older snapshots only.
+        workers (int): The number of worker processes, 1 to match in this process.
+        four_week_rule (bool): True to apply the 4-week rule to losses (see fifo_sweep).
+        open_lots (bool): False if only the sold lots are needed, the open lots are then only copied
+            at the year ends the snapshot and the sweep need.
+        fixed_point_scales (tuple[int, int] | None): The quantity and amount scales to match on
+            scaled integers (see fixed_point.py), None to match on Decimals.
+    Returns:
+        dict[int, dict]: Per tax year the sold lots ("sold_lots"), the summed gain
+            ("total_gain") and the open lots per asset at the year end ("open_lots", see open_lots).
+            When resuming from a snapshot, only the years after the snapshot are included.
+    """
+    # For FIFO it's important that that tx are sorted by date, this is the only sort
+    with stage("fifo_sort"):
+        sorted_trades = sorted(trades, key=lambda t: str(t["date"]))
+    start = 0
+    initial_lots = {}
+    deferred_losses = {}
+    start_year = None
+
+    with stage("fifo_snapshot_load"):
+        snapshot = load_lot_snapshot(snapshot_path) if snapshot_path else None
+        # a snapshot made with the 4-week rule on or off is only used in the same mode
+        if (snapshot and (from_year is None or snapshot["year"] < from_year)
+                and snapshot.get("four_week_rule", False) == four_week_rule):
+            # an added or changed trade up to the snapshot year end changes the hash
+            if hash_snapshot_trades(sorted_trades, snapshot["year"], four_week_rule) == snapshot["trades_hash"]:
+                initial_lots = snapshot["lots"]
+                deferred_losses = snapshot.get("deferred_losses", {})
+                start = count_trades_until(sorted_trades, snapshot["year"])
+                start_year = snapshot["year"]
+    count("trades_replayed", len(sorted_trades) - start)
+
+    todo = sorted_trades[start:]
+    # the year before the latest trade is closed, its lot state is kept for the next run
+    closed_year = int(str(sorted_trades[-1]["date"])[:4]) - 1 if sorted_trades else None
+    open_lots_years = None if open_lots else ({closed_year} if snapshot_path else set())
+    partitions = partition_by_asset(todo, workers) if workers > 1 else []
+    if len(partitions) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        # counters of the worker processes are not collected, only the stage time
+        with stage("fifo_sweep"), ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    fifo_sweep, part,
+                    {asset: initial_lots[asset] for asset in {t["asset"] for t in part} if asset in initial_lots},
+                    start_year, four_week_rule,
+                    {asset: deferred_losses[asset] for asset in {t["asset"] for t in part} if asset in deferred_losses},
+                    open_lots_years, fixed_point_scales,
+                )
+                for part in partitions
+            ]
+            partition_years = [f.result() for f in futures]
+        years = merge_partition_years(todo, partitions, partition_years, start_year, open_lots_years)
+        # assets of the snapshot without newer trades keep their lots
+        traded = {t["asset"] for t in todo}
+        idle_lots = {asset: asset_lots for asset, asset_lots in initial_lots.items() if asset not in traded}
+        for result in years.values():
+            if "open_lots" in result:
+                result["open_lots"] = {**idle_lots, **result["open_lots"]}
+    else:
+        with stage("fifo_sweep"):
+            years = fifo_sweep(todo, initial_lots, start_year, four_week_rule, deferred_losses, open_lots_years, fixed_point_scales)
+
+    if snapshot_path and sorted_trades:
+        if closed_year in years:
+            with stage("fifo_snapshot_save"):
+                save_lot_snapshot(
+                    snapshot_path, closed_year, hash_snapshot_trades(sorted_trades, closed_year, four_week_rule),
+                    years[closed_year]["open_lots"], years[closed_year].get("deferred_losses"),
+                )
+    return years
+
+def calculate_fifo(trades: list[dict], tax_year: int, snapshot_path: str | None = None,
+                   workers: int = 1, four_week_rule: bool = False, fixed_point_scales: tuple[int, int] | None = None) -> list[dict]:
+    """
+    Calculate FIFO (First In, First Out) capital gains for a list of trades.
+    Args:
+        trades (list[dict]): A list of trade dictionaries.
+        tax_year (int): The tax year to report sells for.
+        snapshot_path (str | None): The path to the lot snapshot file, None to replay all history.
+        workers (int): The number of worker processes that match assets in parallel.
+        four_week_rule (bool): True to apply the 4-week rule to losses (see fifo_sweep).
+        fixed_point_scales (tuple[int, int] | None): The quantity and amount scales for the
+            fixed-point mode, None to match on Decimals.
+    Returns:
+        list[dict]: A list of capital gain dictionaries.
+    """
     #First Check if sells in chosen tax year
-    if not any(trade["type"] == "sell" and datetime.fromisoformat(trade["date"]).year == tax_year for trade in trades):
+    if not any(trade["type"] == "sell" and datetime.fromisoformat(str(trade["date"])).year == tax_year for trade in trades):
         print(f"WARNING: No sell trade found in tax year {tax_year}")
     else:
-        # For FIFO it's important that that tx are sorted by date
-        # trade in this for loop accesses the dicts in trades
-        for trade in sorted(trades, key=lambda t: t["date"]): 
-            asset = trade["asset"]
-            qty = Decimal(trade["quantity"])
-            # if a buy push the qty to the FIFO queue
-            if trade["type"] == "buy":
-                lots[asset].append({
-                    "quantity": qty,
-                    "total_net": Decimal(trade["total_net"]),
-                    "original_qty": qty,
-                    "date": trade["date"]
-                })
-            # if sell in tax_year , find a buy in queue to match qty
-            elif trade["type"] == "sell" and datetime.fromisoformat(trade["date"]).year == tax_year:
-                qty_to_match = qty
-                details = []
-
-                proceeds = Decimal(trade["total_net"])
-                # important: since a sell can be partial, a while loop ensures
-                # that while qty_to_match > 0 the algorithm keeps matching with
-                # remaining buys on the queue
-                while qty_to_match > 0 and lots[asset]:
-                    buy_lot = lots[asset][0]
-                    match_qty = min(qty_to_match, buy_lot["quantity"])
-
-                    # each trade has a total net value, which divided by it's original
-                    # qty is the cost per unit, this can be used to calculate cost_basis
-                    cost_per_unit = buy_lot["total_net"] / buy_lot["original_qty"]
-                    cost_basis = cost_per_unit * match_qty
-                    gain = proceeds - cost_basis
-
-                    details.append({
-                        "used_qty": match_qty,
-                        "cost_per_unit": cost_per_unit,
-                        "cost_basis": cost_basis,
-                        "gain": gain,
-                        "buy_date": buy_lot["date"],
-                    })
-
-                    # the match_qty and qty_to_match are updated and the buy_lot is
-                    # removed from the queue if fully matched
-                    buy_lot["quantity"] -= match_qty
-                    qty_to_match -= match_qty
-                    if buy_lot["quantity"] == 0:
-                        lots[asset].popleft()
-                if qty_to_match > 0:
-                    print(f"WARNING: Unmatched sell quantity for asset: {asset}. Remaining quantity: {qty_to_match}")
-
-                total_gain = sum(d["gain"] for d in details)
-
-                sold_lots.append({
-                    "date": trade["date"],
-                    "asset": asset,
-                    "type": "sell",
-                    "quantity": qty,
-                    "total_gain": total_gain,
-                    "details": details,
-                })
-        return sold_lots
\ No newline at end of file
+        # sells from earlier years still use up lots, so the whole history is matched
+        return calculate_fifo_all_years(trades, snapshot_path, from_year=tax_year, workers=workers,
+                                        four_week_rule=four_week_rule, open_lots=False,
+                                        fixed_point_scales=fixed_point_scales)[tax_year]["sold_lots"]
@@ -0,0 +1,192 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+from collections import deque
+from functools import lru_cache
+
+# --- Default scales (number of decimals kept) for the fixed-point mode
+QUANTITY_SCALE = 8
+AMOUNT_SCALE = 4
+
+# --- Lot Record
+class FixedLot:
+    """
+    An open buy lot in a FIFO queue with quantities and amounts stored as scaled integers.
+    The results are Decimals, the lot converts its numbers for them once when it is created
+    (like Lot, the cost per unit too) and its remaining quantity when that changed.
+    """
+    __slots__ = ("quantity", "total_net", "original_qty", "date", "cost_per_unit", "qty_unit", "decimals")
+
+    def __init__(self, quantity: int, total_net: int, original_qty: int, date: str, scales: tuple[int, int]):
+        self.quantity = quantity
+        self.total_net = total_net
+        self.original_qty = original_qty
+        self.date = date
+        self.qty_unit = scale_unit(scales[0])
+        decimal_total_net = Decimal(total_net) * scale_unit(scales[1])
+        decimal_original_qty = Decimal(original_qty) * self.qty_unit
+        self.cost_per_unit = decimal_total_net / decimal_original_qty if original_qty else Decimal(0)
+        # the remaining quantity the Decimals belong to, then the lot's numbers as Decimals
+        self.decimals = (quantity, Decimal(quantity) * self.qty_unit, decimal_total_net, decimal_original_qty)
+
+    def as_dict(self) -> dict:
+        """
+        Converts the lot to the dictionary layout used in the results.
+        Returns:
+            dict: The lot's quantity, total_net, original_qty and date as Decimals.
+        """
+        # the lot is copied at every year end, most lots did not change since the last copy
+        if self.decimals[0] != self.quantity:
+            self.decimals = (self.quantity, Decimal(self.quantity) * self.qty_unit) + self.decimals[2:]
+        return {
+            "quantity": self.decimals[1],
+            "total_net": self.decimals[2],
+            "original_qty": self.decimals[3],
+            "date": self.date,
+        }
+
+# --- Helper Functions Start
+def to_fixed(value, scale: int, exact: bool = False) -> int:
+    """
+    Converts a number to a scaled integer, e.g. to_fixed("1.5", 4) -> 15000.
+    Args:
+        value: The number as a string or Decimal.
+        scale (int): The number of decimals to keep.
+        exact (bool): If True, raise instead of rounding digits beyond the scale.
+    Returns:
+        int: The value multiplied by 10**scale (rounded half even).
+    """
+    scaled = Decimal(value).scaleb(scale)
+    fixed = int(scaled) if exact else int(scaled.to_integral_value(ROUND_HALF_EVEN))
+    if exact and fixed != scaled:
+        raise ValueError(f"{value} has more than {scale} decimals, increase the scale in config.yaml")
+    return fixed
+
+def as_fixed(value, scale: int, exact: bool = False) -> int:
+    """
+    Converts a number to a scaled integer unless it already is one (converted once when the
+    trades were loaded, see fixed_scales).
+    Args:
+        value: The number as a string, Decimal or scaled integer.
+        scale (int): The number of decimals to keep.
+        exact (bool): If True, raise instead of rounding digits beyond the scale.
+    Returns:
+        int: The scaled integer.
+    """
+    return value if type(value) is int else to_fixed(value, scale, exact)
+
+def rescale(coefficient: int, exponent: int, scale: int, exact: bool = False) -> int:
+    """
+    Converts a number stored as integer coefficient and exponent (see columnar_store.split_decimal)
+    to a scaled integer, on ints only, e.g. rescale(15, -1, 4) -> 15000.
+    Args:
+        coefficient (int): The coefficient, value == coefficient * 10**exponent.
+        exponent (int): The decimal exponent.
+        scale (int): The number of decimals to keep.
+        exact (bool): If True, raise instead of rounding digits beyond the scale.
+    Returns:
+        int: The value multiplied by 10**scale (rounded half even).
+    """
+    shift = exponent + scale
+    if shift >= 0:
+        return coefficient * 10 ** shift
+    fixed = div_round(coefficient, 10 ** -shift)
+    if exact and fixed * 10 ** -shift != coefficient:
+        raise ValueError(f"{Decimal(coefficient).scaleb(exponent)} has more than {scale} decimals, increase the scale in config.yaml")
+    return fixed
+
+def fixed_scales(scales: tuple[int, int]) -> dict[str, tuple[int, bool]]:
+    """
+    Gets the fields of a normalized trade that FIFO reads as scaled integers.
+    Args:
+        scales (tuple[int, int]): The quantity and amount scales.
+    Returns:
+        dict[str, tuple[int, bool]]: Per field its scale and if it must fit the scale exactly.
+    """
+    qty_scale, amount_scale = scales
+    # a rounded quantity would change which lots a sell uses, so it has to fit
+    return {"quantity": (qty_scale, True), "total_net": (amount_scale, False)}
+
+@lru_cache(maxsize=None)
+def scale_unit(scale: int) -> Decimal:
+    """
+    Gets the value of 1 at a scale, e.g. scale_unit(4) -> Decimal("0.0001").
+    Args:
+        scale (int): The number of decimals.
+    Returns:
+        Decimal: 10**-scale, multiplying an integer by it is exact and faster than scaleb().
+    """
+    return Decimal(1).scaleb(-scale)
+
+def from_fixed(value: int, scale: int) -> Decimal:
+    """
+    Converts a scaled integer back to a Decimal, e.g. from_fixed(15000, 4) -> Decimal("1.5000").
+    Args:
+        value (int): The scaled integer.
+        scale (int): The number of decimals it holds.
+    Returns:
+        Decimal: The exact decimal value.
+    """
+    return Decimal(value) * scale_unit(scale)
+
+def div_round(numerator: int, denominator: int) -> int:
+    """
+    Divides two integers and rounds half even, without going through floats.
+    Args:
+        numerator (int): The dividend.
+        denominator (int): The divisor (not 0).
+    Returns:
+        int: The rounded quotient.
+    """
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    quotient, remainder = divmod(numerator, denominator)
+    twice = 2 * remainder
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+def match_sell_fixed(queue: deque, qty: int, proceeds: int, scales: tuple[int, int]) -> tuple[list[dict], int]:
+    """
+    Matches a sell against the open FixedLot records of one asset (oldest first), on plain ints.
+    Works like fifo.match_sell, cost basis and proceeds shares are rounded to the amount scale.
+    Args:
+        queue (deque): The FIFO queue of open FixedLot records of the sold asset.
+        qty (int): The sold quantity (scaled).
+        proceeds (int): The net proceeds of the sell (scaled).
+        scales (tuple[int, int]): The quantity and amount scales.
+    Returns:
+        tuple[list[dict], int]: The matched buy details (as Decimals) and the scaled quantity that could not be matched.
+    """
+    qty_unit, amount_unit = scale_unit(scales[0]), scale_unit(scales[1])
+    qty_to_match = qty
+    details = []
+    while qty_to_match > 0 and queue:
+        buy_lot = queue[0]
+        lot_qty = buy_lot.quantity
+        match_qty = qty_to_match if qty_to_match < lot_qty else lot_qty
+
+        if match_qty == buy_lot.original_qty:
+            cost_basis = buy_lot.total_net
+        else:
+            cost_basis = div_round(buy_lot.total_net * match_qty, buy_lot.original_qty)
+        match_proceeds = proceeds if match_qty == qty else div_round(proceeds * match_qty, qty)
+
+        cost_basis = Decimal(cost_basis) * amount_unit
+        match_proceeds = Decimal(match_proceeds) * amount_unit
+        details.append({
+            "used_qty": Decimal(match_qty) * qty_unit,
+            "cost_per_unit": buy_lot.cost_per_unit,
+            "cost_basis": cost_basis,
+            "proceeds": match_proceeds,
+            # both have amount_scale decimals, so the difference is exact
+            "gain": match_proceeds - cost_basis,
+            "buy_date": buy_lot.date,
+        })
+
+        qty_to_match -= match_qty
+        if match_qty == lot_qty:
+            queue.popleft()
+        else:
+            buy_lot.quantity = lot_qty - match_qty
+    return details, qty_to_match
+
+# --- Helper Functions End
@@ -2,13 +2,19 @@ import inspect
 import normalization
 import app
 import fifo
+import fixed_point
+import columnar_store
+import adapters
+import query
+import watch
+import profiling
 
 # --- Marker Definition
 start_marker = "<!-- FUNCTION_REFERENCE_START -->"
 end_marker = "<!-- FUNCTION_REFERENCE_END -->"
 
 # --- List of modules to document
-scripts = [normalization, fifo, app]
+scripts = [normalization, fifo, fixed_point, columnar_store, adapters, query, watch, profiling, app]
 
 # --- New Content to Insert
 func_docs = ""
@@ -16,8 +22,10 @@ func_docs = ""
 # -- Loop through all scripts to get doc-strings
 for script in scripts:
     func_docs += f'### Module: {script.__name__}.py\n\n'
-    # For every function in a module, extract its documentation
+    # For every function defined in a module (not imported from another one), extract its documentation
     for name, func in inspect.getmembers(script, inspect.isfunction):
+        if func.__module__ != script.__name__:
+            continue
         func_docs += f'#### `{name}{inspect.signature(func)}` \n\n {inspect.getdoc(func)} \n\n'
 
 # --- Read the existing README content
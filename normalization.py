@@ -1,14 +1,28 @@
 import csv
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
 from decimal import Decimal, InvalidOperation
 import hashlib
+import io
+from functools import lru_cache
+from operator import itemgetter
 import os
+import sqlite3
+from typing import Iterator
+from columnar_store import COLUMNAR_SUFFIX, ColumnarStore, append_columnar_store
+from profiling import count, stage, timed
 
 # --- Definition of valid trade types/ required fields
-VALID_TRADE_TYPES = ["buy", "sell"]
+VALID_TRADE_TYPES = ["buy", "sell", "split", "bonus", "consolidation"]
+# corporate actions change the quantity of the open lots, their Quantity is the ratio
+# (split: new shares per share, bonus: free shares per share, consolidation: shares per new share)
+CORPORATE_ACTION_TYPES = ["split", "bonus", "consolidation"]
 REQUIRED_FIELDS = ["Date", "Type", "Asset", "Quantity", "Price"]
 EXPECTED_COLUMNS = ["Date", "Type", "Asset", "Quantity", "Price", "Fees", "Notes"]
 
+# --- Number of input rows that are validated/ normalized/ written at once
+CHUNK_SIZE = 10000
+
 # --- Helper Functions Start
 def is_valid_number(num: str) -> bool:
     """
@@ -24,6 +38,17 @@ def is_valid_number(num: str) -> bool:
     except (ValueError, TypeError, InvalidOperation):
         return False
 
+def is_valid_ratio(num: str) -> bool:
+    """
+    Checks if a valid number is usable as the ratio of a corporate action.
+    Args:
+        num (str): The number (see is_valid_number).
+    Returns:
+        bool: True if the number is finite and greater than 0 (NaN and Infinity are not).
+    """
+    ratio = Decimal(num)
+    return ratio.is_finite() and ratio > 0
+
 def is_valid_date(date_str: str) -> bool:
     """
     Checks if a string is a valid date.
@@ -38,16 +63,31 @@ def is_valid_date(date_str: str) -> bool:
     except (ValueError, TypeError):
         return False
 
-def check_valid_input(raw_trades: list[dict]) -> list[str]:
+def utc_date(date_str: str) -> datetime:
+    """
+    Parses a valid date, a time with an offset is converted to UTC without offset, so dates with
+    and without an offset can be compared.
+    Args:
+        date_str (str): The date string (see is_valid_date).
+    Returns:
+        datetime: The date without time zone.
+    """
+    date = datetime.fromisoformat(date_str)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+def check_valid_input(raw_trades: list[dict], start_line: int = 2) -> list[str]:
     """
     Checks if the input trades are valid.
     Args:
         raw_trades (list): The list of raw trade dictionaries to validate.
+        start_line (int): The line number of the first trade, for chunks further down the file.
     Returns:
         str: A report of any errors found.
     """
     error_report = []
-    for line_num, t in enumerate(raw_trades, start=2):  # start=2 to account for header row
+    for line_num, t in enumerate(raw_trades, start=start_line):  # start=2 to account for header row
         
         row_errors = []
 
@@ -72,6 +112,10 @@ def check_valid_input(raw_trades: list[dict]) -> list[str]:
         for num_field in ["Price", "Quantity"]:
             if not is_valid_number(t.get(num_field, "")):
                 row_errors.append(f"Invalid value for {num_field}: '{t.get(num_field)}' (e.g. 123.45 or 123)")
+        # Check for a positive ratio of corporate actions
+        trade_type = t.get("Type", "").strip().lower()
+        if trade_type in CORPORATE_ACTION_TYPES and is_valid_number(t.get("Quantity", "")) and not is_valid_ratio(t["Quantity"]):
+            row_errors.append(f"Invalid ratio for {trade_type}: '{t.get('Quantity')}' (must be a number greater than 0)")
         # Check for valid fee field
         fee_val = t.get("Fees", "").strip()
         if fee_val not in ["", None] and not is_valid_number(fee_val):
@@ -85,6 +129,122 @@ def check_valid_input(raw_trades: list[dict]) -> list[str]:
             error_report.append(f"Line {line_num}: " + "; ".join(row_errors))
     return error_report    
 
+def column_is_valid(field: str, column: list[str]) -> bool:
+    """
+    Checks a whole input column at once, with the parsing done in C (map) instead of a
+    Python loop per row. True means check_valid_input has no error for any of the values.
+    Args:
+        field (str): The input column.
+        column (list[str]): The values of the column.
+    Returns:
+        bool: True if every value is valid, False if at least one value is not (or might not be).
+    """
+    try:
+        if field == "Date":
+            # a value that parses is never empty
+            deque(map(datetime.fromisoformat, map(str.strip, column)), maxlen=0)
+        elif field == "Type":
+            return set(map(str.lower, map(str.strip, column))) <= set(VALID_TRADE_TYPES)
+        elif field in ("Quantity", "Price"):
+            deque(map(Decimal, column), maxlen=0)
+        elif field == "Fees":
+            deque(map(Decimal, filter(None, map(str.strip, column))), maxlen=0)
+        else:
+            return all(map(str.strip, column))
+    except (ValueError, TypeError, InvalidOperation):
+        return False
+    return True
+
+def value_is_valid(field: str, value: str) -> bool:
+    """
+    Checks one value of an input column, exactly like check_valid_input does.
+    Args:
+        field (str): The input column.
+        value (str): The value to check.
+    Returns:
+        bool: True if check_valid_input has no error for the value.
+    """
+    if field == "Date":
+        return bool(value.strip()) and is_valid_date(value.strip())
+    if field == "Type":
+        return value.strip().lower() in VALID_TRADE_TYPES
+    if field in ("Quantity", "Price"):
+        return bool(value.strip()) and is_valid_number(value)
+    if field == "Fees":
+        return not value.strip() or is_valid_number(value.strip())
+    return bool(value.strip())
+
+def check_valid_columns(raw_trades: list[dict], start_line: int = 2) -> list[str]:
+    """
+    Batched version of check_valid_input, gives the same report.
+    Checks column by column. Only a column that is not valid as a whole is checked value by
+    value (each distinct value once), and only the rows with a bad value are then run through
+    check_valid_input to format their messages.
+    Args:
+        raw_trades (list): The list of raw trade dictionaries to validate.
+        start_line (int): The line number of the first trade, for chunks further down the file.
+    Returns:
+        list[str]: A report of any errors found.
+    """
+    if not raw_trades:
+        return []
+    # unexpected header columns are an error on every row, no need to batch
+    if set(raw_trades[0]) - set(EXPECTED_COLUMNS):
+        return check_valid_input(raw_trades, start_line)
+
+    # rows with too many fields have the extra values under the key None
+    bad_rows = {i for i, t in enumerate(raw_trades) if None in t}
+    columns = {}
+    for field in ["Date", "Type", "Asset", "Quantity", "Price", "Fees"]:
+        if field in raw_trades[0]:
+            column = list(map(itemgetter(field), raw_trades))
+        else:
+            column = [t.get(field, "") for t in raw_trades]
+        columns[field] = column
+        if column_is_valid(field, column):
+            continue
+        # a short row has None values, check_valid_input decides what to do with it
+        bad_values = {value for value in set(column) if value is None or not value_is_valid(field, value)}
+        bad_rows.update(i for i, value in enumerate(column) if value in bad_values)
+    # the ratio of a corporate action has to be positive, only checked if the chunk has any
+    if set(map(str.lower, map(str.strip, filter(None, columns["Type"])))) & set(CORPORATE_ACTION_TYPES):
+        for i, (trade_type, quantity) in enumerate(zip(columns["Type"], columns["Quantity"])):
+            if (trade_type or "").strip().lower() in CORPORATE_ACTION_TYPES and is_valid_number(quantity) and not is_valid_ratio(quantity):
+                bad_rows.add(i)
+
+    error_report = []
+    for i in sorted(bad_rows):
+        error_report.extend(check_valid_input([raw_trades[i]], start_line + i))
+    return error_report
+
+def canonical_key(trade: dict) -> tuple[str, str, str, str, str]:
+    """
+    Builds the canonical row key of a raw trade, the fields that identify it, cleaned once.
+    Args:
+        trade (dict): The raw trade dictionary.
+    Returns:
+        tuple: The stripped Date, the lowercased Type and Asset, the stripped Quantity and Price.
+    """
+    return (
+        trade["Date"].strip(),
+        trade["Type"].strip().lower(),
+        trade["Asset"].strip().lower(),
+        trade["Quantity"].strip(),
+        trade["Price"].strip(),
+    )
+
+@lru_cache(maxsize=CHUNK_SIZE)
+def txid_from_key(key: tuple[str, str, str, str, str]) -> str:
+    """
+    Creates the transaction ID of a canonical row key (see canonical_key), repeated keys are
+    only hashed once.
+    Args:
+        key (tuple): The canonical row key.
+    Returns:
+        str: The transaction ID, the same as make_txid gives.
+    """
+    return hashlib.sha256("_".join(key).encode()).hexdigest()[:10]
+
 def make_txid(trade: dict) -> str:
     """
     Creates a synthetic transaction ID for a trade.
@@ -98,32 +258,37 @@ def make_txid(trade: dict) -> str:
 
 def write_trades_normalized(trades: list[dict], file_path: str) -> None:
     """
-    Writes the normalized trade data to a CSV file.
+    Appends the normalized trade data to a CSV file, the header is only written to a new file.
+    A path ending in COLUMNAR_SUFFIX is the columnar store (NORMALIZED_STORE: columnar), the
+    trades are appended to it directly (see columnar_store.append_columnar_store).
     Args:
         trades (list): The list of normalized trade dictionaries to write.
-        file_path (str): The path to the output CSV file.
+        file_path (str): The path to the output CSV file or columnar store.
     """
     if not trades:
         return
+    if file_path.endswith(COLUMNAR_SUFFIX):
+        append_columnar_store(trades, file_path)
+        return
     # Order of columns for the output CSV
     col_names = [
         "date", "asset", "type", "quantity", "price", "fee", 
         "total_gross", "total_net", "txid", "note"
     ]
 
-    with open(file_path, "w", newline="") as f:
+    # Append, so trades of earlier runs are kept
+    new_file = not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+    with open(file_path, "a", newline="") as f:
         writer = csv.DictWriter(f, fieldnames=col_names)
-        writer.writeheader()
-        counter = 0
+        if new_file:
+            writer.writeheader()
         for t in trades:
             row = {k: (str(v) if isinstance(v, (Decimal, datetime)) else v) for k, v in t.items()}
             writer.writerow(row)
-            counter += 1
-        print(f"INFO: Added {counter} new trades.")    
 
 def load_existing_txids(file_path: str) -> set:
     """
-    Loads existing transaction IDs from a CSV file.
+    Loads existing transaction IDs from a CSV file (or a columnar store, only its txid column is read).
     Args:
         file_path (str): The path to the CSV file.
     Returns:
@@ -131,66 +296,318 @@ def load_existing_txids(file_path: str) -> set:
     """
     if not os.path.exists(file_path):
         return set()
+    if file_path.endswith(COLUMNAR_SUFFIX):
+        with ColumnarStore(file_path) as store:
+            return {t["txid"] for t in store.trades(fields=["txid"]) if t["txid"]}
     with open(file_path, newline='') as f:
         reader = csv.DictReader(f)
         return {row.get("txid") for row in reader if row.get("txid")}
 
-# --- Helper Functions End
+def txid_index_path(file_path: str) -> str:
+    """
+    Gets the path of the txid index that belongs to a normalized trades CSV (or columnar store).
+    Args:
+        file_path (str): The path to the normalized trades CSV file.
+    Returns:
+        str: The path to the SQLite txid index next to it.
+    """
+    root, ext = os.path.splitext(file_path)
+    # the CSV and the columnar store next to it each have their own index
+    return f"{root}_cols_txids.sqlite" if ext == COLUMNAR_SUFFIX else f"{root}_txids.sqlite"
 
-def run_normalization(my_trades: str, normalized_trades: str) -> None:
+def open_txid_index(index_path: str, file_path: str) -> sqlite3.Connection:
     """
-    Main function to process trade data.
+    Opens the txid index of a normalized trades CSV, the index is rebuilt from the CSV
+    if it is missing or the CSV was changed outside of run_normalization.
+    Args:
+        index_path (str): The path to the SQLite txid index.
+        file_path (str): The path to the normalized trades CSV file.
+    Returns:
+        sqlite3.Connection: The connection to the index.
+    """
+    conn = sqlite3.connect(index_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS txids (txid TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    # input chunks whose trades are all in the CSV, with their number of rows
+    conn.execute("CREATE TABLE IF NOT EXISTS chunks (checksum TEXT PRIMARY KEY, rows INTEGER) WITHOUT ROWID")
+
+    # the size of the CSV when the index was last updated tells if both are in sync
+    csv_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+    row = conn.execute("SELECT value FROM meta WHERE key = 'csv_size'").fetchone()
+    if row is None or int(row[0]) != csv_size:
+        conn.execute("DELETE FROM txids")
+        conn.execute("DELETE FROM chunks")
+        conn.executemany("INSERT OR IGNORE INTO txids VALUES (?)", ((txid,) for txid in load_existing_txids(file_path)))
+        set_index_csv_size(conn, csv_size)
+        conn.commit()
+    return conn
+
+def add_txids(conn: sqlite3.Connection, txids: list[str], file_path: str) -> None:
+    """
+    Adds transaction IDs to the txid index after their trades were appended to the CSV.
+    Args:
+        conn (sqlite3.Connection): The connection to the txid index.
+        txids (list[str]): The transaction IDs that were written.
+        file_path (str): The path to the normalized trades CSV file.
+    """
+    conn.executemany("INSERT OR IGNORE INTO txids VALUES (?)", ((txid,) for txid in txids))
+    set_index_csv_size(conn, os.path.getsize(file_path) if os.path.exists(file_path) else 0)
+    conn.commit()
+
+def set_index_csv_size(conn: sqlite3.Connection, csv_size: int) -> None:
+    """
+    Records the size of the normalized trades CSV the txid index is in sync with.
+    Args:
+        conn (sqlite3.Connection): The connection to the txid index.
+        csv_size (int): The size of the CSV file in bytes.
+    """
+    conn.execute("INSERT OR REPLACE INTO meta VALUES ('csv_size', ?)", (str(csv_size),))
+
+def existing_txids_in(conn: sqlite3.Connection, txids: list[str]) -> set:
+    """
+    Looks up a batch of transaction IDs in the txid index with one query.
+    Args:
+        conn (sqlite3.Connection): The connection to the txid index.
+        txids (list[str]): The transaction IDs to look up (at most CHUNK_SIZE).
+    Returns:
+        set: The transaction IDs that are already stored.
+    """
+    if not txids:
+        return set()
+    placeholders = ",".join("?" * len(txids))
+    return {row[0] for row in conn.execute(f"SELECT txid FROM txids WHERE txid IN ({placeholders})", txids)}
+
+def ends_in_quoted_value(line: bytes, in_quotes: bool = False) -> bool:
+    """
+    Follows the quoted values of one raw CSV line the way the csv module reads them: a quote
+    only opens a value at the start of a field ("" inside is an escaped quote), any other quote
+    (e.g. 27" monitor) is plain text.
+    Args:
+        line (bytes): The raw line.
+        in_quotes (bool): True if the line starts inside a quoted value of an earlier line.
+    Returns:
+        bool: True if the line ends inside a quoted value (it continues on the next line).
+    """
+    if not in_quotes and b'"' not in line:
+        return False
+    pos = 0
+    field_start = not in_quotes
+    while True:
+        if in_quotes:
+            end = line.find(b'"', pos)
+            if end < 0:
+                return True
+            if line[end + 1:end + 2] == b'"':
+                pos = end + 2
+                continue
+            # the rest of the field after the closing quote is plain text
+            in_quotes = field_start = False
+            pos = end + 1
+        elif field_start and line[pos:pos + 1] == b'"':
+            in_quotes = True
+            pos += 1
+        else:
+            comma = line.find(b",", pos)
+            if comma < 0:
+                return False
+            field_start = True
+            pos = comma + 1
+
+def read_raw_chunks(f, chunk_size: int = CHUNK_SIZE) -> Iterator[tuple[bytes, bytes]]:
+    """
+    Reads an input CSV opened in binary mode in chunks of raw lines, without parsing them.
+    A chunk only ends outside a quoted value, so a quoted value with a line break stays in
+    one chunk. Each line is looked at once (see ends_in_quoted_value).
+    Args:
+        f: The input CSV file, opened with "rb".
+        chunk_size (int): The number of lines per chunk (a chunk can have more, see above).
+    Returns:
+        Iterator[tuple[bytes, bytes]]: The header line and the lines of each chunk.
+    """
+    header = f.readline()
+    lines = []
+    in_quotes = False
+    for line in f:
+        lines.append(line)
+        in_quotes = ends_in_quoted_value(line, in_quotes)
+        if len(lines) >= chunk_size and not in_quotes:
+            yield header, b"".join(lines)
+            lines = []
+    if lines:
+        yield header, b"".join(lines)
+
+def chunk_checksum(header: bytes, data: bytes) -> str:
+    """
+    Computes the checksum of a raw input chunk, the header is included since it decides what
+    the values mean.
+    Args:
+        header (bytes): The header line.
+        data (bytes): The lines of the chunk.
+    Returns:
+        str: The hex checksum.
+    """
+    h = hashlib.blake2b(header, digest_size=16)
+    h.update(data)
+    return h.hexdigest()
+
+def parse_chunk(header: bytes, data: bytes) -> list[dict]:
+    """
+    Parses a raw input chunk into raw trade dictionaries.
+    Args:
+        header (bytes): The header line.
+        data (bytes): The lines of the chunk.
+    Returns:
+        list[dict]: The raw trade dictionaries, like csv.DictReader gives them.
+    """
+    return list(csv.DictReader(io.StringIO((header + data).decode(), newline="")))
+
+def known_chunk_rows(conn: sqlite3.Connection, checksum: str) -> int | None:
+    """
+    Looks up an input chunk that was fully normalized before.
+    Args:
+        conn (sqlite3.Connection): The connection to the txid index.
+        checksum (str): The checksum of the chunk (see chunk_checksum).
+    Returns:
+        int | None: The number of rows of the chunk, None if it is not known.
+    """
+    row = conn.execute("SELECT rows FROM chunks WHERE checksum = ?", (checksum,)).fetchone()
+    return row[0] if row else None
+
+def add_chunk(conn: sqlite3.Connection, checksum: str, rows: int) -> None:
+    """
+    Records an input chunk whose trades are all in the CSV (committed with the next add_txids).
+    Args:
+        conn (sqlite3.Connection): The connection to the txid index.
+        checksum (str): The checksum of the chunk.
+        rows (int): The number of rows of the chunk.
+    """
+    conn.execute("INSERT OR REPLACE INTO chunks VALUES (?, ?)", (checksum, rows))
+
+def normalize_trade(t: dict, txid: str, key: tuple[str, str, str, str, str] | None = None) -> dict:
+    """
+    Converts a validated raw trade into a normalized trade.
+    Args:
+        t (dict): The raw trade dictionary (validated with check_valid_input).
+        txid (str): The transaction ID of the trade.
+        key (tuple | None): The canonical row key of the trade if already built (see canonical_key).
+    Returns:
+        dict: The normalized trade dictionary.
+    """
+    date, trade_type, asset, quantity, price = key or canonical_key(t)
+    fees = (t.get("Fees") or "").strip()
+    fee = Decimal(fees) if fees else Decimal(0)
+    quantity = Decimal(quantity)
+    price = Decimal(price)
+    total_gross = price * quantity
+
+    if trade_type == "buy":
+        total_net = total_gross + fee
+    elif trade_type == "sell":
+        total_net = total_gross - fee
+    else:
+        # a corporate action moves no money, the lots keep their cost
+        total_gross = total_net = Decimal(0)
+
+    return {
+        # a time with an offset is stored as UTC without offset, like every other date
+        "date": utc_date(date),
+        "asset": asset,
+        "type": trade_type,
+        "quantity": quantity,
+        "price": price,
+        "fee": fee,
+        "total_gross": total_gross,
+        "total_net": total_net,
+        "txid": txid,
+        "note": t.get("Notes", "").strip(),
+    }
+
+def normalize_chunk(raw_trades: list[dict], conn: sqlite3.Connection) -> list[dict]:
     """
+    Normalizes a chunk of validated raw trades, leaving out trades that are already stored.
+    Args:
+        raw_trades (list[dict]): The raw trade dictionaries of the chunk.
+        conn (sqlite3.Connection): The connection to the txid index.
+    Returns:
+        list[dict]: The normalized new trades.
+    """
+    with stage("make_txid"):
+        keys = [canonical_key(t) for t in raw_trades]
+        txids = [txid_from_key(key) for key in keys]
+    # a txid seen before (in the store or earlier in the chunk) is skipped
+    with stage("dedup_lookup"):
+        seen = existing_txids_in(conn, list(set(txids)))
     trades = []
+    with stage("normalize_trade"):
+        for t, key, txid in zip(raw_trades, keys, txids):
+            if txid in seen:
+                continue
+            trades.append(normalize_trade(t, txid, key))
+            seen.add(txid)
+    count("rows_deduped", len(raw_trades) - len(trades))
+    return trades
 
-    with open(my_trades, "r") as f:
-        raw_trades = list(csv.DictReader(f))
+# --- Helper Functions End
 
-    error_report = check_valid_input(raw_trades)
+def run_normalization(my_trades: str, normalized_trades: str) -> list[str]:
+    """
+    Main function to process trade data.
+    The new trades are appended to the normalized store, a CSV or a columnar store (see write_trades_normalized).
+    The input is streamed in chunks of CHUNK_SIZE rows twice: first to validate every row,
+    then (only if there were no errors) to normalize, dedup and append the new trades.
+    Memory use depends on the chunk size, not on the size of the input file.
+    A chunk that was fully normalized before (same checksum of its raw lines) is skipped
+    without parsing, validating or hashing it, so an unchanged input only costs one read.
+    Returns:
+        list[str]: The errors found in the input, nothing is written if there are any.
+    """
+    conn = open_txid_index(txid_index_path(normalized_trades), normalized_trades)
+    error_report = []
+    new_chunks = 0
+    start_line = 2  # line 1 is the header row
+    with open(my_trades, "rb") as f:
+        for header, data in timed(read_raw_chunks(f), "read_csv"):
+            with stage("chunk_checksum"):
+                rows = known_chunk_rows(conn, chunk_checksum(header, data))
+            if rows is None:
+                chunk = parse_chunk(header, data)
+                rows = len(chunk)
+                new_chunks += 1
+                with stage("check_valid_input"):
+                    error_report.extend(check_valid_columns(chunk, start_line))
+            else:
+                count("chunks_skipped")
+            count("rows_read", rows)
+            start_line += rows
+    count("rows_invalid", len(error_report))
 
     if error_report:
+        conn.close()
         print("ERROR: Errors found in the CSV file:")
         for err in error_report:
             print(err)
         print("WARNING: Please fix these errors before trying again.")
-        return
+        return error_report
 
-    else:
-        existing_txids = load_existing_txids(normalized_trades)
-        for t in raw_trades:
-            txid = make_txid({
-                "Date": t["Date"].strip(),
-                "Type": t["Type"].strip().lower(),
-                "Asset": t["Asset"].strip().lower(),
-                "Quantity": t["Quantity"].strip(),
-                "Price": t["Price"].strip()
-            })
-
-            if txid in existing_txids:
-                continue
-            else:
-                date = datetime.fromisoformat(t["Date"])
-                fee = Decimal(t["Fees"].strip()) if t.get("Fees", "").strip() not in ["", None] else Decimal(0)
-                total_gross = Decimal(t["Price"].strip()) * Decimal(t["Quantity"].strip())
-
-                if t["Type"].strip().lower() == "buy":
-                    total_net = total_gross + fee
-                elif t["Type"].strip().lower() == "sell":
-                    total_net = total_gross - fee
-
-                trades.append({
-                    "date": date,
-                    "asset": t["Asset"].strip().lower(),
-                    "type": t["Type"].strip().lower(),
-                    "quantity": Decimal(t["Quantity"].strip()),
-                    "price": Decimal(t["Price"].strip()),
-                    "fee": fee,
-                    "total_gross": total_gross,
-                    "total_net": total_net,
-                    "txid": txid,
-                    "note": t.get("Notes", "").strip(),
-                })
-                existing_txids.add(txid)
-    if trades:
-        write_trades_normalized(trades, normalized_trades)
-    else: print("INFO: No new trades found.")
\ No newline at end of file
+    added = 0
+    if new_chunks:
+        with open(my_trades, "rb") as f:
+            for header, data in timed(read_raw_chunks(f), "read_csv"):
+                checksum = chunk_checksum(header, data)
+                if known_chunk_rows(conn, checksum) is not None:
+                    continue
+                chunk = parse_chunk(header, data)
+                trades = normalize_chunk(chunk, conn)
+                with stage("write_normalized"):
+                    write_trades_normalized(trades, normalized_trades)
+                    # written chunks go to the index, so later chunks are deduped against them
+                    add_chunk(conn, checksum, len(chunk))
+                    add_txids(conn, [t["txid"] for t in trades], normalized_trades)
+                added += len(trades)
+    count("rows_written", added)
+    conn.close()
+
+    if added:
+        print(f"INFO: Added {added} new trades.")
+    else: print("INFO: No new trades found.")
+    return error_report
@@ -0,0 +1,126 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# --- Collected data (only filled while profiling is enabled)
+STAGES = {}
+COUNTERS = {}
+PEAK_QUEUE_DEPTH = {}
+TRACE_EVENTS = []
+
+_enabled = False
+_started = 0.0
+
+def enable_profiling() -> None:
+    """
+    Starts collecting stage timings and counters (clears earlier data).
+    """
+    global _enabled, _started
+    STAGES.clear()
+    COUNTERS.clear()
+    PEAK_QUEUE_DEPTH.clear()
+    TRACE_EVENTS.clear()
+    _enabled = True
+    _started = time.perf_counter()
+
+def disable_profiling() -> None:
+    """
+    Stops collecting, the data collected so far is kept.
+    """
+    global _enabled
+    _enabled = False
+
+def profiling_enabled() -> bool:
+    """
+    Checks if profiling is on, hot loops check this once and skip their counters otherwise.
+    Returns:
+        bool: True if stage timings and counters are collected.
+    """
+    return _enabled
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a pipeline stage, e.g. with stage("validate"): ... (does nothing while profiling is off).
+    Args:
+        name (str): The name of the stage.
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        totals = STAGES.setdefault(name, {"seconds": 0.0, "calls": 0})
+        totals["seconds"] += end - start
+        totals["calls"] += 1
+        # Chrome trace "complete" event, times in microseconds
+        TRACE_EVENTS.append({
+            "name": name, "ph": "X", "pid": os.getpid(), "tid": 0,
+            "ts": round((start - _started) * 1e6), "dur": round((end - start) * 1e6),
+        })
+
+def timed(iterable, name: str):
+    """
+    Times every step of an iterator as the stage name, e.g. the CSV reading behind a generator.
+    Args:
+        iterable: The iterable to time.
+        name (str): The name of the stage.
+    Returns:
+        The iterable itself while profiling is off, otherwise a timed iterator over it.
+    """
+    if not _enabled:
+        return iterable
+    return _timed_steps(iter(iterable), name)
+
+def _timed_steps(iterator, name: str):
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+def count(name: str, n: int = 1) -> None:
+    """
+    Adds to a counter, e.g. count("rows_read", len(chunk)).
+    Args:
+        name (str): The name of the counter.
+        n (int): The amount to add.
+    """
+    if _enabled:
+        COUNTERS[name] = COUNTERS.get(name, 0) + n
+
+def record_queue_depth(peaks: dict[str, int]) -> None:
+    """
+    Merges the peak FIFO queue depth per asset of one sweep into the profile.
+    Args:
+        peaks (dict[str, int]): The highest number of open lots seen per asset.
+    """
+    if _enabled:
+        for asset, depth in peaks.items():
+            if depth > PEAK_QUEUE_DEPTH.get(asset, 0):
+                PEAK_QUEUE_DEPTH[asset] = depth
+
+def write_profile(file_path: str) -> None:
+    """
+    Writes the collected profile as JSON. The "traceEvents" part can be opened in a trace
+    viewer such as chrome://tracing or Perfetto.
+    Args:
+        file_path (str): The path to the profile JSON file.
+    """
+    profile = {
+        "total_seconds": time.perf_counter() - _started,
+        "stages": STAGES,
+        "counters": COUNTERS,
+        "peak_queue_depth": dict(sorted(PEAK_QUEUE_DEPTH.items(), key=lambda item: item[1], reverse=True)),
+        "traceEvents": TRACE_EVENTS,
+    }
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"INFO: Profile written to {file_path}")
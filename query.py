@@ -0,0 +1,178 @@
+import argparse
+import os
+from datetime import datetime
+from decimal import Decimal
+
+from columnar_store import (
+    COLUMNAR_SUFFIX, ColumnarStore, build_columnar_store, columnar_path, date_to_micros, export_csv, write_columnar_store, TRADE_TYPES,
+)
+from calculator import CGTCalculator
+from fifo import fifo_sweep, FOUR_WEEK_WINDOW
+
+# --- File Paths
+NORMALIZED_TRADES_PATH = "data/normalized_trades.csv"
+
+SELL = TRADE_TYPES.index("sell")
+
+# --- Helper Functions Start
+def open_store(normalized_file: str = NORMALIZED_TRADES_PATH) -> ColumnarStore:
+    """
+    Opens the columnar store of the normalized trades: the store itself with NORMALIZED_STORE: columnar,
+    or the one built from a normalized trades CSV, (re)building it first if needed.
+    Args:
+        normalized_file (str): The path to the normalized trades CSV file or columnar store.
+    Returns:
+        ColumnarStore: The open store (close it when done).
+    """
+    if normalized_file.endswith(COLUMNAR_SUFFIX):
+        if not os.path.exists(normalized_file):
+            write_columnar_store([], normalized_file)
+        return ColumnarStore(normalized_file)
+    store_path = columnar_path(normalized_file)
+    build_columnar_store(normalized_file, store_path)
+    return ColumnarStore(store_path)
+
+def count_sells(store: ColumnarStore, asset: str, start=None, end=None) -> int:
+    """
+    Counts the sells of an asset in a date range, from the type column only.
+    Args:
+        store (ColumnarStore): The trade store.
+        asset (str): The asset.
+        start: The first date to include, None for no lower bound.
+        end: The date to stop before, None for no upper bound.
+    Returns:
+        int: The number of sells.
+    """
+    return sum(code == SELL for code in store.column("type", store.select(asset, start, end)))
+
+def replay_asset(store: ColumnarStore, asset: str, end=None, four_week_rule: bool = False) -> dict[int, dict]:
+    """
+    Runs FIFO over the trades of one asset, up to a date.
+    Args:
+        store (ColumnarStore): The trade store.
+        asset (str): The asset.
+        end: The date to stop before, None for all trades.
+        four_week_rule (bool): Apply the 4-week rule, as the calculator does with FOUR_WEEK_RULE on.
+    Returns:
+        dict[int, dict]: The fifo_sweep results of the asset per tax year.
+    """
+    return fifo_sweep(list(store.trades(asset, end=end)), four_week_rule=four_week_rule)
+
+# --- Helper Functions End
+
+def open_position(store: ColumnarStore, asset: str, as_of=None, four_week_rule: bool = False) -> dict:
+    """
+    Gets the open position of one asset and the cost basis of its open lots (unrealised).
+    Only the trades of that asset are read.
+    Args:
+        store (ColumnarStore): The trade store.
+        asset (str): The asset, e.g. "eth".
+        as_of: Only count trades before this date (datetime or ISO string), None for all trades.
+        four_week_rule (bool): Add the losses the 4-week rule disallows to the cost of the buys that took them.
+    Returns:
+        dict: The open quantity, the cost basis, the average cost per unit and the open lots.
+    """
+    asset = asset.strip().lower()
+    years = replay_asset(store, asset, as_of, four_week_rule)
+    lots = years[max(years)]["open_lots"].get(asset, []) if years else []
+    quantity = sum((lot["quantity"] for lot in lots), Decimal(0))
+    cost_basis = sum((lot["quantity"] * lot["total_net"] / lot["original_qty"] for lot in lots if lot["original_qty"]), Decimal(0))
+    return {
+        "asset": asset,
+        "as_of": as_of,
+        "quantity": quantity,
+        "cost_basis": cost_basis,
+        "average_cost": cost_basis / quantity if quantity else Decimal(0),
+        "lots": lots,
+    }
+
+def open_positions(store: ColumnarStore, as_of=None, four_week_rule: bool = False) -> list[dict]:
+    """
+    Gets the open position of every asset that still has open lots (see open_position).
+    Args:
+        store (ColumnarStore): The trade store.
+        as_of: Only count trades before this date (datetime or ISO string), None for all trades.
+        four_week_rule (bool): Apply the 4-week rule.
+    Returns:
+        list[dict]: The open positions, by asset.
+    """
+    positions = (open_position(store, asset, as_of, four_week_rule) for asset in sorted(store.assets))
+    return [position for position in positions if position["lots"]]
+
+def realised_gains(store: ColumnarStore, start=None, end=None, asset: str | None = None, four_week_rule: bool = False) -> dict:
+    """
+    Gets the sells in a date window and the gains they realised. Assets without a sell in the
+    window are skipped, the others are replayed up to the end of the window only (with the
+    4-week rule, up to 4 weeks after it, as those buys can disallow a loss in the window).
+    Args:
+        store (ColumnarStore): The trade store.
+        start: The first date of the window (datetime or ISO string), None for no lower bound.
+        end: The date the window stops before, None for no upper bound.
+        asset (str | None): Only this asset, None for all assets.
+        four_week_rule (bool): Apply the 4-week rule, as the calculator does with FOUR_WEEK_RULE on.
+    Returns:
+        dict: The window, the sold lots (date sorted) and their total gain.
+    """
+    assets = [asset.strip().lower()] if asset else store.assets
+    replay_end = end
+    if four_week_rule and end is not None:
+        replay_end = datetime.fromisoformat(str(end)) + FOUR_WEEK_WINDOW
+    sold_lots = []
+    for a in assets:
+        count = count_sells(store, a, start, end)
+        if not count:
+            continue
+        asset_sells = [lot for result in replay_asset(store, a, replay_end, four_week_rule).values() for lot in result["sold_lots"]]
+        # the sells before the window only used up lots, the ones after it only took part in the replay
+        skipped = count_sells(store, a, end=start) if start is not None else 0
+        sold_lots.extend(asset_sells[skipped:skipped + count])
+    sold_lots.sort(key=lambda lot: date_to_micros(lot["date"]))
+    return {
+        "start": start,
+        "end": end,
+        "asset": asset,
+        "sold_lots": sold_lots,
+        "total_gain": sum((lot["total_gain"] for lot in sold_lots), Decimal(0)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Queries on the normalized trades")
+    parser.add_argument("--normalized", type=str, default=NORMALIZED_TRADES_PATH,
+                        help="Path to the normalized trades CSV (with NORMALIZED_STORE: columnar, the store next to it is read)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    position_parser = subparsers.add_parser("position", help="Open quantity and cost basis of one asset (or all assets)")
+    position_parser.add_argument("asset", nargs="?", help="The asset, e.g. ETH (default: every asset with open lots)")
+    position_parser.add_argument("--as-of", type=str, default=None, help="Only trades before this date, e.g. 2024-06-01")
+
+    gains_parser = subparsers.add_parser("gains", help="Realised gains of the sells in a date window")
+    gains_parser.add_argument("--from", dest="start", type=str, default=None, help="First date of the window, e.g. 2024-03-01")
+    gains_parser.add_argument("--to", dest="end", type=str, default=None, help="Date the window stops before, e.g. 2024-04-01")
+    gains_parser.add_argument("--asset", type=str, default=None, help="Only this asset")
+
+    export_parser = subparsers.add_parser("export", help="Write the normalized trades as CSV")
+    export_parser.add_argument("output", help="Path of the CSV to write")
+    args = parser.parse_args()
+
+    # the same config as the reports, so the gains and cost bases agree with them
+    calculator = CGTCalculator.from_config_file()
+    four_week_rule = calculator.four_week_rule
+    with open_store(calculator.normalized_path(args.normalized)) as store:
+        if args.command == "export":
+            export_csv(store.file_path, args.output)
+            print(f"INFO: Wrote {len(store)} trades to {args.output}")
+        elif args.command == "position":
+            if args.asset:
+                positions = [open_position(store, args.asset, args.as_of, four_week_rule)]
+            else:
+                positions = open_positions(store, args.as_of, four_week_rule)
+            for p in positions:
+                print(f"{p['asset']}: quantity {p['quantity']}, cost basis {p['cost_basis']}, average cost {p['average_cost']}, {len(p['lots'])} open lots")
+        else:
+            result = realised_gains(store, args.start, args.end, args.asset, four_week_rule)
+            for lot in result["sold_lots"]:
+                print(f"{lot['date']} {lot['asset']}: sold {lot['quantity']}, gain {lot['total_gain']}")
+            print(f"Total gain: {result['total_gain']} ({len(result['sold_lots'])} sells)")
+
+if __name__ == "__main__":
+    main()
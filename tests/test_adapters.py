@@ -0,0 +1,105 @@
+import unittest
+import tempfile
+import csv
+import io
+import os
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from adapters import FormatAdapter, NATIVE, load_adapters, merge_runs, read_export, run_ingestion
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "samples")
+
+EXCHANGE_A = {
+    "columns": {"Date": "Time", "Type": "Side", "Asset": "Coin", "Quantity": "Amount", "Price": "Unit Price",
+                "Fees": "Commission", "Notes": "Comment"},
+    "date_format": "%d/%m/%Y %H:%M",
+    "types": {"BUY": "buy", "SELL": "sell"},
+    "skip_types": ["DEPOSIT", "WITHDRAWAL"],
+}
+
+class TestAdapters(unittest.TestCase):
+    def setUp(self):
+        self.adapters = load_adapters({"exchange_a": EXCHANGE_A})
+
+    def test_read_export_sample(self):
+        """Test header detection, column/ type/ date mapping and skipped rows on a sample export."""
+        with tempfile.TemporaryDirectory() as run_dir, redirect_stdout(io.StringIO()):
+            runs, errors = read_export(os.path.join(SAMPLES_DIR, "exchange_a.csv"), self.adapters, run_dir)
+            trades = list(merge_runs(runs, run_dir))
+        self.assertEqual(errors, [])
+        self.assertEqual(len(trades), 2)
+        self.assertEqual(trades[0], {"Date": "2024-01-15 10:30:00", "Type": "buy", "Asset": "BTC", "Quantity": "0.5",
+                                     "Price": "40000", "Fees": "5", "Notes": ""})
+        self.assertEqual(trades[1]["Notes"], "partial, first half")
+
+    def test_read_export_errors_use_file_lines(self):
+        """Test that errors name the file and its real line number."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "bad.csv")
+            with open(path, "w") as f:
+                f.write("Report\nTime,Side,Coin,Amount,Unit Price\n15/01/2024 10:30,BUY,BTC,1,1\n32/01/2024 10:30,BUY,BTC,1,1\n")
+            with redirect_stdout(io.StringIO()):
+                _, errors = read_export(path, self.adapters, tmpdir)
+                _, unknown = read_export(path, [NATIVE], tmpdir)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith(f"{path}: Line 4: Invalid date format"))
+        self.assertIn("No known format found", unknown[0])
+
+    @patch("adapters.CHUNK_SIZE", 2)
+    @patch("adapters.MAX_OPEN_RUNS", 2)
+    def test_read_export_in_chunks(self):
+        """Test that an unsorted export read in small chunks merges back in date order, with real line numbers."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "unsorted.csv")
+            with open(path, "w") as f:
+                f.write("Time,Side,Coin,Amount,Unit Price\n")
+                for day in [5, 3, 9, 1, 7, 2, 8]:
+                    f.write(f"0{day}/01/2024 10:00,BUY,BTC,{day},1\n")
+            with redirect_stdout(io.StringIO()):
+                runs, _ = read_export(path, self.adapters, tmpdir)
+                self.assertEqual([t["Quantity"] for t in merge_runs(runs, tmpdir)], ["1", "2", "3", "5", "7", "8", "9"])
+                with open(path, "a") as f:
+                    f.write("01/02/2024 10:00,DEPOSIT,BTC,1,1\n01/02/2024 11:00,BUY,BTC,x,1\n")
+                _, errors = read_export(path, self.adapters, tmpdir)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith(f"{path}: Line 10: Invalid value for Quantity"))
+
+    def test_run_ingestion_merges_sorted(self):
+        """Test that several formats end up in the store in one date sorted, deduped stream."""
+        inputs = [os.path.join(SAMPLES_DIR, "exchange_a.csv"), os.path.join(SAMPLES_DIR, "native.csv")]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            normalized_path = os.path.join(tmpdir, "normalized_trades.csv")
+            with redirect_stdout(io.StringIO()):
+                self.assertEqual(run_ingestion(inputs, normalized_path, self.adapters), [])
+                run_ingestion(inputs, normalized_path, self.adapters)
+            with open(normalized_path, newline="") as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual([row["date"][:10] for row in rows], ["2024-01-10", "2024-01-15", "2024-02-01", "2025-02-01", "2025-03-01"])
+        self.assertEqual([row["asset"] for row in rows], ["eth", "btc", "btc", "eth", "btc"])
+
+    def test_run_ingestion_mixed_offsets(self):
+        """Test that files with and without time zone offsets are merged on the UTC date."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            naive = os.path.join(tmpdir, "naive.csv")
+            offset = os.path.join(tmpdir, "offset.csv")
+            with open(naive, "w") as f:
+                f.write("Date,Type,Asset,Quantity,Price,Fees,Notes\n2024-01-10,buy,BTC,1,100,,\n2024-01-11 09:30:00,sell,BTC,1,200,,\n")
+            with open(offset, "w") as f:
+                f.write("Date,Type,Asset,Quantity,Price,Fees,Notes\n2024-01-11T10:00:00+01:00,buy,ETH,1,10,,\n")
+            normalized_path = os.path.join(tmpdir, "normalized_trades.csv")
+            with redirect_stdout(io.StringIO()):
+                self.assertEqual(run_ingestion([naive, offset], normalized_path), [])
+            with open(normalized_path, newline="") as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual([row["date"] for row in rows], ["2024-01-10 00:00:00", "2024-01-11 09:00:00", "2024-01-11 09:30:00"])
+
+    def test_adapter_from_config(self):
+        """Test that an adapter only needs the columns of the required fields."""
+        adapter = FormatAdapter.from_config("x", {"columns": {"Date": "d", "Type": "t", "Asset": "a", "Quantity": "q", "Price": "p"}})
+        self.assertTrue(adapter.matches(["d", "t", "a", "q", "p", "other"]))
+        self.assertFalse(adapter.matches(["d", "t", "a", "q"]))
+        self.assertEqual(adapter.to_raw_trade({"d": "2024-01-01", "t": "buy", "a": "btc", "q": "1", "p": "2"})["Fees"], "")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import tempfile
+import csv
+import json
+import os
+import subprocess
+import sys
+from decimal import Decimal
+from app import (
+    generate_report,
+    report_path,
+    run_batch,
+    year_report_path,
+)
+
+class TestApp(unittest.TestCase):
+    def test_import_is_light(self):
+        """Test that importing the CLI does not load the pipeline (YAML, sqlite, process pools)."""
+        code = "import sys, app; print(sorted({'yaml', 'sqlite3', 'concurrent.futures', 'fifo'} & set(sys.modules)))"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_watch_takes_one_input(self):
+        """Test that --watch rejects several input files instead of only watching the first."""
+        result = subprocess.run([sys.executable, "app.py", "--watch", "--input", "a.csv", "b.csv"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("--watch takes one --input file", result.stderr)
+
+    def test_year_report_path(self):
+        """Test that the tax year is added to the report file name."""
+        self.assertEqual(year_report_path("output/report.csv", 2024), "output/report_2024.csv")
+
+    def test_generate_report(self):
+        """Test per match rows, asset and year totals with tax, as CSV and JSON Lines, from a generator."""
+        sold_lots = [
+            {"date": "2025-01-01 00:00:00", "asset": "btc", "quantity": Decimal("2"), "total_gain": Decimal("1500"), "details": [
+                {"used_qty": Decimal("1"), "cost_per_unit": Decimal("100"), "cost_basis": Decimal("100"), "proceeds": Decimal("1000"), "gain": Decimal("900"), "buy_date": "2024-01-01 00:00:00"},
+                {"used_qty": Decimal("1"), "cost_per_unit": Decimal("400"), "cost_basis": Decimal("400"), "proceeds": Decimal("1000"), "gain": Decimal("600"), "buy_date": "2024-02-01 00:00:00"},
+            ]},
+            {"date": "2025-02-01 00:00:00", "asset": "eth", "quantity": Decimal("1"), "total_gain": Decimal("1000"), "details": [
+                {"used_qty": Decimal("1"), "cost_per_unit": Decimal("50"), "cost_basis": Decimal("50"), "proceeds": Decimal("1050"), "gain": Decimal("1000"), "buy_date": "2024-03-01 00:00:00"},
+            ]},
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "report.csv")
+            total = generate_report((lot for lot in sold_lots), csv_path, Decimal("0.33"), Decimal("1270"))
+            self.assertEqual(total["tax_due"], Decimal("405.90"))
+            with open(csv_path, newline="") as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual([row["Record"] for row in rows], ["match", "match", "match", "asset_total", "asset_total", "year_total"])
+            self.assertEqual(rows[1]["Buy Date"], "2024-02-01 00:00:00")
+            self.assertEqual((rows[3]["Asset"], rows[3]["Gain"], rows[3]["Sold Quantity"]), ("btc", "1500", "2"))
+            self.assertEqual((rows[5]["Gain"], rows[5]["Exemption Used"], rows[5]["Taxable Gain"]), ("2500", "1270", "1230"))
+
+            jsonl_path = report_path(csv_path, "jsonl")
+            self.assertTrue(jsonl_path.endswith("report.jsonl"))
+            generate_report(sold_lots, jsonl_path, Decimal("0.33"), Decimal("1270"), output_format="jsonl")
+            with open(jsonl_path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(records[0]["used_quantity"], "1")
+            self.assertEqual(records[-1], {"record": "year_total", "cost_basis": "550", "proceeds": "3050", "gain": "2500",
+                                           "exemption_used": "1270", "taxable_gain": "1230", "tax_due": "405.90"})
+
+            self.assertIsNone(generate_report(iter([]), os.path.join(tmpdir, "empty.csv"), Decimal("0.33"), Decimal("1270")))
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, "empty.csv")))
+
+    def test_run_batch(self):
+        """Test that every client gets its own report and a bad CSV does not stop the batch."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            batch_dir = os.path.join(tmpdir, "clients")
+            os.makedirs(batch_dir)
+            with open(os.path.join(batch_dir, "alice.csv"), "w") as f:
+                f.write("Date,Type,Asset,Quantity,Price,Fees,Notes\n2024-01-01,buy,BTC,1,100,,\n2025-01-01,sell,BTC,1,150,,\n")
+            with open(os.path.join(batch_dir, "bob.csv"), "w") as f:
+                f.write("Date,Type,Asset,Quantity,Price,Fees,Notes\n2024-01-01,transfer,BTC,1,100,,\n")
+
+            output_root = os.path.join(tmpdir, "output")
+            entries = run_batch(batch_dir, 2025, jobs=2, data_root=os.path.join(tmpdir, "data"), output_root=output_root)
+
+            status = {entry["client"]: entry["status"] for entry in entries}
+            self.assertEqual(status, {"alice": "ok", "bob": "invalid_input"})
+            self.assertTrue(os.path.exists(os.path.join(output_root, "alice", "report.csv")))
+            self.assertFalse(os.path.exists(os.path.join(output_root, "bob", "report.csv")))
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, "data", "alice", "normalized_trades.csv")))
+            with open(os.path.join(output_root, "manifest.json")) as f:
+                manifest = json.load(f)
+            self.assertEqual([c["client"] for c in manifest["clients"]], ["alice", "bob"])
+            self.assertTrue(manifest["clients"][1]["errors"][0].startswith("Line 2: Invalid trade type"))
+
+if __name__ == "__main__":
+    unittest.main()
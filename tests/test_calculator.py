@@ -0,0 +1,72 @@
+import unittest
+import tempfile
+import os
+from decimal import Decimal
+from unittest import mock
+
+from calculator import CGTCalculator, FIFO_FIELDS
+from fifo import calculate_tax
+from normalization import write_trades_normalized
+
+class TestCalculator(unittest.TestCase):
+    def setUp(self):
+        self.trades = [
+            {"date": "2024-01-01 00:00:00", "asset": "btc", "type": "buy", "quantity": "1", "total_net": "1000"},
+            {"date": "2025-01-01 00:00:00", "asset": "btc", "type": "sell", "quantity": "1", "total_net": "3270"},
+        ]
+
+    def test_calculate_tax(self):
+        """Test exemption and rate on gains and losses."""
+        totals = calculate_tax(Decimal("2270"), Decimal("0.33"), Decimal("1270"))
+        self.assertEqual(totals["taxable_gain"], Decimal("1000"))
+        self.assertEqual(totals["tax_due"], Decimal("330.00"))
+        totals = calculate_tax(Decimal("-50"), Decimal("0.33"), Decimal("1270"))
+        self.assertEqual(totals["exemption_used"], Decimal("0"))
+        self.assertEqual(totals["tax_due"], Decimal("0.00"))
+
+    def test_calculate_from_memory(self):
+        """Test that trades from any iterable give sold lots and tax totals."""
+        calculator = CGTCalculator({"CGT_TAX_Normal": 0.33, "PERSONAL_EXEMPTION": 1270})
+        result = calculator.calculate(iter(self.trades), 2025)
+        self.assertEqual(len(result["sold_lots"]), 1)
+        self.assertEqual(result["total_gain"], Decimal("2270"))
+        self.assertEqual(result["tax_due"], Decimal("330.00"))
+        self.assertEqual(calculator.calculate(self.trades, 2023)["sold_lots"], [])
+        self.assertEqual(calculator.calculate_all_years(self.trades)[2025]["taxable_gain"], Decimal("1000"))
+
+    def test_warm_calls_do_no_file_io(self):
+        """Test that config and loaded trades are cached between calls."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_path = os.path.join(tmpdir, "config.yaml")
+            with open(config_path, "w") as f:
+                f.write("CGT_TAX_Normal: 0.33\nPERSONAL_EXEMPTION: 1270\n")
+            trades_path = os.path.join(tmpdir, "normalized_trades.csv")
+            with open(trades_path, "w") as f:
+                f.write("date,asset,type,quantity,total_net\n2024-01-01 00:00:00,btc,buy,1,1000\n")
+
+            calculator = CGTCalculator.from_config_file(config_path)
+            trades = calculator.load_trades(trades_path)
+            with mock.patch("builtins.open", side_effect=AssertionError("file opened")):
+                CGTCalculator.from_config_file(config_path).calculate(self.trades, 2025)
+                self.assertIs(calculator.load_trades(trades_path), trades)
+
+    def test_load_trades_columnar(self):
+        """Test that trades written to the columnar store give the same results as the CSV, without a CSV."""
+        trades = [dict(t, price="0", fee="0", total_gross=t["total_net"], txid=f"{i:010d}", note="") for i, t in enumerate(self.trades)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "normalized_trades.csv")
+            write_trades_normalized(trades, csv_path)
+            csv_result = CGTCalculator().calculate(CGTCalculator().load_trades(csv_path), 2025)
+            os.remove(csv_path)
+
+            columnar = CGTCalculator({"NORMALIZED_STORE": "columnar"})
+            store_path = columnar.normalized_path(csv_path)
+            self.assertEqual(store_path, os.path.join(tmpdir, "normalized_trades.cols"))
+            write_trades_normalized(trades, store_path)
+            loaded = columnar.load_trades(store_path)
+            self.assertEqual(list(loaded[0]), FIFO_FIELDS)
+            self.assertEqual(columnar.calculate(loaded, 2025)["tax_due"], csv_result["tax_due"])
+            self.assertFalse(os.path.exists(csv_path))
+
+if __name__ == "__main__":
+    unittest.main()
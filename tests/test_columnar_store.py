@@ -0,0 +1,116 @@
+import unittest
+import tempfile
+import os
+import csv
+import io
+from contextlib import redirect_stdout
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import patch
+
+from columnar_store import ColumnarStore, build_columnar_store, columnar_path, date_to_micros, export_csv, CSV_COLUMNS, TRADE_TYPES
+from normalization import load_existing_txids, normalize_trade, run_normalization, write_trades_normalized
+
+class TestColumnarStore(unittest.TestCase):
+    def setUp(self):
+        self.trades = [
+            {"date": "2024-03-01 10:00:00", "asset": "eth", "type": "buy", "quantity": "2.5", "price": "3000", "fee": "1.25",
+             "total_gross": "7500.0", "total_net": "7501.25", "txid": "bbbbbbbbbb", "note": "via bank"},
+            {"date": "2024-01-01 00:00:00", "asset": "btc", "type": "buy", "quantity": "0.00000001", "price": "40000", "fee": "0",
+             "total_gross": "0.00040000", "total_net": "0.00040000", "txid": "aaaaaaaaaa", "note": ""},
+            {"date": "2025-01-01 00:00:00.500000", "asset": "btc", "type": "sell", "quantity": "0.00000001", "price": "90000", "fee": "0.01",
+             "total_gross": "0.00090000", "total_net": "-0.00910000", "txid": "cccccccccc", "note": "ünïcode"},
+        ]
+
+    def test_round_trip_and_filters(self):
+        """Test that the store gives back the exact trades, date sorted, filtered by asset and date."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "normalized_trades.csv")
+            write_trades_normalized(self.trades, csv_path)
+            store_path = columnar_path(csv_path)
+            self.assertTrue(build_columnar_store(csv_path, store_path))
+            self.assertFalse(build_columnar_store(csv_path, store_path))
+
+            with ColumnarStore(store_path) as store:
+                trades = list(store.trades())
+                self.assertEqual([t["txid"] for t in trades], ["aaaaaaaaaa", "bbbbbbbbbb", "cccccccccc"])
+                self.assertEqual(trades[2]["total_net"], Decimal("-0.00910000"))
+                self.assertEqual(str(trades[0]["quantity"]), "1E-8")
+                for trade in trades:
+                    original = next(t for t in self.trades if t["txid"] == trade["txid"])
+                    self.assertEqual({k: Decimal(v) if k in ("quantity", "price", "fee", "total_gross", "total_net") else v for k, v in original.items()}, trade)
+                self.assertEqual(store.trade(2), trades[2])
+
+                self.assertEqual([t["txid"] for t in store.trades("btc")], ["aaaaaaaaaa", "cccccccccc"])
+                self.assertEqual([t["txid"] for t in store.trades("btc", start="2024-06-01")], ["cccccccccc"])
+                self.assertEqual([t["txid"] for t in store.trades(end="2024-03-01 10:00:00")], ["aaaaaaaaaa"])
+                self.assertEqual(list(store.trades("doge")), [])
+
+            # appending to the CSV rebuilds the store
+            write_trades_normalized([dict(self.trades[0], txid="dddddddddd", date="2023-01-01 00:00:00")], csv_path)
+            self.assertTrue(build_columnar_store(csv_path, store_path))
+            with ColumnarStore(store_path) as store:
+                self.assertEqual(store.select("eth"), [0, 2])
+
+            export_path = os.path.join(tmpdir, "export.csv")
+            export_csv(store_path, export_path)
+            with open(export_path, "r", newline="") as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(list(rows[0].keys()), CSV_COLUMNS)
+            self.assertEqual(rows[1]["total_gross"], "0.00040000")
+
+    @patch("columnar_store.MERGE_SEGMENTS", 3)
+    def test_append_segments(self):
+        """Test that appended trades are read back in date order across segments and segments get merged."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store_path = os.path.join(tmpdir, "normalized_trades.cols")
+            added = []
+            for i, day in enumerate([5, 3, 9, 1, 7, 3, 8]):
+                trade = dict(self.trades[i % 3], date=f"2024-01-0{day} 00:00:00", txid=f"{i:010d}")
+                write_trades_normalized([trade], store_path)
+                added.append(trade)
+                with ColumnarStore(store_path) as store:
+                    # 3 single trade segments become one of 3 trades, 3 of those one of 9
+                    self.assertEqual([s.rows for s in store.segments], [[1], [1, 1], [3], [3, 1], [3, 1, 1], [3, 3], [3, 3, 1]][i])
+
+            with ColumnarStore(store_path) as store:
+                self.assertEqual([t["txid"] for t in store.trades()], [t["txid"] for t in sorted(added, key=lambda t: t["date"])])
+                self.assertEqual([store.trade(row)["txid"] for row in store.select("eth")], ["0000000003", "0000000000", "0000000006"])
+                self.assertEqual(store.column("type", store.select("btc", start="2024-01-08")), [TRADE_TYPES.index("sell")])
+                self.assertEqual(len(store), 7)
+            self.assertEqual(load_existing_txids(store_path), {t["txid"] for t in added})
+            # the store is not a copy of a CSV, so building one from a CSV must not replace it
+            with self.assertRaises(ValueError):
+                build_columnar_store(os.path.join(tmpdir, "normalized_trades.csv"), store_path)
+
+            export_path = os.path.join(tmpdir, "export.csv")
+            export_csv(store_path, export_path)
+            with open(export_path, "r", newline="") as f:
+                self.assertEqual([row["date"][:10] for row in csv.DictReader(f)], [f"2024-01-0{d}" for d in [1, 3, 3, 5, 7, 8, 9]])
+
+    def test_run_normalization_into_store(self):
+        """Test that ingestion appends to the columnar store only and dedups against it."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "my_trades.csv")
+            store_path = os.path.join(tmpdir, "normalized_trades.cols")
+            with open(input_path, "w") as f:
+                f.write("Date,Type,Asset,Quantity,Price,Fees,Notes\n2024-01-02,buy,BTC,1,100,,\n")
+            with redirect_stdout(io.StringIO()):
+                self.assertEqual(run_normalization(input_path, store_path), [])
+                with open(input_path, "a") as f:
+                    f.write("2024-01-01,buy,ETH,2,10,1,\n")
+                run_normalization(input_path, store_path)
+                run_normalization(input_path, store_path)
+            with ColumnarStore(store_path) as store:
+                self.assertEqual([(t["asset"], t["total_net"]) for t in store.trades()], [("eth", Decimal("21")), ("btc", Decimal("100"))])
+            self.assertEqual(sorted(os.listdir(tmpdir)), ["my_trades.csv", "normalized_trades.cols", "normalized_trades_cols_txids.sqlite"])
+
+    def test_time_zone_offsets(self):
+        """Test that dates with an offset are stored as UTC, so both stores accept them."""
+        raw = {"Date": "2024-01-01T10:00:00+01:00", "Type": "buy", "Asset": "BTC", "Quantity": "1", "Price": "10", "Fees": "", "Notes": ""}
+        self.assertEqual(normalize_trade(raw, "aaaaaaaaaa")["date"], datetime(2024, 1, 1, 9))
+        # a CSV normalized before keeps the offset, the store converts it
+        self.assertEqual(date_to_micros("2024-01-01 10:00:00+01:00"), date_to_micros("2024-01-01 09:00:00"))
+
+if __name__ == "__main__":
+    unittest.main()
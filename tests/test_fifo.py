@@ -1,5 +1,262 @@
+import io
+import os
+import random
+import sys
+import tempfile
 import unittest
+from collections import deque
+from contextlib import redirect_stdout
+from decimal import Decimal
+from unittest import mock
+from fractions import Fraction
 
 from fifo import (
-        
-)
\ No newline at end of file
+    Lot,
+    calculate_fifo,
+    calculate_fifo_all_years,
+    config_cache_path,
+    fifo_sweep,
+    load_config,
+    load_lot_snapshot,
+    match_sell,
+)
+
+def make_trade(date: str, trade_type: str, asset: str, quantity: str, total_net: str) -> dict:
+    """Builds a trade dictionary the way it is read back from the normalized CSV."""
+    return {
+        "date": f"{date} 00:00:00",
+        "asset": asset,
+        "type": trade_type,
+        "quantity": quantity,
+        "total_net": total_net,
+    }
+
+class TestFifo(unittest.TestCase):
+    def setUp(self):
+        self.trades = [
+            make_trade("2023-01-01", "buy", "btc", "1", "100"),
+            make_trade("2023-02-01", "buy", "btc", "1", "200"),
+            make_trade("2023-06-01", "sell", "btc", "1", "150"),
+            make_trade("2024-03-01", "sell", "btc", "1", "260"),
+            make_trade("2024-04-01", "buy", "eth", "2", "50"),
+        ]
+
+    def test_match_sell_splits_proceeds(self):
+        """Test that a sell over several lots only counts its share of the proceeds per lot."""
+        queue = deque([
+            Lot(Decimal("1"), Decimal("100"), Decimal("1"), "2023-01-01"),
+            Lot(Decimal("1"), Decimal("200"), Decimal("1"), "2023-02-01"),
+        ])
+        details, unmatched = match_sell(queue, Decimal("2"), Decimal("400"))
+        self.assertEqual(unmatched, Decimal("0"))
+        self.assertEqual([d["gain"] for d in details], [Decimal("100"), Decimal("0")])
+        self.assertEqual(sum(d["gain"] for d in details), Decimal("100"))
+        self.assertFalse(queue)
+
+    def test_match_sell_partial_lot(self):
+        """Test that a partly used lot keeps its remaining quantity and cost per unit."""
+        queue = deque([Lot(Decimal("4"), Decimal("10"), Decimal("4"), "2023-01-01")])
+        details, unmatched = match_sell(queue, Decimal("1"), Decimal("5"))
+        self.assertEqual(unmatched, Decimal("0"))
+        self.assertEqual(details[0]["cost_basis"], Decimal("2.5"))
+        self.assertEqual(queue[0].quantity, Decimal("3"))
+        self.assertEqual(queue[0].cost_per_unit, Decimal("2.5"))
+
+    def test_calculate_fifo_uses_lots_of_earlier_years(self):
+        """Test that sells of an earlier year use up lots before the chosen tax year."""
+        sold_lots = calculate_fifo(self.trades, 2024)
+        self.assertEqual(len(sold_lots), 1)
+        self.assertEqual(sold_lots[0]["details"][0]["buy_date"], "2023-02-01 00:00:00")
+        self.assertEqual(sold_lots[0]["total_gain"], Decimal("60"))
+
+    def test_calculate_fifo_all_years(self):
+        """Test per-year sold lots, totals and year end lot state from one pass."""
+        years = calculate_fifo_all_years(self.trades)
+        self.assertEqual(sorted(years), [2023, 2024])
+        self.assertEqual(years[2023]["total_gain"], Decimal("50"))
+        self.assertEqual(years[2024]["total_gain"], Decimal("60"))
+        self.assertEqual(years[2023]["open_lots"]["btc"][0]["date"], "2023-02-01 00:00:00")
+        self.assertNotIn("btc", years[2024]["open_lots"])
+        self.assertEqual(years[2024]["open_lots"]["eth"][0]["quantity"], Decimal("2"))
+        # must match the single year results
+        for year in years:
+            self.assertEqual(years[year]["sold_lots"], calculate_fifo(self.trades, year))
+
+    def test_sold_lots_only(self):
+        """Test that without open_lots only the year end lot states the snapshot and merge need are copied."""
+        trades = self.trades + [make_trade("2021-05-01", "buy", "ada", "10", "5"), make_trade("2022-03-01", "sell", "ada", "4", "8")]
+        full = calculate_fifo_all_years(trades)
+        for workers in [1, 2]:
+            years = calculate_fifo_all_years(trades, workers=workers, open_lots=False)
+            self.assertEqual([y for y in years if "open_lots" in years[y]], [2024])
+            self.assertEqual({y: r["sold_lots"] for y, r in years.items()}, {y: r["sold_lots"] for y, r in full.items()})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot_path = os.path.join(tmpdir, "lot_snapshot.json")
+            years = calculate_fifo_all_years(trades, snapshot_path, open_lots=False)
+            self.assertEqual([y for y in years if "open_lots" in years[y]], [2023, 2024])
+            self.assertEqual(load_lot_snapshot(snapshot_path)["lots"], full[2023]["open_lots"])
+
+    def test_lot_snapshot_resume(self):
+        """Test that a saved year end snapshot is resumed from and invalidated by earlier changes."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot_path = os.path.join(tmpdir, "lot_snapshot.json")
+            full = calculate_fifo_all_years(self.trades)
+
+            # first run replays everything and saves the 2023 lot state
+            first = calculate_fifo_all_years(self.trades, snapshot_path)
+            self.assertEqual(first, full)
+            self.assertEqual(load_lot_snapshot(snapshot_path)["year"], 2023)
+
+            # second run only needs the 2024 trades
+            resumed = calculate_fifo_all_years(self.trades, snapshot_path)
+            self.assertEqual(sorted(resumed), [2024])
+            self.assertEqual(resumed[2024], full[2024])
+
+            # a changed 2023 trade invalidates the snapshot
+            changed = [dict(t) for t in self.trades]
+            changed[1]["total_net"] = "220"
+            replayed = calculate_fifo_all_years(changed, snapshot_path)
+            self.assertEqual(sorted(replayed), [2023, 2024])
+            self.assertEqual(replayed[2024]["total_gain"], Decimal("40"))
+
+            # older years than the snapshot still replay the whole history
+            self.assertEqual(calculate_fifo(self.trades, 2023, snapshot_path), full[2023]["sold_lots"])
+
+    def test_parallel_matches_serial(self):
+        """Test that matching assets in a process pool gives the serial results."""
+        trades = self.trades + [
+            make_trade("2023-01-01", "buy", "eth", "3", "30"),
+            make_trade("2023-06-01", "sell", "eth", "1", "20"),
+            make_trade("2021-05-01", "buy", "ada", "10", "5"),
+            make_trade("2024-03-01", "sell", "ada", "4", "8"),
+        ]
+        serial = calculate_fifo_all_years(trades)
+        parallel = calculate_fifo_all_years(trades, workers=2)
+        self.assertEqual(parallel, serial)
+        self.assertEqual([lot["asset"] for lot in parallel[2024]["sold_lots"]], ["btc", "ada"])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot_path = os.path.join(tmpdir, "lot_snapshot.json")
+            calculate_fifo_all_years(trades, snapshot_path)
+            resumed = calculate_fifo_all_years(trades, snapshot_path, workers=2)
+            self.assertEqual(resumed[2024], serial[2024])
+
+    def test_parallel_total_gain_is_exact(self):
+        """Test that parallel year totals are added up in the serial order, to the last Decimal digit."""
+        rng = random.Random(7)
+        trades = []
+        for i in range(300):
+            asset = f"a{i % 7}"
+            date = f"2024-{1 + i // 30:02d}-{1 + i % 28:02d}"
+            trades.append(make_trade(date, "buy", asset, "3", str(rng.randint(1, 1000))))
+            trades.append(make_trade(date, "sell", asset, "1", str(rng.randint(1, 1000))))
+        serial = calculate_fifo_all_years(trades)
+        parallel = calculate_fifo_all_years(trades, workers=3)
+        self.assertEqual(str(parallel[2024]["total_gain"]), str(serial[2024]["total_gain"]))
+        self.assertEqual(parallel, serial)
+
+    def test_four_week_rule(self):
+        """Test that a loss is deferred onto the buys within 4 weeks after the sell."""
+        trades = [
+            make_trade("2024-01-01", "buy", "btc", "2", "200"),
+            make_trade("2024-12-20", "sell", "btc", "2", "100"),
+            # only the first buy is within 4 weeks, so half of the loss is disallowed
+            make_trade("2025-01-10", "buy", "btc", "1", "60"),
+            make_trade("2025-03-01", "buy", "btc", "1", "60"),
+            make_trade("2025-06-01", "sell", "btc", "2", "200"),
+        ]
+        off = calculate_fifo_all_years(trades)
+        on = calculate_fifo_all_years(trades, four_week_rule=True)
+        self.assertEqual(off[2024]["total_gain"], Decimal("-100"))
+        self.assertEqual(on[2024]["total_gain"], Decimal("-50"))
+        self.assertEqual(on[2024]["sold_lots"][0]["disallowed_loss"], Decimal("50"))
+        # the deferred loss raises the cost of the reacquired lot
+        self.assertEqual(on[2025]["total_gain"], Decimal("30"))
+        self.assertEqual([d["cost_basis"] for d in on[2025]["sold_lots"][0]["details"]], [Decimal("110"), Decimal("60")])
+        self.assertEqual(on[2024]["total_gain"] + on[2025]["total_gain"], off[2024]["total_gain"] + off[2025]["total_gain"])
+        self.assertEqual(calculate_fifo_all_years(trades, workers=2, four_week_rule=True), on)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot_path = os.path.join(tmpdir, "lot_snapshot.json")
+            calculate_fifo_all_years(trades, snapshot_path, four_week_rule=True)
+            self.assertTrue(load_lot_snapshot(snapshot_path)["four_week_rule"])
+            # the deferred loss is carried over in the snapshot
+            resumed = calculate_fifo_all_years(trades, snapshot_path, four_week_rule=True)
+            self.assertEqual(sorted(resumed), [2025])
+            self.assertEqual(resumed[2025], on[2025])
+            # a changed buy in the 4 weeks after the snapshot year invalidates it
+            changed = [dict(t) for t in trades]
+            changed[2]["quantity"] = "2"
+            replayed = calculate_fifo_all_years(changed, snapshot_path, four_week_rule=True)
+            self.assertEqual(replayed[2024]["total_gain"], Decimal("0"))
+            # a snapshot made with the rule is not used without it
+            self.assertEqual(calculate_fifo_all_years(trades, snapshot_path), off)
+
+        with self.assertRaises(ValueError):
+            fifo_sweep(trades, four_week_rule=True, fixed_point_scales=(8, 4))
+
+    def test_match_sell_rescales_lazily(self):
+        """Test that only the matched lots are rescaled to a new corporate action factor."""
+        queue = deque([Lot(Decimal("2"), Decimal("100"), Decimal("2"), "2024-01-01"), Lot(Decimal("1"), Decimal("80"), Decimal("1"), "2024-02-01")])
+        details, _ = match_sell(queue, Decimal("10"), Decimal("60"), Fraction(10))
+        self.assertEqual(details[0]["cost_basis"], Decimal("50"))
+        self.assertEqual(queue[0].quantity, Decimal("10"))
+        # the second lot was not touched yet
+        self.assertEqual((queue[1].quantity, queue[1].factor), (Decimal("1"), 1))
+
+    def test_corporate_actions(self):
+        """Test that splits, bonus issues and consolidations keep the cost of the open lots."""
+        trades = [
+            make_trade("2023-01-01", "buy", "acme", "3", "90"),
+            make_trade("2023-02-01", "buy", "acme", "1", "40"),
+            make_trade("2023-06-01", "split", "acme", "100", "0"),
+            make_trade("2023-07-01", "bonus", "acme", "0.5", "0"),
+            make_trade("2023-08-01", "consolidation", "acme", "3", "0"),
+            # 3 -> 300 -> 450 -> 150 and 1 -> 50
+            make_trade("2024-01-01", "sell", "acme", "160", "320"),
+        ]
+        years = calculate_fifo_all_years(trades)
+        self.assertEqual(years[2023]["open_lots"]["acme"][0]["quantity"], Decimal("150"))
+        self.assertEqual(years[2023]["open_lots"]["acme"][1]["quantity"], Decimal("50"))
+        details = years[2024]["sold_lots"][0]["details"]
+        self.assertEqual([d["used_qty"] for d in details], [Decimal("150"), Decimal("10")])
+        self.assertEqual([d["cost_basis"] for d in details], [Decimal("90"), Decimal("8")])
+        self.assertEqual(years[2024]["total_gain"], Decimal("222"))
+        self.assertEqual(years[2024]["open_lots"]["acme"][0]["quantity"], Decimal("40"))
+        with self.assertRaises(ValueError):
+            fifo_sweep(trades, fixed_point_scales=(8, 4))
+
+    def test_corporate_actions_do_not_add_up_rounding(self):
+        """Test that a consolidation that does not divide the lot, then a split, leave exact quantities."""
+        trades = [
+            make_trade("2023-01-01", "buy", "acme", "10", "100"),
+            make_trade("2023-02-01", "consolidation", "acme", "3", "0"),
+            make_trade("2023-03-01", "sell", "acme", "1", "20"),
+            make_trade("2023-04-01", "split", "acme", "3", "0"),
+            make_trade("2023-05-01", "sell", "acme", "7", "140"),
+        ]
+        output = io.StringIO()
+        with redirect_stdout(output):
+            years = calculate_fifo_all_years(trades)
+        self.assertNotIn("Unmatched", output.getvalue())
+        self.assertEqual(years[2023]["sold_lots"][1]["details"][0]["used_qty"], Decimal("7"))
+        self.assertEqual(years[2023]["open_lots"], {})
+
+    def test_load_config_cache(self):
+        """Test that a new process reads the precompiled config until the YAML file changes."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_path = os.path.join(tmpdir, "config.yaml")
+            with open(config_path, "w") as f:
+                f.write("CGT_TAX_Normal: 0.33\nBROKER_FORMATS: {}\n")
+            # __wrapped__ skips the per process cache, like a new process
+            self.assertEqual(load_config.__wrapped__(config_path), {"CGT_TAX_Normal": 0.33, "BROKER_FORMATS": {}})
+            self.assertTrue(os.path.exists(config_cache_path(config_path)))
+            with mock.patch.dict(sys.modules, {"yaml": None}):
+                self.assertEqual(load_config.__wrapped__(config_path)["CGT_TAX_Normal"], 0.33)
+
+            with open(config_path, "w") as f:
+                f.write("CGT_TAX_Normal: 0.4\n")
+            self.assertEqual(load_config.__wrapped__(config_path), {"CGT_TAX_Normal": 0.4})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import tempfile
+import os
+from decimal import Decimal
+
+from calculator import CGTCalculator
+from fifo import calculate_fifo_all_years
+from fixed_point import (
+    div_round,
+    from_fixed,
+    rescale,
+    to_fixed,
+)
+from normalization import write_trades_normalized
+
+class TestFixedPoint(unittest.TestCase):
+    def test_to_fixed_and_back(self):
+        """Test conversion between numbers and scaled integers."""
+        self.assertEqual(to_fixed("1.5", 4), 15000)
+        self.assertEqual(to_fixed(Decimal("-0.00005"), 4), 0)
+        self.assertEqual(to_fixed("0.00015", 4), 2)
+        self.assertEqual(from_fixed(15000, 4), Decimal("1.5"))
+        self.assertEqual(to_fixed("0.12345678", 8, exact=True), 12345678)
+        with self.assertRaises(ValueError):
+            to_fixed("0.123456789", 8, exact=True)
+
+    def test_rescale(self):
+        """Test conversion of a coefficient and exponent to a scaled integer."""
+        self.assertEqual(rescale(15, -1, 4), 15000)
+        self.assertEqual(rescale(-123456, -6, 4), -1235)
+        self.assertEqual(rescale(5, 2, 4), 5000000)
+        self.assertEqual(rescale(12345678, -8, 8, exact=True), 12345678)
+        with self.assertRaises(ValueError):
+            rescale(123456789, -9, 8, exact=True)
+
+    def test_div_round(self):
+        """Test integer division with half even rounding."""
+        self.assertEqual(div_round(7, 2), 4)
+        self.assertEqual(div_round(5, 2), 2)
+        self.assertEqual(div_round(-7, 2), -4)
+        self.assertEqual(div_round(10, 3), 3)
+        self.assertEqual(div_round(20, -3), -7)
+
+    def test_matches_decimal_path(self):
+        """Test that the fixed-point engine gives the Decimal results to the cent."""
+        trades = [
+            {"date": "2023-01-01 00:00:00", "asset": "btc", "type": "buy", "quantity": "0.3", "total_net": "10000.01"},
+            {"date": "2023-01-02 00:00:00", "asset": "btc", "type": "buy", "quantity": "0.7", "total_net": "21000.333"},
+            {"date": "2023-05-01 00:00:00", "asset": "btc", "type": "sell", "quantity": "0.45", "total_net": "18000.7"},
+            {"date": "2024-05-01 00:00:00", "asset": "btc", "type": "sell", "quantity": "0.33333333", "total_net": "15000"},
+        ]
+        decimal_years = calculate_fifo_all_years(trades)
+        fixed_years = calculate_fifo_all_years(trades, fixed_point_scales=(8, 4))
+        self.assertEqual(sorted(fixed_years), sorted(decimal_years))
+        for year in decimal_years:
+            self.assertLess(abs(fixed_years[year]["total_gain"] - decimal_years[year]["total_gain"]), Decimal("0.01"))
+            for fixed_lot, decimal_lot in zip(fixed_years[year]["sold_lots"], decimal_years[year]["sold_lots"]):
+                self.assertEqual(fixed_lot["quantity"], decimal_lot["quantity"])
+                self.assertEqual(len(fixed_lot["details"]), len(decimal_lot["details"]))
+            for asset, lots in decimal_years[year]["open_lots"].items():
+                self.assertEqual([l["quantity"] for l in fixed_years[year]["open_lots"][asset]], [l["quantity"] for l in lots])
+
+    def test_load_trades_scaled(self):
+        """Test that both stores load scaled integers once and give the Decimal results to the cent."""
+        trades = [
+            {"date": "2023-01-01 00:00:00", "asset": "btc", "type": "buy", "quantity": "0.3", "price": "0", "fee": "0",
+             "total_gross": "0", "total_net": "10000.01", "txid": "aaaaaaaaaa", "note": ""},
+            {"date": "2023-01-02 00:00:00", "asset": "btc", "type": "buy", "quantity": "0.7", "price": "0", "fee": "0",
+             "total_gross": "0", "total_net": "21000.333", "txid": "bbbbbbbbbb", "note": ""},
+            {"date": "2024-05-01 00:00:00", "asset": "btc", "type": "sell", "quantity": "0.33333333", "price": "0", "fee": "0",
+             "total_gross": "0", "total_net": "15000.55555", "txid": "cccccccccc", "note": ""},
+        ]
+        expected = CGTCalculator().calculate(trades, 2024)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for store in ("csv", "columnar"):
+                calculator = CGTCalculator({"NORMALIZED_STORE": store, "FIXED_POINT": True})
+                path = calculator.normalized_path(os.path.join(tmpdir, "normalized_trades.csv"))
+                write_trades_normalized(trades, path)
+                loaded = calculator.load_trades(path)
+                self.assertEqual([(t["quantity"], t["total_net"]) for t in loaded][1:], [(70000000, 210003330), (33333333, 150005556)])
+                result = calculator.calculate(loaded, 2024)
+                self.assertLess(abs(result["total_gain"] - expected["total_gain"]), Decimal("0.01"))
+                self.assertEqual(result["tax_due"], expected["tax_due"])
+        with self.assertRaises(ValueError):
+            CGTCalculator({"FIXED_POINT": True, "FOUR_WEEK_RULE": True})
+
+if __name__ == "__main__":
+    unittest.main()
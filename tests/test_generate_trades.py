@@ -0,0 +1,25 @@
+import unittest
+from collections import defaultdict
+from decimal import Decimal
+
+from benchmarks.generate_trades import generate_rows
+from normalization import check_valid_input
+
+class TestGenerateTrades(unittest.TestCase):
+    def test_generate_rows(self):
+        """Test that synthetic trades are reproducible, valid and never oversell."""
+        rows = list(generate_rows(2000, 10, seed=7))
+        self.assertEqual(len(rows), 2000)
+        self.assertEqual(rows, list(generate_rows(2000, 10, seed=7)))
+        self.assertNotEqual(rows, list(generate_rows(2000, 10, seed=8)))
+        self.assertEqual(check_valid_input(rows), [])
+        self.assertEqual(rows, sorted(rows, key=lambda r: r["Date"]))
+
+        held = defaultdict(Decimal)
+        for row in rows:
+            held[row["Asset"]] += Decimal(row["Quantity"]) if row["Type"] == "buy" else -Decimal(row["Quantity"])
+            self.assertGreaterEqual(held[row["Asset"]], 0)
+        self.assertIn("sell", {row["Type"] for row in rows})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,26 @@
 import unittest
 import tempfile
 import csv
+import io
 import os
+from contextlib import redirect_stdout
+from unittest import mock
+import normalization
 from normalization import (
     load_existing_txids, #done
     write_trades_normalized, #done
     make_txid, #done
     check_valid_input,
+    check_valid_columns,
     is_valid_date, #done
     is_valid_number, #done
+    run_normalization,
+    read_raw_chunks,
+    parse_chunk,
+    canonical_key,
+    txid_from_key,
+    txid_index_path,
+    normalize_trade,
 )
 
 class TestNormalization(unittest.TestCase):
@@ -161,5 +173,138 @@ class TestNormalization(unittest.TestCase):
         self.assertTrue(any("Invalid trade type: Transfer." in err for err in error_data))
         self.assertTrue(any("Invalid value for Price: 'Money'" in err for err in error_data))
 
+    def test_check_valid_columns_matches_check_valid_input(self):
+        """Test that the batched validator gives the same report as the per row one."""
+        good = {"Date": "2025-01-31 10:00:00", "Type": "buy", "Asset": "BTC", "Quantity": "1.0", "Price": "30000", "Fees": "", "Notes": ""}
+        trades = [dict(good) for _ in range(12)]
+        trades[1]["Date"] = "2025-02-30"
+        trades[2]["Type"] = " SELL "
+        trades[3]["Type"] = "Transfer"
+        trades[4]["Quantity"] = "1,5"
+        trades[5]["Price"] = ""
+        trades[6]["Fees"] = "abc"
+        trades[7]["Asset"] = " "
+        trades[8]["Fees"] = " 2 "
+        trades[9]["Quantity"] = "1\n2"
+        trades[10][None] = ["extra"]
+        self.assertEqual(check_valid_columns(trades, start_line=5), check_valid_input(trades, start_line=5))
+        self.assertEqual(len(check_valid_columns(trades)), 8)
+        self.assertEqual(check_valid_columns([good] * 3), [])
+        # unexpected columns are reported for every row
+        wrong_header = [dict(good, Extra="1")] * 2
+        self.assertEqual(check_valid_columns(wrong_header), check_valid_input(wrong_header))
+
+    def test_corporate_actions(self):
+        """Test that corporate actions need a positive ratio and move no money."""
+        split = {"Date": "2025-03-01", "Type": "Split", "Asset": "AAPL", "Quantity": "4", "Price": "0", "Fees": "", "Notes": ""}
+        trades = [split, dict(split, Type="bonus", Quantity="0.5"), dict(split, Quantity="0"), dict(split, Type="consolidation", Quantity="-10"),
+                  dict(split, Quantity="NaN"), dict(split, Type="bonus", Quantity="sNaN"), dict(split, Quantity="Infinity")]
+        self.assertEqual(check_valid_columns(trades), check_valid_input(trades))
+        self.assertEqual(len(check_valid_input(trades)), 5)
+        self.assertIn("Invalid ratio for split", check_valid_input(trades)[0])
+        normalized = normalize_trade(dict(split, Price="150", Fees="1"), "0000000001")
+        self.assertEqual((normalized["type"], normalized["quantity"], normalized["total_net"]), ("split", 4, 0))
+
+    def test_raw_chunks_line_numbers(self):
+        """Test that chunked validation reports the same line numbers as a full read."""
+        lines = ["Date,Type,Asset,Quantity,Price,Fees,Notes"]
+        lines += [f"2025-01-0{i},buy,BTC,1,100,," for i in range(1, 6)]
+        lines[4] = "2025-01-04,transfer,BTC,1,100,,"
+        content = io.BytesIO(("\n".join(lines) + "\n").encode())
+
+        chunks = []
+        start_line = 2
+        for header, data in read_raw_chunks(content, chunk_size=2):
+            rows = parse_chunk(header, data)
+            chunks.append((start_line, rows))
+            start_line += len(rows)
+        self.assertEqual([(start, len(rows)) for start, rows in chunks], [(2, 2), (4, 2), (6, 1)])
+        errors = [err for start, rows in chunks for err in check_valid_input(rows, start)]
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith("Line 5: Invalid trade type: transfer."))
+
+    def test_txid_from_key(self):
+        """Test that the canonical row key gives the same txid as make_txid on cleaned fields."""
+        raw = {"Date": " 2025-01-01 ", "Type": "Buy ", "Asset": "BTC", "Quantity": "1.0", "Price": "30000"}
+        cleaned = {"Date": "2025-01-01", "Type": "buy", "Asset": "btc", "Quantity": "1.0", "Price": "30000"}
+        self.assertEqual(canonical_key(raw), ("2025-01-01", "buy", "btc", "1.0", "30000"))
+        self.assertEqual(txid_from_key(canonical_key(raw)), make_txid(cleaned))
+
+    def test_read_raw_chunks_keeps_quoted_values(self):
+        """Test that a quoted value with a line break is not split over two chunks."""
+        content = io.BytesIO(b'Date,Type,Asset,Quantity,Price,Fees,Notes\n2025-01-01,buy,BTC,1,1,,"two\nlines"\n2025-01-02,buy,BTC,1,1,,\n')
+        chunks = list(read_raw_chunks(content, chunk_size=1))
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[0][1].endswith(b'lines"\n'))
+
+    def test_read_raw_chunks_stray_quote(self):
+        """Test that a quote inside an unquoted value does not keep the rest of the file in one chunk."""
+        rows = [b'2025-01-01,buy,BTC,1,1,,27" monitor\n'] + [b'2025-01-02,buy,BTC,1,1,,"a ""b"" c"\n'] * 5
+        content = io.BytesIO(b"Date,Type,Asset,Quantity,Price,Fees,Notes\n" + b"".join(rows))
+        chunks = list(read_raw_chunks(content, chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sum(len(parse_chunk(*chunk)) for chunk in chunks), 6)
+        self.assertEqual(parse_chunk(*chunks[0])[0]["Notes"], '27" monitor')
+
+    def test_run_normalization_skips_known_chunks(self):
+        """Test that unchanged chunks are not parsed again and line numbers still count them."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "my_trades.csv")
+            normalized_path = os.path.join(tmpdir, "normalized_trades.csv")
+            lines = [f"2025-01-{day:02d},buy,BTC,1,100,," for day in range(1, 6)]
+            with open(input_path, "w") as f:
+                f.write("Date,Type,Asset,Quantity,Price,Fees,Notes\n" + "\n".join(lines) + "\n")
+            with redirect_stdout(io.StringIO()):
+                with mock.patch("normalization.read_raw_chunks", lambda f: read_raw_chunks(f, chunk_size=2)):
+                    run_normalization(input_path, normalized_path)
+                    with mock.patch("normalization.parse_chunk", side_effect=normalization.parse_chunk) as parse:
+                        run_normalization(input_path, normalized_path)
+                        self.assertEqual(parse.call_count, 0)
+                        with open(input_path, "a") as f:
+                            f.write("2025-01-06,transfer,BTC,1,100,,\n")
+                        errors = run_normalization(input_path, normalized_path)
+                        # only the changed last chunk is parsed
+                        self.assertEqual(parse.call_count, 1)
+            self.assertEqual(len(errors), 1)
+            self.assertTrue(errors[0].startswith("Line 7: Invalid trade type"))
+
+    def test_run_normalization_appends(self):
+        """Test that new trades are appended to the normalized CSV and known trades are skipped."""
+        fieldnames = ["Date", "Type", "Asset", "Quantity", "Price", "Fees", "Notes"]
+        rows = [
+            {"Date": "2025-01-01", "Type": "Buy", "Asset": "BTC", "Quantity": "1.0", "Price": "30000", "Fees": "10", "Notes": ""},
+            {"Date": "2025-02-01", "Type": "Sell", "Asset": "BTC", "Quantity": "0.5", "Price": "40000", "Fees": "", "Notes": ""},
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "my_trades.csv")
+            normalized_path = os.path.join(tmpdir, "normalized_trades.csv")
+
+            def write_input(input_rows):
+                with open(input_path, "w", newline="") as f:
+                    writer = csv.DictWriter(f, fieldnames=fieldnames)
+                    writer.writeheader()
+                    writer.writerows(input_rows)
+
+            def read_txids():
+                with open(normalized_path, newline="") as f:
+                    return [row["txid"] for row in csv.DictReader(f)]
+
+            write_input(rows[:1])
+            run_normalization(input_path, normalized_path)
+            self.assertTrue(os.path.exists(txid_index_path(normalized_path)))
+
+            # earlier rows are kept, only the new row is added
+            write_input(rows)
+            run_normalization(input_path, normalized_path)
+            first_run = read_txids()
+            self.assertEqual(len(first_run), 2)
+            run_normalization(input_path, normalized_path)
+            self.assertEqual(read_txids(), first_run)
+
+            # the index follows the CSV if it is removed by hand
+            os.remove(normalized_path)
+            run_normalization(input_path, normalized_path)
+            self.assertEqual(read_txids(), first_run)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
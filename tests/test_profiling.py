@@ -0,0 +1,47 @@
+import unittest
+import tempfile
+import json
+import os
+
+import profiling
+from fifo import calculate_fifo_all_years
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.trades = [
+            {"date": "2024-01-01 00:00:00", "asset": "btc", "type": "buy", "quantity": "1", "total_net": "100"},
+            {"date": "2024-01-02 00:00:00", "asset": "btc", "type": "buy", "quantity": "1", "total_net": "100"},
+            {"date": "2024-02-01 00:00:00", "asset": "btc", "type": "sell", "quantity": "1.5", "total_net": "300"},
+        ]
+
+    def tearDown(self):
+        profiling.disable_profiling()
+
+    def test_disabled_collects_nothing(self):
+        """Test that nothing is collected while profiling is off."""
+        profiling.enable_profiling()
+        profiling.disable_profiling()
+        calculate_fifo_all_years(self.trades)
+        self.assertEqual(profiling.STAGES, {})
+        self.assertEqual(profiling.COUNTERS, {})
+
+    def test_fifo_counters_and_profile_file(self):
+        """Test stage timings, FIFO counters and the written profile."""
+        profiling.enable_profiling()
+        calculate_fifo_all_years(self.trades)
+        self.assertEqual(profiling.STAGES["fifo_sweep"]["calls"], 1)
+        self.assertEqual(profiling.COUNTERS["lots_created"], 2)
+        self.assertEqual(profiling.COUNTERS["lot_matches"], 2)
+        self.assertEqual(profiling.COUNTERS["partial_matches"], 1)
+        self.assertEqual(profiling.PEAK_QUEUE_DEPTH, {"btc": 2})
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "profile.json")
+            profiling.write_profile(path)
+            with open(path) as f:
+                profile = json.load(f)
+        self.assertIn("fifo_sort", profile["stages"])
+        self.assertTrue(all(event["ph"] == "X" for event in profile["traceEvents"]))
+
+if __name__ == "__main__":
+    unittest.main()
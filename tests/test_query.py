@@ -0,0 +1,71 @@
+import unittest
+import tempfile
+import os
+from decimal import Decimal
+
+from normalization import write_trades_normalized
+from query import open_store, open_position, open_positions, realised_gains
+
+def make_trade(date, asset, trade_type, quantity, total_net, txid):
+    return {"date": date, "asset": asset, "type": trade_type, "quantity": quantity, "price": "0", "fee": "0",
+            "total_gross": total_net, "total_net": total_net, "txid": txid, "note": ""}
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmpdir.name, "normalized_trades.csv")
+        write_trades_normalized([
+            make_trade("2024-01-10 00:00:00", "eth", "buy", "2", "2000", "0000000001"),
+            make_trade("2024-02-10 00:00:00", "eth", "buy", "2", "3000", "0000000002"),
+            make_trade("2024-02-20 00:00:00", "btc", "buy", "1", "40000", "0000000003"),
+            make_trade("2024-03-05 00:00:00", "eth", "sell", "1", "2500", "0000000004"),
+            make_trade("2024-03-25 00:00:00", "eth", "sell", "2", "4000", "0000000005"),
+            make_trade("2024-04-02 00:00:00", "btc", "sell", "1", "50000", "0000000006"),
+        ], self.csv_path)
+        self.store = open_store(self.csv_path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_open_position(self):
+        """Test open quantity and cost basis, now and at an earlier date."""
+        position = open_position(self.store, "ETH")
+        self.assertEqual(position["quantity"], Decimal("1"))
+        self.assertEqual(position["cost_basis"], Decimal("1500"))
+        earlier = open_position(self.store, "eth", as_of="2024-03-10")
+        self.assertEqual(earlier["quantity"], Decimal("3"))
+        self.assertEqual(earlier["cost_basis"], Decimal("4000"))
+        self.assertEqual([p["asset"] for p in open_positions(self.store)], ["eth"])
+        self.assertEqual(open_position(self.store, "doge")["quantity"], Decimal("0"))
+
+    def test_realised_gains_window(self):
+        """Test that sells before the window use up lots but are not reported."""
+        march = realised_gains(self.store, "2024-03-10", "2024-04-01")
+        self.assertEqual(len(march["sold_lots"]), 1)
+        # the first eth lot has 1 left at 1000/unit, then 1 of the second at 1500/unit
+        self.assertEqual(march["total_gain"], Decimal("4000") - Decimal("2500"))
+        everything = realised_gains(self.store)
+        self.assertEqual([lot["asset"] for lot in everything["sold_lots"]], ["eth", "eth", "btc"])
+        self.assertEqual(realised_gains(self.store, "2024-04-01", asset="eth")["sold_lots"], [])
+
+    def test_four_week_rule(self):
+        """Test that a buy just after the window disallows a loss in it, like in the reports."""
+        csv_path = os.path.join(self.tmpdir.name, "four_week_trades.csv")
+        write_trades_normalized([
+            make_trade("2024-01-10 00:00:00", "eth", "buy", "1", "3000", "0000000001"),
+            make_trade("2024-03-25 00:00:00", "eth", "sell", "1", "2000", "0000000002"),
+            make_trade("2024-04-05 00:00:00", "eth", "buy", "1", "2100", "0000000003"),
+        ], csv_path)
+        self.store.close()
+        self.store = open_store(csv_path)
+        self.assertEqual(realised_gains(self.store, "2024-03-01", "2024-04-01")["total_gain"], Decimal("-1000"))
+        march = realised_gains(self.store, "2024-03-01", "2024-04-01", four_week_rule=True)
+        self.assertEqual(len(march["sold_lots"]), 1)
+        self.assertEqual(march["total_gain"], Decimal("0"))
+        # the disallowed loss moves to the cost of the buy that reacquired the asset
+        self.assertEqual(open_position(self.store, "eth")["cost_basis"], Decimal("2100"))
+        self.assertEqual(open_position(self.store, "eth", four_week_rule=True)["cost_basis"], Decimal("3100"))
+
+if __name__ == "__main__":
+    unittest.main()
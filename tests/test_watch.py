@@ -0,0 +1,97 @@
+import unittest
+import tempfile
+import io
+import os
+import random
+from contextlib import redirect_stdout
+from functools import partial
+
+from app import generate_report, year_report_path
+from calculator import CGTCalculator
+from watch import TradeWatcher
+
+write_report = partial(generate_report, tax_rate=CGTCalculator().tax_rate, exemption=CGTCalculator().exemption)
+
+HEADER = "Date,Type,Asset,Quantity,Price,Fees,Notes\n"
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.tmpdir.name, "my_trades.csv")
+        self.normalized_file = os.path.join(self.tmpdir.name, "normalized_trades.csv")
+        self.output_file = os.path.join(self.tmpdir.name, "report.csv")
+        with open(self.input_file, "w") as f:
+            f.write(HEADER)
+            f.write("2023-01-01,buy,BTC,2,100,,\n2023-06-01,buy,ETH,1,50,,\n2024-02-01,sell,BTC,1,300,,\n2024-03-01,sell,ETH,1,80,,\n")
+        self.watcher = TradeWatcher(CGTCalculator(), self.input_file, self.normalized_file, self.output_file, 2024, False,
+                                    write_report, year_report_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def cold_report(self) -> str:
+        calculator = CGTCalculator()
+        result = calculator.calculate(calculator.load_trades(self.normalized_file), 2024)
+        cold_file = os.path.join(self.tmpdir.name, "cold.csv")
+        write_report(result["sold_lots"], cold_file)
+        with open(cold_file) as f:
+            return f.read()
+
+    def test_update_matches_full_run(self):
+        """Test that appended and inserted trades give the same report as a full run."""
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(self.watcher.start(), [])
+            with open(self.input_file, "a") as f:
+                # an earlier BTC buy changes the lots the 2024 BTC sell uses
+                f.write("2022-01-01,buy,BTC,1,10,,\n2024-05-01,sell,BTC,1,400,1,\n")
+            self.assertEqual(self.watcher.update(), [])
+        self.assertEqual(self.watcher.txids, {t["txid"] for t in CGTCalculator().load_trades(self.normalized_file)})
+        with open(self.output_file) as f:
+            self.assertEqual(f.read(), self.cold_report())
+        self.assertIn("2022-01-01", self.cold_report())
+
+    def test_year_total_matches_full_run(self):
+        """Test that the year total is added up in the order of a full run, to the last Decimal digit."""
+        rng = random.Random(7)
+        with open(self.input_file, "w") as f:
+            f.write(HEADER)
+            for i in range(300):
+                date = f"2024-{1 + i // 30:02d}-{1 + i % 28:02d}"
+                f.write(f"{date},buy,A{i % 7},3,{rng.randint(1, 1000)},1,\n{date},sell,A{i % 7},1,{rng.randint(1, 1000)},,\n")
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(self.watcher.start(), [])
+        calculator = CGTCalculator()
+        cold = calculator.calculate(calculator.load_trades(self.normalized_file), 2024)
+        self.assertEqual(str(self.watcher.year_result(2024)["total_gain"]), str(cold["total_gain"]))
+
+    def test_invalid_rows_change_nothing(self):
+        """Test that an invalid new row is reported with its line number and nothing is ingested."""
+        with redirect_stdout(io.StringIO()):
+            self.watcher.start()
+            with open(self.input_file, "a") as f:
+                f.write("2024-05-01,transfer,BTC,1,400,,\n")
+            errors = self.watcher.update()
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith("Line 6: Invalid trade type"))
+        self.assertEqual(len(CGTCalculator().load_trades(self.normalized_file)), 4)
+
+    def test_four_week_rule_across_year_end(self):
+        """Test that a January buy rewrites the report of the year before when it disallows a December loss."""
+        with open(self.input_file, "w") as f:
+            f.write(HEADER)
+            f.write("2024-01-01,buy,BTC,1,200,,\n2024-12-20,sell,BTC,1,100,,\n2025-03-01,buy,ETH,1,50,,\n")
+        watcher = TradeWatcher(CGTCalculator({"FOUR_WEEK_RULE": True}), self.input_file, self.normalized_file, self.output_file,
+                               2025, True, write_report, year_report_path)
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(watcher.start(), [])
+            with open(self.input_file, "a") as f:
+                f.write("2025-01-05,buy,BTC,1,90,,\n")
+            self.assertEqual(watcher.update(), [])
+        self.assertEqual(watcher.year_result(2024)["total_gain"], 0)
+        with open(year_report_path(self.output_file, 2024)) as f:
+            year_total = f.read().splitlines()[-1]
+        self.assertTrue(year_total.startswith("year_total"))
+        self.assertNotIn("-100", year_total)
+
+if __name__ == "__main__":
+    unittest.main()
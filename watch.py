@@ -0,0 +1,331 @@
+import csv
+import io
+import os
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from decimal import Decimal
+from typing import Callable
+
+from calculator import CGTCalculator
+from fifo import fifo_sweep
+from normalization import (
+    canonical_key, check_valid_input, normalize_trade, open_txid_index, txid_index_path, txid_from_key, add_txids,
+    run_normalization, write_trades_normalized,
+)
+
+# --- Seconds between two checks of the input file
+WATCH_INTERVAL = 1.0
+
+def parse_row(row) -> list[str]:
+    """
+    Gets the fields of a row key of read_input.
+    Args:
+        row (bytes | tuple[str, ...]): The raw line, or the fields already parsed.
+    Returns:
+        list[str]: The fields of the row.
+    """
+    # a raw line (bytes) still has to be split into its fields
+    return next(csv.reader([row.decode()])) if isinstance(row, bytes) else list(row)
+
+def row_dict(header: list[str], fields: list[str]) -> dict:
+    """
+    Builds a raw trade dictionary from a row's fields, like csv.DictReader does.
+    Args:
+        header (list[str]): The column names.
+        fields (list[str]): The fields of the row.
+    Returns:
+        dict: The raw trade, extra fields under the key None, missing fields as None.
+    """
+    row = dict(zip(header, fields))
+    if len(fields) > len(header):
+        row[None] = fields[len(header):]
+    for name in header[len(fields):]:
+        row[name] = None
+    return row
+
+def trade_year(trade: dict) -> int:
+    """
+    Gets the tax year of a normalized trade.
+    Args:
+        trade (dict): The normalized trade dictionary.
+    Returns:
+        int: The year of its date.
+    """
+    # normalized dates are ISO formatted, so the year is the first 4 chars
+    return int(str(trade["date"])[:4])
+
+class TradeWatcher:
+    """
+    Keeps the normalized trades and the FIFO results per asset in memory and updates them when
+    the input CSV changes. Rows that are new in the input (new txid) are appended to the
+    normalized store like in a normal run, then only their assets are matched again, starting
+    from the year end lot state before the earliest new trade.
+    """
+
+    def __init__(self, calculator: CGTCalculator, input_file: str, normalized_file: str, output_file: str, year: int,
+                 all_years: bool, write_report: Callable[[list[dict], str], None], year_report_path: Callable[[str, int], str]):
+        """
+        Args:
+            calculator (CGTCalculator): The calculator with the config to use.
+            input_file (str): The path to the input trades CSV that is watched.
+            normalized_file (str): The path to the normalized store (see CGTCalculator.normalized_path).
+            output_file (str): The path to the output report CSV.
+            year (int): The tax year to report.
+            all_years (bool): If True, keep one report per tax year instead.
+            write_report (Callable): Writes the sold lots of a year to a report file (e.g. app.generate_report with the tax rate and exemption bound).
+            year_report_path (Callable): Gives the report path of one tax year (see app.year_report_path).
+        """
+        self.calculator = calculator
+        self.input_file = input_file
+        self.normalized_file = normalized_file
+        self.output_file = output_file
+        self.year = year
+        self.all_years = all_years
+        self.write_report = write_report
+        self.year_report_path = year_report_path
+
+        self.input_stat = None
+        self.ready = False
+        self.input_header = None
+        self.input_rows = set()
+        self.txids = set()
+        self.position = {}
+        self.asset_trades = defaultdict(list)
+        self.asset_years = {}
+
+    # --- State
+    def add_trades(self, trades: list[dict]) -> dict[str, int]:
+        """
+        Adds normalized trades to the in memory state, in the order of the normalized CSV.
+        Args:
+            trades (list[dict]): The normalized trade dictionaries.
+        Returns:
+            dict[str, int]: Per asset the year of its earliest added trade.
+        """
+        changed = {}
+        for t in trades:
+            self.position[id(t)] = len(self.position)
+            self.txids.add(t["txid"])
+            # date sorted, trades with the same date keep the order of the normalized CSV
+            insort(self.asset_trades[t["asset"]], t, key=lambda x: (str(x["date"]), self.position[id(x)]))
+            changed[t["asset"]] = min(changed.get(t["asset"], trade_year(t)), trade_year(t))
+        return changed
+
+    def rematch(self, asset: str, from_year: int) -> int:
+        """
+        Runs FIFO for one asset from a year on, starting from the asset's lots at the end of
+        the year before (the results of earlier years are kept).
+        Args:
+            asset (str): The asset.
+            from_year (int): The first year that changed.
+        Returns:
+            int: The first year whose results were matched again (a year earlier with the 4-week rule).
+        """
+        old_years = self.asset_years.get(asset, {})
+        if self.calculator.four_week_rule:
+            # a new buy early in the year can disallow a loss of the year before
+            from_year -= 1
+        # the asset might not have traded in the year before, its lots are those of its last year
+        earlier = [y for y in old_years if y < from_year]
+        start_year = max(earlier) if earlier else None
+        initial_lots = old_years[start_year]["open_lots"] if earlier else None
+        deferred_losses = old_years[start_year].get("deferred_losses") if earlier else None
+        trades = self.asset_trades[asset]
+        first = 0 if start_year is None else bisect_left(trades, str(start_year + 1), key=lambda t: str(t["date"]))
+        new_years = fifo_sweep(
+            trades[first:], initial_lots, start_year, self.calculator.four_week_rule, deferred_losses,
+            fixed_point_scales=self.calculator.fixed_point_scales,
+        )
+        self.asset_years[asset] = {**{y: r for y, r in old_years.items() if y <= (start_year or 0)}, **new_years}
+        return from_year
+
+    def year_result(self, year: int) -> dict:
+        """
+        Collects the sold lots of every asset in a tax year, in the order of a single FIFO pass.
+        Args:
+            year (int): The tax year.
+        Returns:
+            dict: The sold lots and the tax totals of the year.
+        """
+        tagged = []
+        for asset, years in self.asset_years.items():
+            if year not in years:
+                continue
+            trades = self.asset_trades[asset]
+            first = bisect_left(trades, str(year), key=lambda t: str(t["date"]))
+            last = bisect_left(trades, str(year + 1), key=lambda t: str(t["date"]))
+            sells = [t for t in trades[first:last] if t["type"] == "sell"]
+            tagged.extend(((str(t["date"]), self.position[id(t)]), lot) for t, lot in zip(sells, years[year]["sold_lots"]))
+        tagged.sort(key=lambda item: item[0])
+        sold_lots = [lot for _, lot in tagged]
+        # added up in sell order like in a single FIFO pass, Decimal sums are rounded per addition
+        total_gain = sum((lot["total_gain"] for lot in sold_lots), Decimal(0))
+        return {"sold_lots": sold_lots, **self.calculator.tax_totals(total_gain)}
+
+    def write_reports(self, from_year: int | None = None) -> None:
+        """
+        Writes the report of the tax year (or, with all_years, every tax year from from_year on).
+        Args:
+            from_year (int | None): The first year that changed, None for all years.
+        """
+        if not self.all_years:
+            result = self.year_result(self.year)
+            if not result["sold_lots"]:
+                print(f"WARNING: No sell trade found in tax year {self.year}")
+            self.write_report(result["sold_lots"], self.output_file)
+            print(f"INFO: {self.year}: {len(result['sold_lots'])} sells, total gain {result['total_gain']}, tax due {result['tax_due']}")
+            return
+        years = sorted({y for asset_years in self.asset_years.values() for y in asset_years})
+        for year in years:
+            if from_year is not None and year < from_year:
+                continue
+            result = self.year_result(year)
+            self.write_report(result["sold_lots"], self.year_report_path(self.output_file, year))
+            print(f"INFO: {year}: {len(result['sold_lots'])} sells, total gain {result['total_gain']}, tax due {result['tax_due']}")
+
+    # --- Input
+    def read_input(self) -> list:
+        """
+        Reads the input CSV as one key per row and remembers its size and modification time.
+        A row's key is its raw line, or its parsed fields if the file has quotes (a quoted
+        value might span lines). Only rows with a new key have to be parsed.
+        Returns:
+            list: The header's key, then the key of every row (empty rows left out).
+        """
+        self.input_stat = self.stat_input()
+        with open(self.input_file, "rb") as f:
+            content = f.read()
+        if b'"' in content:
+            rows = [tuple(row) for row in csv.reader(io.StringIO(content.decode(), newline=""))]
+        else:
+            rows = content.splitlines()
+        return [row for row in rows if row]
+
+    def stat_input(self) -> tuple[int, int] | None:
+        """
+        Gets what tells if the input file changed since the last read.
+        Returns:
+            tuple[int, int] | None: The modification time (ns) and size of the input, None if it does not exist.
+        """
+        if not os.path.exists(self.input_file):
+            return None
+        stat = os.stat(self.input_file)
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self) -> list[str]:
+        """
+        Runs a normal (full) normalization and FIFO and writes the report(s).
+        Returns:
+            list[str]: The errors found in the input, nothing is kept in memory if there are any.
+        """
+        rows = self.read_input()
+        errors = run_normalization(self.input_file, self.normalized_file)
+        if errors:
+            return errors
+        self.input_header = rows[0] if rows else None
+        self.input_rows = set(rows[1:])
+        # a copy of the loaded trades, the calculator's cache is shared
+        changed = self.add_trades([dict(t) for t in self.calculator.load_trades(self.normalized_file)])
+        for asset, from_year in changed.items():
+            self.rematch(asset, from_year)
+        self.write_reports()
+        self.ready = True
+        return []
+
+    def update(self) -> list[str]:
+        """
+        Ingests the rows that are new in the input, rematches their assets and rewrites the report(s).
+        Returns:
+            list[str]: The errors found in the new rows, nothing is changed if there are any.
+        """
+        start = time.perf_counter()
+        rows = self.read_input()
+        if not rows or rows[0] != self.input_header:
+            # another header (or quotes showing up, which changes the row keys) affects every row
+            print("INFO: The input header changed, processing the whole file again.")
+            self.ready = False
+            self.input_header = None
+            self.input_rows = set()
+            self.txids = set()
+            self.position = {}
+            self.asset_trades = defaultdict(list)
+            self.asset_years = {}
+            return self.start()
+
+        # only rows that are not in the last seen input are parsed, validated and hashed
+        header = parse_row(self.input_header)
+        new_rows = [
+            (line, row_dict(header, parse_row(row)))
+            for line, row in enumerate(rows[1:], start=2) if row not in self.input_rows
+        ]
+        errors = [err for line, raw in new_rows for err in check_valid_input([raw], line)]
+        if errors:
+            print("ERROR: Errors found in the CSV file:")
+            for err in errors:
+                print(err)
+            print("WARNING: Please fix these errors, the report is updated once the file is valid.")
+            return errors
+
+        current_rows = set(rows[1:])
+        removed = len(self.input_rows - current_rows)
+        self.input_rows = current_rows
+        trades = []
+        seen = set()
+        for _, raw in new_rows:
+            key = canonical_key(raw)
+            txid = txid_from_key(key)
+            if txid in self.txids or txid in seen:
+                continue
+            trades.append(normalize_trade(raw, txid, key))
+            seen.add(txid)
+        if removed:
+            print(f"WARNING: {removed} rows were removed or changed in the input, their earlier versions stay in {self.normalized_file}")
+        if not trades:
+            print("INFO: No new trades found.")
+            return []
+
+        conn = open_txid_index(txid_index_path(self.normalized_file), self.normalized_file)
+        write_trades_normalized(trades, self.normalized_file)
+        add_txids(conn, [t["txid"] for t in trades], self.normalized_file)
+        conn.close()
+
+        # the in memory trades look like those loaded from the normalized store
+        changed = self.add_trades([{k: str(v) for k, v in t.items()} for t in trades])
+        first_year = min(self.rematch(asset, from_year) for asset, from_year in changed.items())
+        self.write_reports(first_year)
+        print(f"INFO: Added {len(trades)} new trades, matched {len(changed)} assets again from {first_year} "
+              f"in {(time.perf_counter() - start) * 1000:.0f} ms.")
+        return []
+
+    def poll(self) -> bool:
+        """
+        Checks the input file once and updates if it changed.
+        Returns:
+            bool: True if the input changed.
+        """
+        if self.stat_input() == self.input_stat:
+            return False
+        if not self.ready:
+            # the input had errors so far, start over once it changes
+            self.start()
+        else:
+            self.update()
+        return True
+
+def watch(watcher: TradeWatcher, interval: float = WATCH_INTERVAL) -> None:
+    """
+    Runs a watcher until interrupted (Ctrl+C).
+    Args:
+        watcher (TradeWatcher): The watcher of the input file.
+        interval (float): The seconds between two checks of the input file.
+    """
+    if watcher.start():
+        print("WARNING: Watching for a fixed input file.")
+    print(f"INFO: Watching {watcher.input_file} for changes (Ctrl+C to stop).")
+    try:
+        while True:
+            time.sleep(interval)
+            watcher.poll()
+    except KeyboardInterrupt:
+        print("INFO: Stopped watching.")